@@ -0,0 +1,503 @@
+import os
+import base64
+import binascii
+
+from flask import Blueprint, Response, request, jsonify
+
+from secrets_manager import history, crypto, fingerprints, layers, validation, blobs, audit, profiling, rotation, completion
+from secrets_manager.refactor import refactor_keys
+from secrets_manager.drift import check_drift
+from secrets_manager.storage import (env_path, is_valid_env_name, get_envs, list_env_level, count_keys, get_secret_value,
+                                     update_env, rollback_env)
+
+# Versioned JSON API. Every endpoint answers with JSON directly, never with a redirect.
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+class ApiError(Exception):
+    """An error reported to the client as {"error": message} with the given status code."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@api.errorhandler(ApiError)
+def handle_api_error(e):
+    return jsonify(error=e.message), e.status
+
+
+@api.errorhandler(crypto.DecryptionError)
+def handle_decryption_error(e):
+    return jsonify(error=str(e)), 500
+
+
+# --- Helpers ---
+
+def _decode(encoded_value):
+    """Decodes a stored value to text, or returns None if it is not valid Base64/UTF-8."""
+    try:
+        return base64.b64decode(encoded_value).decode('utf-8')
+    except Exception:
+        return None
+
+
+def _check_env(env, must_exist=True):
+    """Validates an env name from the URL, raising ApiError if it is invalid or missing."""
+    if not is_valid_env_name(env):
+        raise ApiError("Environment name must be alphanumeric and can contain hyphens or underscores (with '/' between levels).")
+    if must_exist and not os.path.exists(env_path(env)):
+        raise ApiError(f"Environment '{env}' not found.", 404)
+
+
+def _wants_raw():
+    """True if the client asked for the stored Base64 values (?raw=1) instead of decoded ones."""
+    return request.args.get('raw', '').lower() in ('1', 'true', 'yes')
+
+
+def _json_body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ApiError('Request body must be a JSON object.')
+    return body
+
+
+def _encode_values(values, encoded):
+    """Validates a {key: value} object from a request body and returns {key: base64_value}."""
+    if not isinstance(values, dict):
+        raise ApiError('Secrets must be given as a JSON object of key/value pairs.')
+    result = {}
+    for key, value in values.items():
+        if not key.strip():
+            raise ApiError('Secret keys cannot be empty.')
+        if not isinstance(value, str):
+            raise ApiError(f"Value for key '{key}' must be a string.")
+        if encoded:
+            try:
+                base64.b64decode(value, validate=True)
+            except (binascii.Error, ValueError):
+                raise ApiError(f"Value for key '{key}' is not valid Base64.")
+            result[key.strip()] = value
+        else:
+            result[key.strip()] = base64.b64encode(value.encode('utf-8')).decode('utf-8')
+    return result
+
+
+def _version_state(env, version):
+    """Rebuilds an env as of a version, raising ApiError(404) if there is no such version."""
+    state = history.get_version_state(env, version)
+    if state is None:
+        raise ApiError(f"Version {version} of '{env}' not found.", 404)
+    return state
+
+
+def _commit(env, upserts=None, deletes=(), replace=False):
+    """Runs a storage transaction and returns the JSON summary for it."""
+    try:
+        upserted, deleted = update_env(env, upserts, deletes, replace=replace)
+    except Exception as e:
+        print(f"Error writing CSV for env {env} via API: {e}")
+        raise ApiError(f"Error saving secrets for environment '{env}': {e}", 500)
+    return jsonify(env=env, set=upserted, deleted=deleted, version=history.current_version(env))
+
+
+# --- Endpoints ---
+
+@api.route('/envs', methods=['GET'])
+def list_envs():
+    """Lists environments with their key counts.
+
+    ?prefix=cluster/namespace limits the list to the envs under that prefix. With
+    ?shallow=1 only the level directly under it is listed, with its sub-prefixes as 'groups'.
+    """
+    prefix = request.args.get('prefix', '').strip('/')
+    if prefix and not is_valid_env_name(prefix):
+        raise ApiError(f"Invalid prefix '{prefix}'.")
+    if request.args.get('shallow', '').lower() in ('1', 'true', 'yes'):
+        envs, groups = list_env_level(prefix)
+        return jsonify(envs=[{'name': env, 'keys': count_keys(env)} for env in envs], groups=groups)
+    return jsonify(envs=[{'name': env, 'keys': count_keys(env)} for env in sorted(get_envs(prefix))])
+
+
+@api.route('/envs/<path:env>/secrets', methods=['GET'])
+def get_secrets_api(env):
+    """Returns all secrets of an env (including inherited ones), or only those named with repeated ?key= parameters."""
+    _check_env(env)
+    wanted = set(request.args.getlist('key'))
+    raw = _wants_raw()
+
+    secrets = {}
+    undecodable = []
+    for key, value, _ in layers.iter_resolved(env):
+        if wanted and key not in wanted:
+            continue
+        if not raw:
+            value = _decode(value)
+            if value is None:
+                undecodable.append(key)
+        secrets[key] = value
+
+    if wanted:
+        audit.record('read', env, sorted(secrets))
+    else:
+        audit.record_read(env)
+    response = {'env': env, 'secrets': secrets}
+    if wanted - secrets.keys():
+        response['missing'] = sorted(wanted - secrets.keys())
+    if undecodable:
+        # Returned as null; fetch them with ?raw=1 to get the stored Base64
+        response['undecodable'] = undecodable
+    return jsonify(response)
+
+
+@api.route('/envs/<path:env>/suggest', methods=['GET'])
+def suggest_keys_api(env):
+    """Lists the keys (including inherited ones) best matching ?q=, for autocompletion.
+
+    Keys starting with q come first, then keys with a word starting with it, then keys
+    holding its letters in order. ?limit= sets how many are returned (default 10, at most 50).
+    """
+    _check_env(env)
+    limit = request.args.get('limit', completion.DEFAULT_SUGGESTIONS, type=int)
+    return jsonify(env=env, keys=completion.suggest(env, request.args.get('q', ''), limit))
+
+
+@api.route('/envs/<path:env>/secrets', methods=['PATCH'])
+def patch_secrets(env):
+    """Upserts and deletes many keys in one transaction.
+
+    Body: {"set": {key: value, ...}, "delete": [key, ...], "encoded": false}.
+    With "encoded": true the values are stored as given (already Base64).
+    """
+    _check_env(env, must_exist=False)
+    body = _json_body()
+    upserts = _encode_values(body.get('set') or {}, bool(body.get('encoded')))
+    deletes = body.get('delete') or []
+    if not isinstance(deletes, list) or not all(isinstance(key, str) for key in deletes):
+        raise ApiError('"delete" must be a list of keys.')
+    if upserts.keys() & set(deletes):
+        raise ApiError('A key cannot be both set and deleted in the same request.')
+    if not os.path.exists(env_path(env)) and not upserts:
+        raise ApiError(f"Environment '{env}' not found.", 404)
+    return _commit(env, upserts, deletes)
+
+
+@api.route('/envs/<path:env>/secrets', methods=['PUT'])
+def replace_secrets(env):
+    """Replaces the whole content of an env (creating it if needed).
+
+    Body: {"secrets": {key: value, ...}, "encoded": false}.
+    """
+    _check_env(env, must_exist=False)
+    body = _json_body()
+    return _commit(env, _encode_values(body.get('secrets') or {}, bool(body.get('encoded'))), replace=True)
+
+
+@api.route('/envs/<path:env>/secrets', methods=['DELETE'])
+def delete_secrets_api(env):
+    """Deletes the keys named with repeated ?key= parameters in one transaction."""
+    _check_env(env)
+    keys = request.args.getlist('key')
+    if not keys:
+        raise ApiError('Name the keys to delete with ?key=.')
+    return _commit(env, deletes=keys)
+
+
+@api.route('/envs/<path:env>/secrets/<key>', methods=['GET'])
+def get_secret_api(env, key):
+    """Returns a single secret, with the env it is stored in as 'source'."""
+    _check_env(env)
+    resolved = layers.get_resolved_value(env, key)
+    if resolved is None:
+        raise ApiError(f"Secret '{key}' not found in '{env}'.", 404)
+    value, source = resolved
+    audit.record_read(env, key)
+    if not _wants_raw():
+        value = _decode(value)
+        if value is None:
+            raise ApiError(f"Secret '{key}' is not valid UTF-8 text; use ?raw=1.", 422)
+    return jsonify(env=env, key=key, value=value, source=source)
+
+
+@api.route('/envs/<path:env>/secrets/<key>', methods=['PUT'])
+def put_secret_api(env, key):
+    """Adds or updates a single secret. Body: {"value": "...", "encoded": false}."""
+    _check_env(env, must_exist=False)
+    body = _json_body()
+    return _commit(env, _encode_values({key: body.get('value')}, bool(body.get('encoded'))))
+
+
+@api.route('/envs/<path:env>/secrets/<key>', methods=['DELETE'])
+def delete_secret_api(env, key):
+    """Deletes a single secret."""
+    _check_env(env)
+    if get_secret_value(env, key) is None:
+        raise ApiError(f"Secret '{key}' not found in '{env}'.", 404)
+    return _commit(env, deletes=[key])
+
+
+@api.route('/envs/<path:env>/parent', methods=['GET'])
+def get_parent_api(env):
+    """Returns the env's parent and the rest of its inheritance chain."""
+    _check_env(env)
+    return jsonify(env=env, parent=layers.get_parent(env), chain=layers.parent_chain(env))
+
+
+@api.route('/envs/<path:env>/parent', methods=['PUT'])
+def set_parent_api(env):
+    """Sets or clears (null) the env's parent. Body: {"parent": "base"}."""
+    _check_env(env)
+    parent = _json_body().get('parent')
+    if parent is not None and not isinstance(parent, str):
+        raise ApiError('Parent must be an environment name or null.')
+    try:
+        layers.set_parent(env, parent or None)
+    except layers.LayerError as e:
+        raise ApiError(str(e), 409)
+    return jsonify(env=env, parent=layers.get_parent(env), chain=layers.parent_chain(env))
+
+
+@api.route('/envs/<path:env>/secrets/<key>/file', methods=['GET'])
+def get_secret_file_api(env, key):
+    """Returns the decoded bytes of a secret as application/octet-stream, decoded as they are sent."""
+    _check_env(env)
+    resolved = layers.get_resolved_value(env, key)
+    if resolved is None:
+        raise ApiError(f"Secret '{key}' not found in '{env}'.", 404)
+    encoded_value = resolved[0]
+    audit.record_read(env, key)
+    return Response(blobs.decode_chunks(encoded_value), mimetype='application/octet-stream',
+                    headers={'Content-Length': str(blobs.decoded_size(encoded_value))})
+
+
+@api.route('/envs/<path:env>/secrets/<key>/file', methods=['PUT'])
+def put_secret_file_api(env, key):
+    """Stores the raw request body (any bytes, up to 1 MiB) as a secret's value."""
+    _check_env(env, must_exist=False)
+    if not key.strip():
+        raise ApiError('Secret keys cannot be empty.')
+    try:
+        encoded_value = blobs.encode_stream(request.stream)
+    except blobs.FileTooLarge as e:
+        raise ApiError(str(e), 413)
+    return _commit(env, {key.strip(): encoded_value})
+
+
+@api.route('/envs/<path:env>/secrets/<key>/audit', methods=['GET'])
+def key_audit_api(env, key):
+    """Lists the audit entries of a secret (reads, writes and whole-env reads), newest first.
+
+    ?limit= caps the number of entries returned.
+    """
+    if not is_valid_env_name(env):
+        raise ApiError("Environment name must be alphanumeric and can contain hyphens or underscores (with '/' between levels).")
+    limit = request.args.get('limit', type=int)
+    return jsonify(env=env, key=key, entries=audit.key_history(env, key, limit=limit))
+
+
+@api.route('/envs/<path:env>/secrets/<key>/rotation', methods=['GET'])
+def get_rotation_api(env, key):
+    """Returns when a stored secret was created and last rotated, its expiry and owner (null if unknown)."""
+    _check_env(env)
+    if get_secret_value(env, key) is None:
+        raise ApiError(f"Secret '{key}' not found in '{env}'.", 404)
+    return jsonify(env=env, key=key, rotation=rotation.get_metadata(env).get(key))
+
+
+@api.route('/envs/<path:env>/secrets/<key>/rotation', methods=['PUT'])
+def set_rotation_api(env, key):
+    """Sets the expiry and/or owner of a stored secret.
+
+    Body: {"expires": "2026-12-31", "owner": "team-payments"}; null clears either, a
+    missing field leaves it unchanged.
+    """
+    _check_env(env)
+    if get_secret_value(env, key) is None:
+        raise ApiError(f"Secret '{key}' not found in '{env}'.", 404)
+    body = _json_body()
+    changes = {}
+    if 'expires' in body:
+        expires = body['expires']
+        if expires is not None and not isinstance(expires, str):
+            raise ApiError('"expires" must be an ISO date or null.')
+        try:
+            changes['expires'] = rotation.parse_expiry(expires) if expires else None
+        except ValueError as e:
+            raise ApiError(str(e))
+    if 'owner' in body:
+        if body['owner'] is not None and not isinstance(body['owner'], str):
+            raise ApiError('"owner" must be a string or null.')
+        changes['owner'] = body['owner']
+    return jsonify(env=env, key=key, rotation=rotation.set_metadata(env, key, **changes))
+
+
+@api.route('/expiring', methods=['GET'])
+def expiring_api():
+    """Lists the secrets that expired or expire soon, soonest first.
+
+    ?days= sets how far ahead to look (default 14); ?prefix= limits the list to the envs under a prefix.
+    """
+    days = request.args.get('days', rotation.EXPIRING_SOON_DAYS, type=float)
+    prefix = request.args.get('prefix', '').strip('/')
+    if prefix and not is_valid_env_name(prefix):
+        raise ApiError(f"Invalid prefix '{prefix}'.")
+    return jsonify(days=days, secrets=rotation.expiring_soon(days, prefix))
+
+
+@api.route('/envs/<path:env>/versions', methods=['GET'])
+def list_versions_api(env):
+    """Lists the versions of an env with the keys each one set or deleted."""
+    if not is_valid_env_name(env):
+        raise ApiError("Environment name must be alphanumeric and can contain hyphens or underscores (with '/' between levels).")
+    return jsonify(env=env, current=history.current_version(env), versions=history.list_versions(env))
+
+
+@api.route('/envs/<path:env>/versions/<int:version>', methods=['GET'])
+def get_version_api(env, version):
+    """Returns an env as of a version (decoded, or Base64 with ?raw=1)."""
+    _check_env(env, must_exist=False)
+    state = {key: crypto.unseal(env, key, value) for key, value in _version_state(env, version).items()}
+    audit.record('read', env, [audit.ALL_KEYS], version)
+    if not _wants_raw():
+        state = {key: _decode(value) for key, value in state.items()}
+    return jsonify(env=env, version=version, secrets=state)
+
+
+@api.route('/envs/<path:env>/versions/<int:old>/diff/<int:new>', methods=['GET'])
+def diff_versions_api(env, old, new):
+    """Lists the keys added, removed and changed between two versions, without decoding values.
+
+    Encrypted values are compared as stored; rewriting an unchanged value keeps its ciphertext.
+    """
+    _check_env(env, must_exist=False)
+    return jsonify(env=env, old=old, new=new, **history.diff_states(_version_state(env, old),
+                                                                      _version_state(env, new)))
+
+
+@api.route('/envs/<path:env>/versions/<int:version>/rollback', methods=['POST'])
+def rollback_api(env, version):
+    """Restores an env to a version. The rollback itself is recorded as a new version."""
+    _check_env(env, must_exist=False)
+    try:
+        result = rollback_env(env, version)
+    except Exception as e:
+        print(f"Error rolling back env {env} to version {version} via API: {e}")
+        raise ApiError(f"Error rolling back '{env}': {e}", 500)
+    if result is None:
+        raise ApiError(f"Version {version} of '{env}' not found.", 404)
+    return jsonify(env=env, set=result[0], deleted=result[1], version=history.current_version(env))
+
+
+@api.route('/where_used', methods=['POST'])
+def where_used_api():
+    """Lists every env and key holding a value. Body: {"value": "...", "encoded": false}.
+
+    POST keeps the value out of URLs and access logs.
+    """
+    body = _json_body()
+    encoded_value = _encode_values({'value': body.get('value')}, bool(body.get('encoded')))['value']
+    matches = fingerprints.where_used(encoded_value)
+    return jsonify(matches=[{'env': env, 'key': key} for env, key in matches])
+
+
+@api.route('/refactor', methods=['POST'])
+def refactor_api():
+    """Renames, copies or deletes keys by prefix or regex across envs, one write per env.
+
+    Body: {"operation": "rename", "prefix": "DB_PASS", "replacement": "DATABASE_PASSWORD",
+    "envs": [...], "dry_run": true}, with "regex" instead of "prefix" to match whole keys
+    by a regular expression. Without "envs", every env is changed.
+    """
+    body = _json_body()
+    mode = 'regex' if 'regex' in body else 'prefix'
+    envs = body.get('envs') or []
+    if not isinstance(envs, list) or not all(isinstance(env, str) for env in envs):
+        raise ApiError('Envs must be given as a list of environment names.')
+    try:
+        summary = refactor_keys(body.get('operation'), mode, body.get(mode) or '', body.get('replacement') or '',
+                                envs, dry_run=bool(body.get('dry_run')))
+    except ValueError as e:
+        raise ApiError(str(e))
+    return jsonify(dry_run=bool(body.get('dry_run')), **summary)
+
+
+@api.route('/drift', methods=['POST'])
+def drift_api():
+    """Compares a `kubectl get secret(s) -o yaml` dump with the stored envs and returns merge patches.
+
+    Body: {"manifest": "<yaml>", "env": "prod", "env_from": "name"}. A single Secret is
+    compared with "env" when given; otherwise each Secret is matched to an env by
+    env_from ("name" or "namespace-name").
+    """
+    body = _json_body()
+    manifest = body.get('manifest')
+    if not isinstance(manifest, str):
+        raise ApiError('The dump must be given as a string in "manifest".')
+    env = body.get('env')
+    if env is not None:
+        _check_env(env)
+    try:
+        summary = check_drift(manifest, env=env, env_from=body.get('env_from') or 'name')
+    except ValueError as e:
+        raise ApiError(str(e))
+    return jsonify(summary)
+
+
+def _check_profile_access():
+    """Only admins holding the profiling token may read profiles; without a token there are none."""
+    if profiling.token() is None:
+        raise ApiError('Profiling is not enabled.', 404)
+    if not profiling.check_token(request.headers.get(profiling.PROFILE_HEADER, '')):
+        raise ApiError(f"A valid {profiling.PROFILE_HEADER} header is required.", 403)
+
+
+@api.route('/profiles', methods=['GET'])
+def list_profiles_api():
+    """Lists the saved request profiles, newest first, without their details."""
+    _check_profile_access()
+    profiles = []
+    for profile_id in profiling.list_profiles():
+        summary = profiling.load_profile(profile_id)
+        if summary is not None:
+            profiles.append({field: summary.get(field) for field in ('id', 'time', 'method', 'path', 'status',
+                                                                     'duration', 'peak_memory')})
+    return jsonify(profiles=profiles)
+
+
+@api.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile_api(profile_id):
+    """Returns a saved profile: top functions by cumulative time and top allocation sites.
+
+    ?format=pstats returns the full cProfile data instead, for pstats or snakeviz.
+    """
+    _check_profile_access()
+    if request.args.get('format') == 'pstats':
+        path = profiling.profile_data_path(profile_id)
+        if path is None:
+            raise ApiError(f"Profile '{profile_id}' not found.", 404)
+        with open(path, 'rb') as f:
+            return Response(f.read(), mimetype='application/octet-stream',
+                            headers={'Content-Disposition': f'attachment; filename={profile_id}.prof'})
+    summary = profiling.load_profile(profile_id)
+    if summary is None:
+        raise ApiError(f"Profile '{profile_id}' not found.", 404)
+    return jsonify(summary)
+
+
+@api.route('/problems', methods=['GET'])
+def problems_api():
+    """Lists stored values that are binary or not valid Base64, across all envs.
+
+    Envs the background validator hasn't checked since their last write are listed under
+    'pending'; ask again shortly to get their results.
+    """
+    found, pending = validation.problems()
+    return jsonify(problems=found, pending=pending)
+
+
+@api.route('/envs/<path:env>/duplicates', methods=['GET'])
+def duplicates_api(env):
+    """Lists groups of keys in an env that hold the same value."""
+    _check_env(env)
+    return jsonify(env=env, duplicates=fingerprints.duplicates(env))
@@ -4,7 +4,25 @@ import base64
 import yaml
 import json
 import sys # Import sys to potentially find gunicorn
-from flask import Flask, request, redirect, url_for, render_template, Response, flash, get_flashed_messages, jsonify
+import tempfile
+import datetime
+import hashlib
+from flask import (Flask, request, redirect, url_for, render_template, stream_template, Response, jsonify,
+                   stream_with_context)
+from werkzeug.utils import secure_filename
+from secrets_manager import storage, history, crypto, fingerprints, layers, validation, blobs, feed, audit, profiling, rotation, messages, completion
+from secrets_manager.compression import compress_response
+from secrets_manager.messages import flash, get_flashed_messages
+from secrets_manager.storage import (env_path, is_valid_env_name, get_envs, list_env_level, get_keys, count_keys,
+                                     env_file_name, MAX_ENV_DEPTH,
+                                     save_secret, save_secrets, delete_secret_from_csv)
+from secrets_manager.api import api
+from secrets_manager.refactor import OPERATIONS, MATCH_MODES, refactor_keys
+from secrets_manager.drift import check_drift
+from secrets_manager.importer import ARCHIVE_EXTENSIONS, MANIFEST_EXTENSIONS, import_manifests
+from secrets_manager.mappings import ENV_MAPPINGS
+from secrets_manager.serializers import SERIALIZERS, DEFAULT_FORMAT, get_serializer
+from secrets_manager.server import gunicorn_command
 
 # Get the absolute path of the directory containing this script (app.py)
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -22,175 +40,210 @@ app = Flask(__name__,
 # Replace with a strong, randomly generated key in production
 app.secret_key = os.environ.get('SECRET_KEY', 'a_default_super_secret_key_change_me')
 
-# Directory to store environment CSV files (relative to the project root)
-# We can keep this relative as the app will be run from the project root
-envs_dir = 'envs'
+# JSON API under /api/v1
+app.register_blueprint(api)
+
+# Flashed messages are kept on the server, so the session cookie stays small
+messages.install(app)
+
+# Lets admins profile single requests on demand, when a profiling token is configured
+profiling.install(app)
+
+# Directory to store environment CSV files, shared with the storage layer
+envs_dir = storage.envs_dir
 if not os.path.exists(envs_dir):
     os.makedirs(envs_dir)
 
-# --- Helper Functions ---
+# Check stored values in the background, so pages can flag binary or invalid ones without decoding them
+validation.start()
 
-def get_envs():
-    """Lists all environment CSV files (without .csv extension) in the envs directory."""
-    # Ensure envs_dir exists before listing
-    if not os.path.exists(envs_dir):
-        return []
-    try:
-        return [f[:-4] for f in os.listdir(envs_dir) if f.endswith('.csv')]
-    except Exception as e:
-        print(f"Error listing environments: {e}")
-        flash(f"Error listing environments: {e}", 'error')
-        return []
+# Keep track of secret expiries and log those that pass
+rotation.start()
 
+# Approximate size of each chunk written while streaming an export
+EXPORT_CHUNK_SIZE = 64 * 1024
 
-def get_secrets(env):
-    """Reads secrets from the CSV file for a given environment."""
-    path = os.path.join(envs_dir, f"{env}.csv")
-    if not os.path.exists(path):
-        return []
-    secrets_list = []
-    try:
-        with open(path, newline='', encoding='utf-8') as csvfile:
-            # Use DictReader, but handle potential empty files gracefully
-            try:
-                reader = csv.DictReader(csvfile)
-                secrets_list = list(reader)
-            except csv.Error:
-                # Handle cases where the file might be empty or corrupted
-                pass # Return empty list if reading fails
-    except Exception as e:
-        print(f"Error reading CSV for env {env}: {e}")
-        flash(f"Error reading secrets for environment '{env}': {e}", 'error')
-        return [] # Return empty list on error
-    return secrets_list
-
-
-def save_secret(env, key, encoded_value):
-    """Saves or updates a secret in the CSV file for a given environment."""
-    path = os.path.join(envs_dir, f"{env}.csv")
-    entries = get_secrets(env)
-    updated = False
-    # Ensure the key is a string before comparison
-    key = str(key)
-    for row in entries:
-        # Ensure row and row.get('key') are not None before comparison
-        if row and str(row.get('key')) == key:
-            row['value'] = encoded_value
-            updated = True
-            break
-    if not updated:
-        entries.append({'key': key, 'value': encoded_value})
-
-    # Ensure the directory exists before writing
-    if not os.path.exists(envs_dir):
-        os.makedirs(envs_dir)
+# Approximate size of each chunk sent while streaming a page; small enough that the
+# browser gets the page head and first rows right away
+PAGE_CHUNK_SIZE = 16 * 1024
 
-    try:
-        # Write the updated entries back to the CSV
-        with open(path, 'w', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['key', 'value']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-            # Determine if header needs to be written
-            write_header = True
-            if os.path.exists(path):
-                if os.stat(path).st_size > 0:
-                    # File has content, check if it has a header row
-                    with open(path, 'r', newline='', encoding='utf-8') as f_check:
-                        reader_check = csv.reader(f_check)
-                        try:
-                            first_row = next(reader_check)
-                            # Check if the first row matches the expected fieldnames
-                            if first_row == fieldnames:
-                                write_header = False # Header already exists
-                        except StopIteration:
-                            pass # File is empty, header needed
-                        except Exception:
-                            # If there's an error reading the first row,
-                            # assume header might be missing or file is malformed, write header
-                            pass
-
-            if write_header:
-                 writer.writeheader()
-
-            # Only write rows if there are actual data rows with a 'key'
-            # Filter out potential empty or malformed rows before writing
-            valid_entries = [row for row in entries if row and 'key' in row]
-            if valid_entries:
-                 writer.writerows(valid_entries)
-    except Exception as e:
-         print(f"Error writing CSV for env {env}: {e}")
-         flash(f"Error saving secrets for environment '{env}': {e}", 'error')
-         pass # Continue execution but log the error
-
-
-def delete_secret_from_csv(env, key):
-    """Deletes a secret with the given key from the CSV file for an environment."""
-    path = os.path.join(envs_dir, f"{env}.csv")
-    entries = get_secrets(env)
-    initial_count = len(entries)
-    # Ensure key is a string for comparison
-    key_str = str(key)
-    # Filter out the entry with the matching key
-    updated_entries = [row for row in entries if row and str(row.get('key')) != key_str]
-    deleted_count = initial_count - len(updated_entries)
+# Values larger than this (decoded) are summarized on list pages instead of being decoded and shown
+INLINE_VALUE_MAX = 4 * 1024
 
-    if deleted_count > 0:
+# Most recent audit entries listed on a secret's access log page
+AUDIT_ENTRIES_SHOWN = 200
+
+# Secrets listed in the dashboard's expiring soon panel
+EXPIRING_SHOWN = 20
+
+# Static files requested with a content hash (?v=) never change, so browsers may keep them for a year
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# Content hashes of static files by name, with the mtime they were computed for
+_asset_hashes = {}
+
+# --- Template Filters ---
+
+@app.template_filter('datetimeformat')
+def datetimeformat(timestamp):
+    """Formats a Unix timestamp as local date and time for display."""
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+@app.template_filter('dateformat')
+def dateformat(timestamp):
+    """Formats a Unix timestamp as a local date, as used by date inputs."""
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
+
+
+@app.template_global()
+def asset_url(filename):
+    """Returns the URL of a static file with a hash of its content, which changes whenever the file does."""
+    path = os.path.join(app.static_folder, filename)
+    mtime = os.path.getmtime(path)
+    cached = _asset_hashes.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = _asset_hashes[filename] = (mtime, hashlib.sha256(f.read()).hexdigest()[:12])
+    return url_for('static', filename=filename, v=cached[1])
+
+
+# --- Response Handling ---
+
+def _coalesce(chunks, size):
+    """Joins small string chunks into pieces of about `size` characters, so streams aren't sent in dribbles."""
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _stream_page(template_name, **context):
+    """Renders a template as it is sent, so the first bytes leave before the last rows are rendered."""
+    # Flashed messages must be taken from the session now; once streaming starts, the
+    # session cookie has already been sent and could no longer be updated
+    get_flashed_messages(with_categories=True)
+    return Response(_coalesce(stream_template(template_name, **context), PAGE_CHUNK_SIZE), mimetype='text/html')
+
+
+def _value_summary(encoded_value, status, size):
+    """Describes a value that isn't shown as is, e.g. 'PEM, 3243 bytes'."""
+    kind = blobs.describe(encoded_value) or ('text' if status == validation.TEXT else 'binary data')
+    return f"{kind}, {size} bytes"
+
+
+def _decoded_rows(env):
+    """Yields {'key', 'value', 'source', 'status', 'size', 'summary'} dicts with decoded values for an env, one row at a time.
+
+    Keys inherited from a parent env are included; 'source' names the env that stores them.
+    Binary and large values are not decoded: 'summary' describes them instead. Values the
+    background validator found not to be valid Base64 are flagged without decoding them;
+    'status' is None for values it hasn't checked yet.
+    """
+    statuses = {} # source env -> {key: status} from the validator
+    for key, encoded_val, source in layers.iter_resolved(env):
+        if source not in statuses:
+            statuses[source] = validation.statuses(source) or {}
+        row = {'key': key, 'source': source, 'status': None, 'size': None, 'summary': None}
+        row.update(statuses[source].get(key, {}))
+        if row['status'] == validation.INVALID:
+            yield dict(row, value='[Invalid base64 or decoding error]')
+            continue
+        if row['size'] is None:
+            row['size'] = blobs.decoded_size(encoded_val)
+        if row['status'] == validation.BINARY or row['size'] > INLINE_VALUE_MAX:
+            summary = _value_summary(encoded_val, row['status'], row['size'])
+            yield dict(row, value=summary, summary=summary)
+            continue
         try:
-            # Write the remaining entries back to the CSV
-            with open(path, 'w', newline='', encoding='utf-8') as csvfile:
-                fieldnames = ['key', 'value']
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-
-                # Always write header if there are entries remaining, or if the file was non-empty initially
-                write_header = True
-                if not updated_entries and initial_count == 0:
-                    write_header = False # File was empty and remains empty
-                elif updated_entries:
-                    # Check if the file was empty initially but now has entries, or if it had a header
-                    if initial_count == 0 or (initial_count > 0 and 'key' in entries[0]):
-                        write_header = True # Write header if adding first entry or if header existed
-                    else:
-                         write_header = False # Header likely didn't exist or file was malformed
-                elif initial_count > 0: # File was not empty, but now is after deletion
-                     # Check if the file had a header initially
-                     with open(path, 'r', newline='', encoding='utf-8') as f_check:
-                        reader_check = csv.reader(f_check)
-                        try:
-                            first_row = next(reader_check)
-                            if first_row == fieldnames:
-                                write_header = True # Header existed, write it even if file is empty
-                        except StopIteration:
-                            pass # File is empty, no header needed
-                        except Exception:
-                            pass # Assume header needed on error
-
-
-                if write_header:
-                     writer.writeheader()
-
-                if updated_entries:
-                     writer.writerows(updated_entries)
-
-            return deleted_count # Return number of deleted items (should be 1 if found)
-        except Exception as e:
-            print(f"Error writing CSV after deleting secret for env {env}: {e}")
-            flash(f"Error saving changes after deleting secret '{key}' in '{env}': {e}", 'error')
-            return 0 # Indicate deletion failed due to save error
-    else:
-        # Key not found
-        return 0
+            # Decode base64 value for display
+            yield dict(row, value=base64.b64decode(encoded_val).decode('utf-8'))
+        except Exception:
+            # Handle potential decoding errors; not validated yet, so classify it now
+            status, size = validation.classify(encoded_val)
+            if status == validation.BINARY:
+                summary = _value_summary(encoded_val, status, size)
+                yield dict(row, value=summary, status=status, size=size, summary=summary)
+            else:
+                yield dict(row, value='[Invalid base64 or decoding error]', status=status, size=size)
+
+
+@app.after_request
+def finish_response(response):
+    """Sets long cache lifetimes on hashed static URLs and compresses text responses."""
+    if request.endpoint == 'static' and request.args.get('v'):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return compress_response(request, response)
+
+
+# --- Error Handlers ---
+
+@app.errorhandler(crypto.DecryptionError)
+def handle_decryption_error(e):
+    """Reports encrypted values that cannot be read (e.g. a wrong master secret)."""
+    print(f"Decryption error: {e}")
+    flash(str(e), 'error')
+    return redirect(url_for('index'))
 
 
 # --- Flask Routes ---
 
+def _env_tree_level(prefix=''):
+    """Describes one level of the env tree for the dashboard's lazy tree view."""
+    envs, groups = list_env_level(prefix)
+    start = len(prefix) + 1 if prefix else 0
+    return {
+        'prefix': prefix,
+        # Key counts come from the key-only scan, so values are never parsed here
+        'envs': [{'name': e, 'label': e[start:], 'keys': count_keys(e), 'parent': layers.get_parent(e)}
+                 for e in envs],
+        'groups': [{'prefix': g, 'label': g[start:]} for g in groups],
+    }
+
+
 @app.route('/', methods=['GET'])
 def index():
     """Renders the main index page."""
-    envs = get_envs()
+    # Only the top level of the env tree is listed; deeper levels are fetched from /env_tree
+    tree = _env_tree_level()
+    has_envs = bool(tree['envs'] or tree['groups'])
     selected_env = request.args.get('env') if 'env' in request.args else None
+    parent = layers.get_parent(selected_env) if selected_env and is_valid_env_name(selected_env) else None
     # Pass flashed messages to the template (handled in base.html)
-    return render_template('index.html', envs=envs, selected_env=selected_env)
+    return render_template('index.html', tree=tree, has_envs=has_envs, selected_env=selected_env,
+                           parent=parent, export_formats=SERIALIZERS.values(), default_format=DEFAULT_FORMAT,
+                           refactor_operations=OPERATIONS, refactor_modes=MATCH_MODES,
+                           expiring=rotation.expiring_soon()[:EXPIRING_SHOWN],
+                           expiring_days=rotation.EXPIRING_SOON_DAYS)
+
+
+@app.route('/env_tree', methods=['GET'])
+def env_tree():
+    """Returns the envs and groups directly under ?prefix= as JSON, for expanding the tree view."""
+    prefix = request.args.get('prefix', '').strip('/')
+    if prefix and not is_valid_env_name(prefix):
+        return jsonify(error=f"Invalid prefix '{prefix}'."), 400
+    return jsonify(_env_tree_level(prefix))
+
+
+@app.route('/key_suggestions', methods=['GET'])
+def key_suggestions():
+    """Returns the keys of ?env= (including inherited ones) best matching ?q= as JSON, for the key box."""
+    env = request.args.get('env', '')
+    if not is_valid_env_name(env):
+        return jsonify(error=f"Invalid environment '{env}'."), 400
+    limit = request.args.get('limit', completion.DEFAULT_SUGGESTIONS, type=int)
+    return jsonify(completion.suggest(env, request.args.get('q', ''), limit))
 
 
 @app.route('/select_env', methods=['POST'])
@@ -202,22 +255,27 @@ def select_env():
         return redirect(url_for('index'))
 
     # Basic validation for environment name
-    if not env.replace('-', '').replace('_', '').isalnum():
-         flash('Environment name must be alphanumeric and can contain hyphens or underscores.', 'warning')
+    if not is_valid_env_name(env):
+         flash('Environment name must be alphanumeric and can contain hyphens or underscores, '
+               f"optionally as a path of up to {MAX_ENV_DEPTH} levels (e.g. cluster/namespace/secret).", 'warning')
          return redirect(url_for('index'))
 
 
-    path = os.path.join(envs_dir, f"{env}.csv")
+    path = env_path(env)
     # Create the CSV file if it doesn't exist, add header
     if not os.path.exists(path):
-        # Ensure directory exists
-        if not os.path.exists(envs_dir):
-             os.makedirs(envs_dir)
+        # Ensure the directory (and, for hierarchical names, its parent levels) exists
+        os.makedirs(os.path.dirname(path), exist_ok=True)
         try:
             with open(path, 'w', newline='', encoding='utf-8') as csvfile:
                 writer = csv.DictWriter(csvfile, fieldnames=['key', 'value'])
                 writer.writeheader()
             flash(f"Environment '{env}' created successfully.", 'success')
+            parent = request.form.get('parent', '').strip()
+            if parent:
+                # The new env starts out empty and inherits everything from its parent
+                layers.set_parent(env, parent)
+                flash(f"'{env}' inherits from '{parent}'.", 'info')
         except Exception as e:
             print(f"Error creating CSV for new env {env}: {e}")
             flash(f"Error creating environment '{env}': {e}", 'error')
@@ -239,17 +297,17 @@ def delete_env():
         flash('No environment specified for deletion.', 'warning')
         return redirect(url_for('index'))
 
-    path = os.path.join(envs_dir, f"{env}.csv")
-
-    if os.path.exists(path):
-        try:
-            os.remove(path)
+    try:
+        # The env's version history is kept, so a deleted env can still be rolled back
+        if storage.delete_env(env):
             flash(f"Environment '{env}' deleted successfully.", 'success')
-        except Exception as e:
-            print(f"Error deleting environment file {path}: {e}")
-            flash(f"Error deleting environment '{env}': {e}", 'error')
-    else:
-        flash(f"Environment '{env}' not found.", 'warning')
+        else:
+            flash(f"Environment '{env}' not found.", 'warning')
+    except layers.LayerError as e:
+        flash(str(e), 'warning')
+    except Exception as e:
+        print(f"Error deleting environment file {env_path(env)}: {e}")
+        flash(f"Error deleting environment '{env}': {e}", 'error')
 
     # Redirect back to the index page (without a selected environment)
     return redirect(url_for('index'))
@@ -324,23 +382,120 @@ def show():
          flash('Environment or Key not specified.', 'warning')
          return redirect(url_for('index'))
 
-    secrets = get_secrets(env)
     decoded = None
-    found = False
-    # Ensure key is a string for consistent comparison
-    key_str = str(key)
-    for row in secrets:
-        if str(row.get('key')) == key_str:
-            found = True
-            try:
-                # Decode base64 value
-                decoded = base64.b64decode(row.get('value', '')).decode('utf-8')
-            except Exception:
-                 decoded = '[Invalid base64 or decoding error]' # Handle potential decoding errors
-            break
+    source = None
+    status = None
+    metadata = None
+    # Only the requested value is read (from the env or the nearest parent that has it)
+    resolved = layers.get_resolved_value(env, key)
+    found = resolved is not None
+    if found:
+        encoded_value, source = resolved
+        audit.record_read(env, key)
+        status = (validation.statuses(source) or {}).get(key)
+        if status is None:
+            # Not validated yet; classifying it is as cheap as decoding it
+            status_name, size = validation.classify(encoded_value)
+            status = {'status': status_name, 'size': size}
+        if status['status'] == validation.TEXT:
+            decoded = base64.b64decode(encoded_value).decode('utf-8')
+        elif status['status'] == validation.BINARY:
+            # Binary values are downloaded instead of shown
+            status['summary'] = _value_summary(encoded_value, status['status'], status['size'])
+        else:
+             decoded = '[Invalid base64 or decoding error]' # Not Base64 at all
+        metadata = rotation.get_metadata(source).get(key)
 
     # Render the show.html template
-    return render_template('show.html', env=env, key=key, decoded=decoded, found=found)
+    return render_template('show.html', env=env, key=key, decoded=decoded, found=found, source=source,
+                           status=status, metadata=metadata, now=datetime.datetime.now().timestamp())
+
+
+@app.route('/set_rotation', methods=['POST'])
+def set_rotation():
+    """Sets the expiry date and owner of a secret stored in an environment."""
+    env = request.form.get('env')
+    key = request.form.get('key')
+    if not env or not key:
+        flash('Environment or Key not specified for setting the rotation details.', 'warning')
+        return redirect(url_for('index'))
+
+    expires = request.form.get('expires', '').strip()
+    owner = request.form.get('owner', '').strip()
+    try:
+        if not storage.has_key(env, key):
+            flash(f"Secret '{key}' not found in '{env}'; set the rotation details where it is stored.", 'warning')
+            return redirect(url_for('show', env=env, key=key))
+        rotation.set_metadata(env, key, expires=rotation.parse_expiry(expires) if expires else None, owner=owner)
+        flash(f"Rotation details of '{key}' in '{env}' updated.", 'success')
+    except ValueError as e:
+        flash(str(e), 'warning')
+    except Exception as e:
+        print(f"Error setting the rotation details of key {key} in env {env}: {e}")
+        flash(f"Error setting the rotation details of '{key}': {e}", 'error')
+
+    return redirect(url_for('show', env=env, key=key))
+
+
+@app.route('/upload_secret', methods=['POST'])
+def upload_secret():
+    """Stores an uploaded file (e.g. a keystore or certificate bundle) as the value of a secret."""
+    env = request.form.get('env')
+    key = request.form.get('key', '').strip()
+    upload = request.files.get('file')
+
+    if not env or not is_valid_env_name(env):
+        flash('Environment not specified for uploading a secret.', 'warning')
+        return redirect(url_for('index'))
+    if not key:
+        flash('Secret key cannot be empty.', 'warning')
+        return redirect(url_for('index', env=env))
+    if not upload or not upload.filename:
+        flash('No file uploaded.', 'warning')
+        return redirect(url_for('index', env=env))
+
+    try:
+        # Encoded a chunk at a time straight from the upload, which Werkzeug spools to disk when large
+        encoded = blobs.encode_stream(upload.stream)
+        save_secret(env, key, encoded)
+        flash(f"File '{upload.filename}' ({blobs.decoded_size(encoded)} bytes) saved as secret '{key}' in '{env}'.",
+              'success')
+    except blobs.FileTooLarge as e:
+        flash(f"Could not save '{upload.filename}': {e}", 'warning')
+    except Exception as e:
+        print(f"Error saving uploaded file as secret: {e}")
+        flash(f"Error saving '{upload.filename}' as secret '{key}': {e}", 'error')
+
+    return redirect(url_for('index', env=env))
+
+
+@app.route('/download_secret', methods=['GET'])
+def download_secret():
+    """Sends the decoded value of a secret as a file, decoding it as it is sent."""
+    env = request.args.get('env')
+    key = request.args.get('key')
+    if not env or not key:
+         flash('Environment or Key not specified.', 'warning')
+         return redirect(url_for('index'))
+
+    resolved = layers.get_resolved_value(env, key)
+    if resolved is None:
+        flash(f"Secret '{key}' not found in '{env}'.", 'warning')
+        return redirect(url_for('index', env=env))
+    encoded_value = resolved[0]
+    if validation.classify(encoded_value[:blobs.DOWNLOAD_CHUNK_SIZE])[0] == validation.INVALID:
+        flash(f"Secret '{key}' is not valid Base64 and cannot be downloaded.", 'warning')
+        return redirect(url_for('show', env=env, key=key))
+    audit.record_read(env, key)
+
+    return Response(
+        blobs.decode_chunks(encoded_value),
+        mimetype='application/octet-stream',
+        headers={
+            'Content-Disposition': f'attachment; filename={secure_filename(key) or "secret"}',
+            'Content-Length': str(blobs.decoded_size(encoded_value)),
+        }
+    )
 
 
 @app.route('/show_all', methods=['GET'])
@@ -351,20 +506,55 @@ def show_all():
          flash('Environment not specified for showing all secrets.', 'warning')
          return redirect(url_for('index'))
 
-    secrets = get_secrets(env)
-    decoded_list = []
-    for row in secrets:
-        key = str(row.get('key', ''))
-        encoded_val = str(row.get('value', ''))
-        try:
-            # Decode base64 value for display
-            decoded_list.append({'key': key, 'value': base64.b64decode(encoded_val).decode('utf-8')})
-        except Exception:
-            # Handle potential decoding errors
-            decoded_list.append({'key': key, 'value': '[Invalid base64 or decoding error]'})
+    # Taken before the rows are read, so the page's change feed also replays writes made while it renders
+    feed_position = feed.current_position(env)
+    parent = layers.get_parent(env)
+    key_count = len(layers.resolved_view(env)) if parent else count_keys(env)
+    if key_count:
+        # Reading one value up front reports a wrong master secret before the page starts streaming
+        next(layers.iter_resolved(env), None)
 
-    # Render the show_all.html template
-    return render_template('show_all.html', env=env, decoded_list=decoded_list)
+    try:
+        duplicates = fingerprints.duplicates(env)
+    except Exception as e:
+        print(f"Error reading the fingerprint index for env {env}: {e}")
+        duplicates = []
+
+    audit.record_read(env)
+    # Stream the show_all.html template; rows are read and decoded as the table is sent
+    return _stream_page('show_all.html', env=env, secrets=_decoded_rows(env), key_count=key_count,
+                        parent=parent, duplicates=duplicates, feed_position=feed_position)
+
+
+@app.route('/changes', methods=['GET'])
+def env_changes():
+    """Streams the changes to an environment as Server-Sent Events, so open pages can patch their rows.
+
+    Resumes after the position in the Last-Event-ID header (sent by a reconnecting browser)
+    or in ?since=.
+    """
+    env = request.args.get('env')
+    if not env or not is_valid_env_name(env) or not os.path.exists(env_path(env)):
+        return jsonify(error=f"Environment '{env}' not found."), 404
+    if not feed.acquire_stream():
+        # Every stream slot of this worker is taken; the page falls back to /changes/poll
+        return jsonify(error='Too many open change feeds; poll /changes/poll instead.'), 503
+    since = feed.parse_position(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    response = Response(feed.stream(env, since), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Called by the server once the stream ends or the client goes away, even if it never started
+    response.call_on_close(feed.release_stream)
+    return response
+
+
+@app.route('/changes/poll', methods=['GET'])
+def env_changes_poll():
+    """Returns the changes to an environment after ?since= as JSON, for pages that can't keep a feed open."""
+    env = request.args.get('env')
+    if not env or not is_valid_env_name(env) or not os.path.exists(env_path(env)):
+        return jsonify(error=f"Environment '{env}' not found."), 404
+    events, position = feed.poll_changes(env, feed.parse_position(request.args.get('since')))
+    return jsonify(events=events, position=position)
 
 
 @app.route('/update_all', methods=['POST'])
@@ -378,56 +568,63 @@ def update_all():
          flash('Environment not specified for updating secrets.', 'warning')
          return redirect(url_for('index'))
 
-    # Iterate through the submitted keys and values
-    updated_count = 0
+    # Encode the submitted values, skipping any that fail
+    updates = {}
+    failed = []
     for key, val in zip(keys, values):
         try:
             # Base64 encode the new value before saving
-            encoded = base64.b64encode(val.encode('utf-8')).decode('utf-8')
-            save_secret(env, key, encoded)
-            updated_count += 1
+            updates[key] = base64.b64encode(val.encode('utf-8')).decode('utf-8')
         except Exception as e:
-            print(f"Error encoding or saving secret for key {key}: {e}")
-            flash(f"Error updating secret '{key}': {e}", 'error')
-            # Continue processing other secrets, but consider logging or user feedback
+            print(f"Error encoding secret for key {key}: {e}")
+            failed.append(f"{key}: {e}")
+            # Continue processing other secrets; they are reported together below
+
+    # Only changed values are saved, so inherited keys left as they are don't become overrides
+    current = {key: encoded for key, encoded, _ in layers.iter_resolved(env)}
+    updates = {key: encoded for key, encoded in updates.items() if current.get(key) != encoded}
+
+    # Save all values with a single write of the env file
+    updated_count = len(updates) if updates and save_secrets(env, updates) else 0
 
     if updated_count > 0:
         flash(f"Successfully updated {updated_count} secret(s) in '{env}'.", 'success')
+    if failed:
+        flash(f"Could not update {len(failed)} secret(s) in '{env}'.", 'error', details=failed)
 
     # Redirect back to the show_all page for the environment
     return redirect(url_for('show_all', env=env))
 
 
+def _export_rows(env):
+    """Yields (key, encoded_value) pairs of an env including inherited keys, as exports need them."""
+    for key, encoded_value, _ in layers.iter_resolved(env):
+        yield key, encoded_value
+
+
 @app.route('/export', methods=['GET'])
 def export_env():
-    """Exports secrets in a Kubernetes Secret YAML data block format."""
+    """Exports secrets in the format selected with ?format= (a Kubernetes Secret YAML data block by default)."""
     env = request.args.get('env')
     if not env:
          flash('Environment not specified for export.', 'warning')
          return redirect(url_for('index'))
 
 
-    secrets = get_secrets(env)
-    # Export in a format similar to kubectl get secret -o yaml data block
-    lines = ['data:']
-    if not secrets:
-        # Add a comment if no secrets are present
-        lines.append('  # No secrets defined for this environment')
-
-    for row in secrets:
-        # Ensure key and value are treated as strings for the YAML export format
-        key = str(row.get('key', ''))
-        encoded_value = str(row.get('value', ''))
-        # Use YAML-like indentation
-        lines.append(f"  {key}: {encoded_value}")
-    content = '\n'.join(lines)
+    export_format = request.args.get('format', DEFAULT_FORMAT)
+    serializer = get_serializer(export_format)
+    if serializer is None:
+        flash(f"Unknown export format '{export_format}'.", 'warning')
+        return redirect(url_for('index', env=env))
 
-    # Return as a plain text response with a .yaml filename
+    audit.record_read(env, op='export')
+    # Stream the document as it is serialized, coalescing the serializer's small per-row
+    # chunks into larger writes, with a download filename for the format
     return Response(
-        content,
-        mimetype='text/plain',
+        stream_with_context(_coalesce(serializer.func(env, _export_rows(env)), EXPORT_CHUNK_SIZE)),
+        mimetype=serializer.mimetype,
         headers={
-            'Content-Disposition': f'attachment; filename={env}_secrets.yaml'
+            'Content-Disposition': f'attachment; filename={serializer.filename.format(env=env_file_name(env))}'
         }
     )
 
@@ -512,35 +709,208 @@ def bulk_confirm():
         flash("Error decoding bulk data for confirmation.", 'error')
         return redirect(url_for('index', env=env))
 
-    # Iterate through the keys and original encoded values from the parsed YAML
-    imported_count = 0
-    skipped_count = 0
+    # Collect the keys and original encoded values from the parsed YAML
+    to_save = {}
+    skipped = []
     for key, val in data.items():
          # Ensure key is string and val is string before saving
         if isinstance(val, str):
-             try:
-                 save_secret(env, str(key), val)
-                 imported_count += 1
-             except Exception as e:
-                 print(f"Error saving secret for key '{key}' during bulk_confirm: {e}")
-                 flash(f"Error saving secret '{key}' during bulk import: {e}", 'error')
-                 # Continue but count as skipped due to save error
-                 skipped_count += 1
+             to_save[str(key)] = val
         else:
              print(f"Warning: Skipping non-string value for key '{key}' during bulk_confirm.")
-             flash(f"Skipped key '{key}' with non-string value during bulk import.", 'warning')
-             skipped_count += 1
+             skipped.append(f"{key}: non-string value")
+    skipped_count = len(skipped)
+
+    # Save everything with a single write of the env file
+    imported_count = 0
+    if to_save:
+        if save_secrets(env, to_save):
+            imported_count = len(to_save)
+        else:
+            # Count as skipped due to save error
+            skipped_count += len(to_save)
+            skipped.append(f"{len(to_save)} key(s) not saved because writing the environment failed")
 
     if imported_count > 0:
         flash(f"Successfully imported/updated {imported_count} secret(s) in '{env}'.", 'success')
     if skipped_count > 0:
-         flash(f"Skipped {skipped_count} key(s) due to errors or non-string values.", 'warning')
+         flash(f"Skipped {skipped_count} key(s) due to errors or non-string values.", 'warning', details=skipped)
 
 
     # Redirect back to the index page with the environment selected
     return redirect(url_for('index', env=env))
 
 
+@app.route('/drift_check', methods=['POST'])
+def drift_check():
+    """Compares pasted `kubectl get secret -o yaml` output with the stored env(s) and shows a patch plan.
+
+    A single Secret (or a bare data block) is compared with the selected env; a dump of
+    many Secrets is matched to envs by Secret name.
+    """
+    env = request.form.get('env')
+    bulk_text = request.form.get('bulk', '')
+
+    try:
+        summary = check_drift(bulk_text, env=env or None)
+    except Exception as e:
+        print(f"Error checking drift for env {env}: {e}")
+        flash(f"Error checking drift: {e}", 'error')
+        return redirect(url_for('index', env=env))
+
+    return render_template('drift_review.html', env=env, summary=summary)
+
+
+@app.route('/import_manifests', methods=['POST'])
+def import_manifests_upload():
+    """Imports an uploaded archive (or single file) of Kubernetes Secret manifests into envs."""
+    upload = request.files.get('manifests')
+    env_from = request.form.get('env_from', 'name')
+
+    if not upload or not upload.filename:
+        flash('No manifest file or archive uploaded.', 'warning')
+        return redirect(url_for('index'))
+    if env_from not in ENV_MAPPINGS:
+        flash(f"Unknown env mapping '{env_from}'.", 'warning')
+        return redirect(url_for('index'))
+
+    filename = os.path.basename(upload.filename).lower()
+    if not filename.endswith(ARCHIVE_EXTENSIONS + MANIFEST_EXTENSIONS):
+        flash('Upload a .tar, .tar.gz, .tgz or .zip archive, or a single .yaml/.yml/.json manifest.', 'warning')
+        return redirect(url_for('index'))
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Keep the original extension so the importer can tell archives from manifests
+            upload_path = os.path.join(tmp_dir, filename)
+            upload.save(upload_path)
+            summary = import_manifests(upload_path, env_from=env_from)
+    except Exception as e:
+        print(f"Error importing manifests from {upload.filename}: {e}")
+        flash(f"Error importing manifests: {e}", 'error')
+        return redirect(url_for('index'))
+
+    if summary['errors']:
+        flash(f"{len(summary['errors'])} problem(s) found.", 'warning', details=summary['errors'])
+    flash(f"Imported {summary['secrets']} Secret(s) from {summary['files']} file(s) "
+          f"into {len(summary['envs'])} environment(s).", 'success' if summary['envs'] else 'info')
+
+    return redirect(url_for('index'))
+
+
+@app.route('/refactor', methods=['POST'])
+def refactor():
+    """Previews renaming, copying or deleting keys by prefix or regex across environments, or applies it.
+
+    The form is first posted without 'apply' to get a dry-run preview with the changes per
+    env; the preview page posts it again with apply=1.
+    """
+    operation = request.form.get('operation', 'rename')
+    mode = request.form.get('mode', 'prefix')
+    pattern = request.form.get('pattern', '')
+    replacement = request.form.get('replacement', '')
+    # Comma or space separated; 'prefix/' stands for every env under it, and none means all
+    envs = [env for field in request.form.getlist('envs') for env in field.replace(',', ' ').split()]
+    apply = request.form.get('apply') == '1'
+
+    try:
+        summary = refactor_keys(operation, mode, pattern, replacement, envs, dry_run=not apply)
+    except ValueError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('index'))
+
+    if not apply:
+        return render_template('refactor_review.html', summary=summary, operation=operation, mode=mode,
+                               pattern=pattern, replacement=replacement, envs=envs)
+
+    if summary['errors']:
+        flash(f"{len(summary['errors'])} problem(s) found.", 'warning', details=summary['errors'])
+    verb = {'rename': 'Renamed', 'copy': 'Copied', 'delete': 'Deleted'}[operation]
+    flash(f"{verb} {summary['keys']} key(s) in {len(summary['envs'])} environment(s).",
+          'success' if summary['envs'] else 'info')
+    return redirect(url_for('index'))
+
+
+@app.route('/set_parent', methods=['POST'])
+def set_parent():
+    """Makes an environment inherit from another one, or stop inheriting."""
+    env = request.form.get('env')
+    parent = request.form.get('parent', '').strip() or None
+    if not env:
+        flash('Environment not specified for setting a parent.', 'warning')
+        return redirect(url_for('index'))
+
+    try:
+        layers.set_parent(env, parent)
+        if parent:
+            flash(f"'{env}' now inherits from '{parent}'. Its own keys override the inherited ones.", 'success')
+        else:
+            flash(f"'{env}' no longer inherits from another environment.", 'success')
+    except layers.LayerError as e:
+        flash(str(e), 'warning')
+    except Exception as e:
+        print(f"Error setting the parent of env {env}: {e}")
+        flash(f"Error setting the parent of '{env}': {e}", 'error')
+
+    return redirect(url_for('index', env=env))
+
+
+@app.route('/audit', methods=['GET'])
+def key_audit():
+    """Lists who read or changed a secret, newest first."""
+    env = request.args.get('env')
+    key = request.args.get('key')
+    if not env or not key:
+         flash('Environment or Key not specified.', 'warning')
+         return redirect(url_for('index'))
+    return render_template('audit.html', env=env, key=key,
+                           entries=audit.key_history(env, key, limit=AUDIT_ENTRIES_SHOWN))
+
+
+@app.route('/problems', methods=['GET'])
+def problems():
+    """Lists the stored values across all environments that are binary or not valid Base64."""
+    found, pending = validation.problems()
+    return render_template('problems.html', problems=found, pending=pending)
+
+
+@app.route('/history', methods=['GET'])
+def env_history():
+    """Renders the version history of an environment."""
+    env = request.args.get('env')
+    if not env:
+         flash('Environment not specified for showing history.', 'warning')
+         return redirect(url_for('index'))
+
+    # Newest first; only key names are shown, so no values are rebuilt or decoded
+    versions = list(reversed(history.list_versions(env)))
+    return _stream_page('history.html', env=env, versions=versions, current_version=history.current_version(env))
+
+
+@app.route('/rollback', methods=['POST'])
+def rollback():
+    """Restores an environment to an earlier version."""
+    env = request.form.get('env')
+    version = request.form.get('version', type=int)
+
+    if not env or version is None:
+        flash('Environment or version not specified for rollback.', 'warning')
+        return redirect(url_for('index'))
+
+    try:
+        result = storage.rollback_env(env, version)
+        if result is None:
+            flash(f"Version {version} of '{env}' not found.", 'warning')
+        else:
+            flash(f"Rolled '{env}' back to version {version} "
+                  f"({result[0]} secret(s) restored, {result[1]} removed).", 'success')
+    except Exception as e:
+        print(f"Error rolling back env {env} to version {version}: {e}")
+        flash(f"Error rolling back '{env}': {e}", 'error')
+
+    return redirect(url_for('env_history', env=env))
+
+
 @app.route('/search_other_envs', methods=['GET'])
 def search_other_envs():
     """Searches for a key in environments other than the current one."""
@@ -558,43 +928,44 @@ def search_other_envs():
         if env == current_env:
             continue
 
-        secrets = get_secrets(env)
-        for secret in secrets:
-            key = str(secret.get('key', '')).lower()
-            # Search only by key for simplicity in this endpoint
-            if search_term in key:
-                found_in_envs.append(env)
-                break # Found in this environment, no need to check other secrets in it
+        # Search only by key for simplicity in this endpoint, so values are never read
+        if any(search_term in key.lower() for key in get_keys(env)):
+            found_in_envs.append(env)
 
     # Return unique environment names
     return jsonify(list(set(found_in_envs)))
 
+@app.route('/where_used', methods=['POST'])
+def where_used():
+    """Lists every env and key holding a value, looked up in the fingerprint index."""
+    # Posted rather than passed in the URL so the value doesn't end up in logs or history
+    value = request.form.get('value', '')
+    if not value:
+        flash('Enter a value to look up.', 'warning')
+        return redirect(url_for('index'))
+
+    try:
+        matches = fingerprints.where_used(base64.b64encode(value.encode('utf-8')).decode('utf-8'))
+    except Exception as e:
+        print(f"Error looking up value in the fingerprint index: {e}")
+        flash(f"Error looking up the value: {e}", 'error')
+        return redirect(url_for('index'))
+
+    return render_template('where_used.html', matches=matches)
+
 # --- New function to run the server ---
+
 def run_server():
     """Runs the application using Gunicorn."""
     # This function will be the entry point for the script
-    # We'll use gunicorn's command line interface via subprocess or os.execv
-    # A simpler way for setuptools scripts is to just point to a function
-    # that starts the WSGI server. Gunicorn can be started programmatically.
-
-    # Find the gunicorn executable in the virtual environment
-    gunicorn_executable = os.path.join(sys.prefix, 'Scripts', 'gunicorn.exe') if sys.platform == "win32" else os.path.join(sys.prefix, 'bin', 'gunicorn')
+    command = gunicorn_command()
+    gunicorn_executable = command[0]
 
     if not os.path.exists(gunicorn_executable):
         print("Error: gunicorn executable not found in the virtual environment.")
         print("Please ensure gunicorn is installed (uv add gunicorn or pip install gunicorn)")
         sys.exit(1)
 
-    # Command and arguments for gunicorn
-    # We pass the module path 'secrets_manager.app'
-    # Gunicorn will find the 'app' object within that module
-    command = [
-        gunicorn_executable,
-        '--workers', '3', # Number of worker processes
-        '--bind', '127.0.0.1:5000', # Bind to localhost on port 5000
-        'secrets_manager.app:app' # Module:app object
-    ]
-
     print(f"Starting Gunicorn server with command: {' '.join(command)}")
     # Replace the current process with the gunicorn process
     os.execv(gunicorn_executable, command)
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import atexit
+import sys
+import getpass
+import threading
+
+# Audit log of every decoded read and every write, kept in envs/.audit/:
+#   <NNNNNN>.log        JSON lines {"time", "op", "env", "key", "version", "remote_addr", "user"};
+#                       the highest number is appended to, older ones are never changed
+#   index/<env>.jsonl   one [key, segment, offset] line per entry of the env, so the history
+#                       of a key reads only that env's index and the matching log lines
+# Operations: 'read' (a decoded value was shown or sent), 'export', 'set', 'delete'.
+# Reads and exports of a whole env are logged once with key '*'.
+
+# A new log segment is started once the current one reaches this size
+MAX_SEGMENT_SIZE = 10 * 1024 * 1024
+
+# Oldest segments beyond this many are removed (with their index entries)
+MAX_SEGMENTS = 50
+
+# Entries are written by a background thread at most this long after they were recorded,
+# or sooner once this many are waiting
+FLUSH_INTERVAL = 1.0
+FLUSH_BATCH = 500
+
+ALL_KEYS = '*'
+
+_buffer = []
+_buffer_lock = threading.Condition()
+_flusher = None
+# Local user of a script, looked up once
+_user = None
+
+
+def _storage():
+    # Imported lazily because the storage layer imports this module
+    from secrets_manager import storage
+    return storage
+
+
+def _audit_dir():
+    return os.path.join(_storage().envs_dir, '.audit')
+
+
+def _segment_path(segment):
+    return os.path.join(_audit_dir(), f"{segment:06d}.log")
+
+
+def _index_path(env):
+    return os.path.join(_audit_dir(), 'index', f"{_storage().env_file_name(env)}.jsonl")
+
+
+def _segments():
+    try:
+        names = os.listdir(_audit_dir())
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-4]) for name in names if name.endswith('.log') and name[:-4].isdigit())
+
+
+def _actor():
+    """Returns (remote_addr, user): the client of a web request, or the local user of a script."""
+    # Like storage._flash_error(), Flask is only asked when the app already loaded it,
+    # so the CLI doesn't pay for importing it
+    if 'flask' in sys.modules:
+        from flask import has_request_context, request
+        if has_request_context():
+            return request.remote_addr, None
+    global _user
+    if _user is None:
+        try:
+            _user = getpass.getuser()
+        except Exception:
+            _user = ''
+    return None, _user or None
+
+
+def record(op, env, keys, version=None):
+    """Queues audit entries for an operation on some keys (ALL_KEYS for a whole env).
+
+    Returns immediately; entries are written in batches by a background thread.
+    """
+    global _flusher
+    remote_addr, user = _actor()
+    now = time.time()
+    entries = [{'time': now, 'op': op, 'env': env, 'key': key, 'version': version,
+                'remote_addr': remote_addr, 'user': user} for key in keys]
+    if not entries:
+        return
+    with _buffer_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name='audit-log', daemon=True)
+            _flusher.start()
+            atexit.register(flush)
+        _buffer.extend(entries)
+        if len(_buffer) >= FLUSH_BATCH:
+            _buffer_lock.notify()
+
+
+def record_read(env, key=ALL_KEYS, op='read'):
+    """Queues an audit entry for a decoded value (or a whole env) being shown or sent."""
+    record(op, env, [key])
+
+
+def _flush_loop():
+    while True:
+        with _buffer_lock:
+            _buffer_lock.wait_for(lambda: len(_buffer) >= FLUSH_BATCH, timeout=FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"Error writing the audit log: {e}")
+
+
+def flush():
+    """Writes the queued entries to the log and the index in one append each."""
+    with _buffer_lock:
+        entries = _buffer[:]
+        del _buffer[:]
+    if not entries:
+        return
+    os.makedirs(os.path.join(_audit_dir(), 'index'), exist_ok=True)
+    # Serializes appends across processes
+    with _storage()._file_lock('.audit'):
+        segments = _segments()
+        segment = segments[-1] if segments else 1
+        path = _segment_path(segment)
+        if os.path.exists(path) and os.path.getsize(path) >= MAX_SEGMENT_SIZE:
+            segment += 1
+            path = _segment_path(segment)
+            _drop_old_segments(segments + [segment])
+
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        lines = []
+        index_lines = {}
+        for entry in entries:
+            line = (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+            lines.append(line)
+            index_lines.setdefault(entry['env'], []).append(
+                json.dumps([entry['key'], segment, offset], separators=(',', ':')) + '\n')
+            offset += len(line)
+        with open(path, 'ab') as f:
+            f.write(b''.join(lines))
+        for env, env_lines in index_lines.items():
+            with open(_index_path(env), 'a', encoding='utf-8') as f:
+                f.write(''.join(env_lines))
+
+
+def _drop_old_segments(segments):
+    """Removes the segments beyond MAX_SEGMENTS and their index entries. Called with the lock held."""
+    dropped = set(segments[:-MAX_SEGMENTS])
+    if not dropped:
+        return
+    for segment in dropped:
+        try:
+            os.remove(_segment_path(segment))
+        except FileNotFoundError:
+            pass
+    index_dir = os.path.join(_audit_dir(), 'index')
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        with open(path, encoding='utf-8') as f:
+            kept = [line for line in f if json.loads(line)[1] not in dropped]
+        _storage()._write_file_atomic(path, ''.join(kept))
+
+
+def key_history(env, key, limit=None):
+    """Returns the audit entries of a key in an env, newest first, including reads of the whole env.
+
+    Only the env's index and the log lines it points to are read.
+    """
+    flush() # Include this process's own recent entries
+    try:
+        with open(_index_path(env), encoding='utf-8') as f:
+            places = [(segment, offset) for entry_key, segment, offset in map(json.loads, f)
+                      if entry_key in (key, ALL_KEYS)]
+    except FileNotFoundError:
+        return []
+    places.reverse()
+    if limit is not None:
+        places = places[:limit]
+
+    entries = []
+    files = {}
+    try:
+        for segment, offset in places:
+            if segment not in files:
+                try:
+                    files[segment] = open(_segment_path(segment), 'rb')
+                except FileNotFoundError:
+                    files[segment] = None
+            f = files[segment]
+            if f is None:
+                continue # Removed by rotation
+            f.seek(offset)
+            entries.append(json.loads(f.readline()))
+    finally:
+        for f in files.values():
+            if f is not None:
+                f.close()
+    return entries
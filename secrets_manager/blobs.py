@@ -0,0 +1,78 @@
+import base64
+
+# File uploads are read and encoded this many bytes at a time (a multiple of 3, so the
+# Base64 pieces join up without padding in between)
+UPLOAD_CHUNK_SIZE = 48 * 1024
+
+# Downloads decode this many Base64 characters at a time (a multiple of 4)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Kubernetes refuses Secrets larger than 1 MiB, so a single value can't usefully be bigger
+MAX_FILE_SIZE = 1024 * 1024
+
+# Leading bytes of common binary formats found in secrets, checked in order
+_SIGNATURES = (
+    (b'\xfe\xed\xfe\xed', 'Java keystore (JKS)'),
+    (b'\xce\xce\xce\xce', 'Java keystore (JCEKS)'),
+    (b'PK\x03\x04', 'ZIP archive'),
+    (b'\x1f\x8b', 'gzip data'),
+    (b'\x89PNG', 'PNG image'),
+    (b'-----BEGIN ', 'PEM'),
+    (b'ssh-', 'SSH public key'),
+    (b'\x30\x82', 'DER data (certificate, key or PKCS#12)'),
+)
+
+
+class FileTooLarge(ValueError):
+    """An uploaded file is larger than MAX_FILE_SIZE."""
+
+
+def encode_stream(stream, max_size=MAX_FILE_SIZE):
+    """Reads a binary stream in chunks and returns its content Base64 encoded.
+
+    Only one chunk of raw bytes is held at a time. Raises FileTooLarge once more than
+    max_size bytes have been read.
+    """
+    pieces = []
+    size = 0
+    carry = b''
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise FileTooLarge(f"File is larger than {max_size // 1024} KB.")
+        chunk = carry + chunk
+        # Streams may return short reads; encode whole 3-byte groups and keep the rest
+        cut = len(chunk) - len(chunk) % 3
+        pieces.append(base64.b64encode(chunk[:cut]).decode('ascii'))
+        carry = chunk[cut:]
+    pieces.append(base64.b64encode(carry).decode('ascii'))
+    return ''.join(pieces)
+
+
+def decode_chunks(encoded_value, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Yields the decoded bytes of a Base64 value a chunk at a time, without decoding it whole."""
+    for start in range(0, len(encoded_value), chunk_size):
+        yield base64.b64decode(encoded_value[start:start + chunk_size])
+
+
+def decoded_size(encoded_value):
+    """Returns the size in bytes of a Base64 value once decoded, without decoding it."""
+    return len(encoded_value) * 3 // 4 - encoded_value[-2:].count('=')
+
+
+def describe(encoded_value):
+    """Returns a short description of a value's format from its first bytes, e.g. 'PEM'.
+
+    Only the first few Base64 characters are decoded. Returns None for unrecognized values.
+    """
+    try:
+        head = base64.b64decode(encoded_value[:24])
+    except Exception:
+        return None
+    for signature, name in _SIGNATURES:
+        if head.startswith(signature):
+            return name
+    return None
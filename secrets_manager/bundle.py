@@ -0,0 +1,138 @@
+import os
+import mmap
+import struct
+import bisect
+
+# Compiled, read-only copy of an env for other processes on the host, written next to
+# the CSV (envs/.bundles/<env>.bundle) by every write. Only the standard library is
+# used, so other services can copy this file and read bundles without the app.
+#
+# Layout (little endian):
+#   header   magic, format version, key count, env version, and the (inode, mtime_ns,
+#            size) of the CSV it was compiled from, so readers can tell it is current
+#   entries  one (key offset, value offset, key length, value length) per key, sorted
+#            by the key's UTF-8 bytes
+#   keys     the UTF-8 keys, back to back
+#   values   the stored values, back to back: Base64, or sealed (crypto.SEALED_PREFIX)
+#            when encryption at rest is on
+MAGIC = b'SMBUNDLE'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('<8sHHIQQQQ')
+_ENTRY = struct.Struct('<QQII')
+
+
+class BundleError(Exception):
+    """Raised for a file that isn't a bundle of a format this reader knows."""
+
+
+def write_bundle(path, pairs, version=0, source_signature=(0, 0, 0)):
+    """Compiles (key, stored_value) pairs into a bundle at path, replacing it atomically.
+
+    Values may be str or bytes-like. If a key repeats, its first value wins, as in lookups
+    and updates of the CSV (storage.get_secret_value(), update_env()).
+    """
+    items = {}
+    for key, value in pairs:
+        key = key.encode('utf-8')
+        if key not in items:
+            items[key] = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+    keys = sorted(items)
+
+    table_size = _ENTRY.size * len(keys)
+    key_offset = _HEADER.size + table_size
+    value_offset = key_offset + sum(len(key) for key in keys)
+    table = bytearray(table_size)
+    for index, key in enumerate(keys):
+        value = items[key]
+        _ENTRY.pack_into(table, index * _ENTRY.size, key_offset, value_offset, len(key), len(value))
+        key_offset += len(key)
+        value_offset += len(value)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(keys), version or 0, *source_signature)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(table)
+            f.write(b''.join(keys))
+            f.write(b''.join(items[key] for key in keys))
+        # Readers never see a half-written bundle
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class BundleReader:
+    """Memory-maps a bundle and looks keys up by binary search over its sorted entries.
+
+    Nothing is parsed up front. get() returns a memoryview of the value inside the map,
+    so values are never copied; release those views before calling close().
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _HEADER.size:
+            self._map.close()
+            raise BundleError(f"{path} is not a secrets bundle")
+        magic, format_version, _, self.count, self.version, *source = _HEADER.unpack_from(self._map)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            self._map.close()
+            raise BundleError(f"{path} is not a secrets bundle of format {FORMAT_VERSION}")
+        # (inode, mtime_ns, size) of the CSV the bundle was compiled from
+        self.source_signature = tuple(source)
+        self._view = memoryview(self._map)
+
+    def _entry(self, index):
+        return _ENTRY.unpack_from(self._map, _HEADER.size + index * _ENTRY.size)
+
+    def _key_at(self, index):
+        key_offset, _, key_length, _ = self._entry(index)
+        return self._map[key_offset:key_offset + key_length]
+
+    def _find(self, key):
+        """Returns the entry index of a key, or None."""
+        key = key.encode('utf-8')
+        index = bisect.bisect_left(range(self.count), key, key=self._key_at)
+        if index < self.count and self._key_at(index) == key:
+            return index
+        return None
+
+    def get(self, key, default=None):
+        """Returns the stored value of a key as a memoryview into the map, or default."""
+        index = self._find(key)
+        if index is None:
+            return default
+        _, value_offset, _, value_length = self._entry(index)
+        return self._view[value_offset:value_offset + value_length]
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __len__(self):
+        return self.count
+
+    def keys(self):
+        """Yields the keys in sorted order."""
+        for index in range(self.count):
+            yield self._key_at(index).decode('utf-8')
+
+    def items(self):
+        """Yields (key, value memoryview) pairs in key order."""
+        for index in range(self.count):
+            key_offset, value_offset, key_length, value_length = self._entry(index)
+            yield (self._map[key_offset:key_offset + key_length].decode('utf-8'),
+                   self._view[value_offset:value_offset + value_length])
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
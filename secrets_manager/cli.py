@@ -0,0 +1,540 @@
+import os
+import sys
+import base64
+import json
+import argparse
+import datetime
+
+from secrets_manager import storage, crypto, fingerprints, layers, blobs, audit, rotation
+from secrets_manager.refactor import OPERATIONS, refactor_keys
+from secrets_manager.mappings import ENV_MAPPINGS, DRIFT_MAPPINGS
+from secrets_manager.serializers import SERIALIZERS, DEFAULT_FORMAT, get_serializer
+
+
+def _error(message):
+    print(f"error: {message}", file=sys.stderr)
+
+
+def _require_env(env):
+    """Returns True if the env exists, printing an error otherwise."""
+    if os.path.exists(storage.env_path(env)):
+        return True
+    _error(f"environment '{env}' not found")
+    return False
+
+
+def _decode(encoded_value):
+    """Decodes a stored value for printing, like the web pages do."""
+    try:
+        return base64.b64decode(encoded_value).decode('utf-8')
+    except Exception:
+        return '[Invalid base64 or decoding error]'
+
+
+def _parse_pair(line):
+    """Splits a KEY=VALUE pair, returning None for blank lines and comments."""
+    if not line.strip() or line.lstrip().startswith('#'):
+        return None
+    key, sep, value = line.partition('=')
+    if not sep or not key.strip():
+        raise ValueError(f"expected KEY=VALUE, got {line!r}")
+    return key.strip(), value
+
+
+def cmd_envs(args):
+    """Lists environments (all, or those under --prefix), optionally with their key counts."""
+    for env in sorted(storage.get_envs(args.prefix.strip('/'))):
+        print(f"{env}\t{storage.count_keys(env)}" if args.counts else env)
+    return 0
+
+
+def cmd_get(args):
+    """Prints one, several or all values of an environment, including inherited ones."""
+    if not _require_env(args.env):
+        return 1
+    show = (lambda value: value) if args.raw else _decode
+
+    if len(args.keys) == 1:
+        # A single key prints just the value, which is what scripts want to capture
+        resolved = layers.get_resolved_value(args.env, args.keys[0])
+        if resolved is None:
+            _error(f"key '{args.keys[0]}' not found in '{args.env}'")
+            return 1
+        audit.record_read(args.env, args.keys[0])
+        print(show(resolved[0]))
+        return 0
+
+    wanted = set(args.keys)
+    found = set()
+    for key, value, _ in layers.iter_resolved(args.env):
+        if not wanted or key in wanted:
+            found.add(key)
+            print(f"{key}={show(value)}")
+    if wanted:
+        audit.record('read', args.env, sorted(found))
+    else:
+        audit.record_read(args.env)
+    missing = wanted - found
+    for key in sorted(missing):
+        _error(f"key '{key}' not found in '{args.env}'")
+    return 1 if missing else 0
+
+
+def cmd_set(args):
+    """Sets KEY=VALUE pairs from the arguments or stdin with a single write."""
+    if not storage.is_valid_env_name(args.env):
+        _error("environment name must be alphanumeric and can contain hyphens or underscores (with '/' between levels)")
+        return 1
+    lines = args.pairs if args.pairs and args.pairs != ['-'] else sys.stdin.read().splitlines()
+
+    updates = {}
+    try:
+        for line in lines:
+            pair = _parse_pair(line)
+            if pair is None:
+                continue
+            key, value = pair
+            if args.encoded:
+                # Values are already Base64, store them as they are after checking them
+                base64.b64decode(value, validate=True)
+                updates[key] = value
+            else:
+                updates[key] = base64.b64encode(value.encode('utf-8')).decode('utf-8')
+    except ValueError as e:
+        _error(str(e))
+        return 1
+
+    if not updates:
+        _error('no KEY=VALUE pairs given')
+        return 1
+    if not storage.save_secrets(args.env, updates):
+        return 1
+    print(f"Set {len(updates)} secret(s) in '{args.env}'.", file=sys.stderr)
+    return 0
+
+
+def cmd_set_file(args):
+    """Stores a file (or stdin) as the value of a key, encoding it a chunk at a time."""
+    if not storage.is_valid_env_name(args.env):
+        _error("environment name must be alphanumeric and can contain hyphens or underscores (with '/' between levels)")
+        return 1
+    try:
+        if args.path == '-':
+            encoded_value = blobs.encode_stream(sys.stdin.buffer)
+        else:
+            with open(args.path, 'rb') as f:
+                encoded_value = blobs.encode_stream(f)
+    except (OSError, blobs.FileTooLarge) as e:
+        _error(str(e))
+        return 1
+    if not storage.save_secrets(args.env, {args.key: encoded_value}):
+        return 1
+    print(f"Set '{args.key}' in '{args.env}' ({blobs.decoded_size(encoded_value)} bytes).", file=sys.stderr)
+    return 0
+
+
+def cmd_get_file(args):
+    """Writes the decoded bytes of a value to a file or stdout, a chunk at a time."""
+    if not _require_env(args.env):
+        return 1
+    resolved = layers.get_resolved_value(args.env, args.key)
+    if resolved is None:
+        _error(f"key '{args.key}' not found in '{args.env}'")
+        return 1
+    audit.record_read(args.env, args.key)
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in blobs.decode_chunks(resolved[0]):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+def cmd_delete(args):
+    """Deletes keys from an environment with a single write."""
+    if not _require_env(args.env):
+        return 1
+    deleted = storage.delete_secrets(args.env, args.keys)
+    print(f"Deleted {deleted} secret(s) from '{args.env}'.", file=sys.stderr)
+    return 0 if deleted == len(set(args.keys)) else 1
+
+
+def cmd_export(args):
+    """Streams an environment in one of the export formats."""
+    if not _require_env(args.env):
+        return 1
+    serializer = get_serializer(args.format)
+    audit.record_read(args.env, op='export')
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        rows = ((key, value) for key, value, _ in layers.iter_resolved(args.env))
+        for chunk in serializer.func(args.env, rows):
+            out.write(chunk)
+        if args.format == DEFAULT_FORMAT:
+            # The data block has no trailing newline, which is awkward on a terminal
+            out.write('\n')
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+def _first_values(pairs):
+    """Returns {key: value}; a repeated key keeps its first value, as in lookups."""
+    values = {}
+    for key, value in pairs:
+        values.setdefault(key, value)
+    return values
+
+
+def _resolved_values(env):
+    """Returns {key: Base64 value} for an env including inherited keys, as `get` reads them."""
+    return _first_values((key, value) for key, value, _ in layers.iter_resolved(env))
+
+
+def cmd_diff(args):
+    """Compares two environments, including inherited keys, by key and Base64 value.
+
+    Encrypted values are decrypted to compare them, but no value is printed.
+    """
+    if not (_require_env(args.env_a) and _require_env(args.env_b)):
+        return 1
+    a = _resolved_values(args.env_a)
+    b = _resolved_values(args.env_b)
+
+    different = False
+    for key in sorted(a.keys() | b.keys()):
+        if key not in b:
+            print(f"- {key}")
+        elif key not in a:
+            print(f"+ {key}")
+        elif a[key] != b[key]:
+            print(f"~ {key}")
+        else:
+            continue
+        different = True
+    # Like diff(1): 0 when identical, 1 when there are differences
+    return 1 if different else 0
+
+
+def cmd_import(args):
+    """Imports a directory or archive of Secret manifests into envs."""
+    # Imported here so other subcommands don't pay for loading yaml and the process pool
+    from secrets_manager.importer import import_manifests
+
+    summary = import_manifests(args.path, env_from=args.env_from, workers=args.workers, dry_run=args.dry_run)
+    for env, key_count in sorted(summary['envs'].items()):
+        print(f"{env}: {key_count} key(s)")
+    for error in summary['errors']:
+        print(f"warning: {error}", file=sys.stderr)
+    action = 'Would import' if args.dry_run else 'Imported'
+    print(f"{action} {summary['secrets']} Secret(s) from {summary['files']} file(s) into {len(summary['envs'])} env(s).")
+    return 1 if summary['errors'] else 0
+
+
+def cmd_where_used(args):
+    """Prints every env and key holding a value, read from stdin unless given as an argument."""
+    value = args.value if args.value is not None else sys.stdin.read().rstrip('\n')
+    encoded_value = value if args.encoded else base64.b64encode(value.encode('utf-8')).decode('utf-8')
+    matches = fingerprints.where_used(encoded_value)
+    for env, key in matches:
+        print(f"{env}\t{key}")
+    # Like grep: 0 when the value was found, 1 when it wasn't
+    return 0 if matches else 1
+
+
+def cmd_encrypt(args):
+    """Encrypts the plain text values of some or all environments with the master secret."""
+    if not crypto.enabled():
+        _error(f"set {crypto.MASTER_KEY_VAR} or {crypto.MASTER_KEYFILE_VAR} to turn on encryption at rest")
+        return 1
+    envs = args.envs or sorted(storage.get_envs())
+    for env in envs:
+        if not _require_env(env):
+            return 1
+    for env in envs:
+        print(f"{env}: encrypted {storage.encrypt_env(env)} value(s)")
+    return 0
+
+
+def cmd_refactor(args):
+    """Renames, copies or deletes keys matching a prefix or regex in some or all environments."""
+    mode, pattern = ('regex', args.regex) if args.regex is not None else ('prefix', args.prefix)
+    if args.operation != 'delete' and args.to is None:
+        _error(f"{args.operation} needs --to")
+        return 1
+    try:
+        summary = refactor_keys(args.operation, mode, pattern, args.to or '', args.envs,
+                                workers=args.workers, dry_run=args.dry_run)
+    except ValueError as e:
+        _error(str(e))
+        return 1
+    for env, result in summary['envs'].items():
+        for old_key, new_key in result['changes']:
+            note = ' (overwrites)' if new_key in result['overwritten'] else ''
+            print(f"{env}\t{old_key}\t{new_key or '-'}{note}")
+    for error in summary['errors']:
+        print(f"warning: {error}", file=sys.stderr)
+    action = 'Would change' if args.dry_run else 'Changed'
+    print(f"{action} {summary['keys']} key(s) in {len(summary['envs'])} env(s).", file=sys.stderr)
+    return 1 if summary['errors'] else 0
+
+
+def cmd_drift(args):
+    """Compares a `kubectl get secret(s) -o yaml` dump with the stored envs. Exits 1 on drift."""
+    if args.env is not None and not storage.is_valid_env_name(args.env):
+        _error("environment name must be alphanumeric and can contain hyphens or underscores (with '/' between levels)")
+        return 1
+    try:
+        if args.path == '-':
+            text = sys.stdin.read()
+        else:
+            with open(args.path, encoding='utf-8') as f:
+                text = f.read()
+    except OSError as e:
+        _error(str(e))
+        return 1
+    # Imported here for the same reason as the importer in cmd_import
+    from secrets_manager.drift import check_drift
+    summary = check_drift(text, env=args.env, env_from=args.env_from)
+
+    drifted = [result for result in summary['secrets'] if result['patch']]
+    if args.output == 'patch':
+        print(json.dumps({f"{result['namespace']}/{result['name']}": result['patch'] for result in drifted}, indent=2))
+    elif args.output == 'kubectl':
+        for result in drifted:
+            print(result['command'])
+    else:
+        for result in summary['secrets']:
+            print(f"{result['namespace']}/{result['name']}\t{result['env']}\t"
+                  f"+{len(result['added'])} -{len(result['removed'])} ~{len(result['changed'])}")
+            for sign, keys in (('+', result['added']), ('-', result['removed']), ('~', result['changed'])):
+                for key in keys:
+                    print(f"  {sign} {key}")
+    for error in summary['errors']:
+        print(f"warning: {error}", file=sys.stderr)
+    print(f"{len(drifted)} of {len(summary['secrets'])} Secret(s) differ from the store.", file=sys.stderr)
+    return 1 if drifted or summary['errors'] else 0
+
+
+def cmd_audit(args):
+    """Prints who read or changed a key, newest first, as tab separated lines."""
+    for entry in audit.key_history(args.env, args.key, limit=args.limit):
+        when = datetime.datetime.fromtimestamp(entry['time']).strftime('%Y-%m-%d %H:%M:%S')
+        who = entry['remote_addr'] or entry['user'] or '-'
+        version = entry['version'] if entry['version'] is not None else '-'
+        print(f"{when}\t{entry['op']}\t{entry['key']}\t{version}\t{who}")
+    return 0
+
+
+def _format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else '-'
+
+
+def cmd_rotation(args):
+    """Prints a key's rotation details, after setting its expiry and/or owner if asked to."""
+    if not _require_env(args.env):
+        return 1
+    if not storage.has_key(args.env, args.key):
+        _error(f"key '{args.key}' not found in '{args.env}'")
+        return 1
+    changes = {}
+    if args.expires is not None:
+        try:
+            changes['expires'] = None if args.expires.lower() == 'none' else rotation.parse_expiry(args.expires)
+        except ValueError as e:
+            _error(str(e))
+            return 1
+    if args.owner is not None:
+        changes['owner'] = args.owner
+    metadata = rotation.set_metadata(args.env, args.key, **changes) if changes \
+        else rotation.get_metadata(args.env).get(args.key)
+    if metadata is None:
+        print('no rotation details recorded yet')
+        return 0
+    print(f"created\t{_format_time(metadata['created'])}")
+    print(f"rotated\t{_format_time(metadata['rotated'])}")
+    print(f"expires\t{_format_time(metadata['expires'])}")
+    print(f"owner\t{metadata['owner'] or '-'}")
+    return 0
+
+
+def cmd_expiring(args):
+    """Prints the secrets that expired or expire soon, soonest first, as tab separated lines."""
+    for item in rotation.expiring_soon(args.days, args.prefix.strip('/')):
+        state = 'expired' if item['expired'] else 'expires'
+        print(f"{_format_time(item['expires'])}\t{state}\t{item['env']}\t{item['key']}")
+    return 0
+
+
+def cmd_bundle(args):
+    """Compiles the binary bundles of environments from their CSV files."""
+    envs = args.envs or storage.get_envs()
+    status = 0
+    for env in envs:
+        if not _require_env(env):
+            status = 1
+            continue
+        count = storage.compile_bundle(env)
+        print(f"{env}: {count} key(s) -> {storage.bundle_path(env)}")
+    return status
+
+
+def cmd_parent(args):
+    """Prints an environment's inheritance chain, or sets or clears its parent."""
+    if not _require_env(args.env):
+        return 1
+    try:
+        if args.clear:
+            layers.set_parent(args.env, None)
+        elif args.parent:
+            layers.set_parent(args.env, args.parent)
+    except layers.LayerError as e:
+        _error(str(e))
+        return 1
+    print(' -> '.join(layers.parent_chain(args.env)))
+    return 0
+
+
+def build_parser():
+    """Builds the argument parser for the command line interface."""
+    parser = argparse.ArgumentParser(prog='k8s-secret-manager-cli',
+                                     description='Manage the local Kubernetes secret store without running the web server.')
+    parser.add_argument('--envs-dir', default=storage.envs_dir,
+                        help='directory holding the env CSV files (default: %(default)s, or $ENVS_DIR)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    envs_parser = subparsers.add_parser('envs', help='list environments')
+    envs_parser.add_argument('--counts', action='store_true', help='also print the number of keys in each env')
+    envs_parser.add_argument('--prefix', default='', help='only list the envs under this prefix, e.g. cluster/namespace')
+    envs_parser.set_defaults(func=cmd_envs)
+
+    get_parser = subparsers.add_parser('get', help='print decoded values (all keys if none are given)')
+    get_parser.add_argument('env')
+    get_parser.add_argument('keys', nargs='*', metavar='key')
+    get_parser.add_argument('--raw', action='store_true', help='print the stored Base64 values')
+    get_parser.set_defaults(func=cmd_get)
+
+    set_parser = subparsers.add_parser('set', help='set KEY=VALUE pairs (read from stdin if none are given)')
+    set_parser.add_argument('env')
+    set_parser.add_argument('pairs', nargs='*', metavar='KEY=VALUE')
+    set_parser.add_argument('--encoded', action='store_true', help='values are already Base64 encoded')
+    set_parser.set_defaults(func=cmd_set)
+
+    set_file_parser = subparsers.add_parser('set-file', help='store a file (e.g. a keystore) as the value of a key')
+    set_file_parser.add_argument('env')
+    set_file_parser.add_argument('key')
+    set_file_parser.add_argument('path', help="file to store, or '-' for stdin")
+    set_file_parser.set_defaults(func=cmd_set_file)
+
+    get_file_parser = subparsers.add_parser('get-file', help='write the decoded bytes of a value')
+    get_file_parser.add_argument('env')
+    get_file_parser.add_argument('key')
+    get_file_parser.add_argument('-o', '--output', help='write to a file instead of stdout')
+    get_file_parser.set_defaults(func=cmd_get_file)
+
+    delete_parser = subparsers.add_parser('delete', help='delete keys')
+    delete_parser.add_argument('env')
+    delete_parser.add_argument('keys', nargs='+', metavar='key')
+    delete_parser.set_defaults(func=cmd_delete)
+
+    export_parser = subparsers.add_parser('export', help='export an environment')
+    export_parser.add_argument('env')
+    export_parser.add_argument('--format', default=DEFAULT_FORMAT, choices=list(SERIALIZERS),
+                               help='export format (default: %(default)s)')
+    export_parser.add_argument('-o', '--output', help='write to a file instead of stdout')
+    export_parser.set_defaults(func=cmd_export)
+
+    diff_parser = subparsers.add_parser('diff', help='compare the keys and values of two environments')
+    diff_parser.add_argument('env_a')
+    diff_parser.add_argument('env_b')
+    diff_parser.set_defaults(func=cmd_diff)
+
+    import_parser = subparsers.add_parser('import', help='import Secret manifests from a directory or archive')
+    import_parser.add_argument('path', help='directory, .tar/.tar.gz/.tgz/.zip archive or single manifest file')
+    import_parser.add_argument('--env-from', choices=ENV_MAPPINGS, default='name',
+                               help='how each Secret is mapped to an env (default: %(default)s)')
+    import_parser.add_argument('--workers', type=int, default=None,
+                               help='number of parser processes (default: number of CPUs)')
+    import_parser.add_argument('--dry-run', action='store_true', help='parse and report without writing anything')
+    import_parser.set_defaults(func=cmd_import)
+
+    where_used_parser = subparsers.add_parser('where-used', help='list the envs and keys that hold a value')
+    where_used_parser.add_argument('value', nargs='?',
+                                   help='value to look up (read from stdin if omitted, which keeps it out of shell history)')
+    where_used_parser.add_argument('--encoded', action='store_true', help='the value is already Base64 encoded')
+    where_used_parser.set_defaults(func=cmd_where_used)
+
+    encrypt_parser = subparsers.add_parser('encrypt', help='encrypt values still stored in plain text')
+    encrypt_parser.add_argument('envs', nargs='*', metavar='env', help='environments to encrypt (default: all)')
+    encrypt_parser.set_defaults(func=cmd_encrypt)
+
+    refactor_parser = subparsers.add_parser('refactor', help='rename, copy or delete keys by prefix or regex across envs')
+    refactor_parser.add_argument('operation', choices=OPERATIONS)
+    match_group = refactor_parser.add_mutually_exclusive_group(required=True)
+    match_group.add_argument('--prefix', help='change keys starting with this prefix, replacing it with --to')
+    match_group.add_argument('--regex', help=r'change keys fully matching this regex; --to may use \1 or \g<name>')
+    refactor_parser.add_argument('--to', help='replacement prefix or regex template (not used by delete)')
+    refactor_parser.add_argument('--env', dest='envs', action='append', metavar='ENV',
+                                 help='environment to change, may be repeated (default: all)')
+    refactor_parser.add_argument('--workers', type=int, default=None,
+                                 help='number of envs rewritten at once (default: up to 8)')
+    refactor_parser.add_argument('--dry-run', action='store_true', help='list the changes without writing anything')
+    refactor_parser.set_defaults(func=cmd_refactor)
+
+    drift_parser = subparsers.add_parser('drift', help='compare a kubectl Secret dump with the store and print patches')
+    drift_parser.add_argument('path', help="output of 'kubectl get secret(s) -o yaml', or - for stdin")
+    drift_parser.add_argument('--env', default=None, help='env to compare a single Secret with (default: its name)')
+    drift_parser.add_argument('--env-from', choices=DRIFT_MAPPINGS, default='name',
+                              help='how Secrets are matched to envs (default: %(default)s)')
+    drift_parser.add_argument('--output', choices=('report', 'patch', 'kubectl'), default='report',
+                              help='key report, JSON merge patches, or kubectl patch commands (default: %(default)s)')
+    drift_parser.set_defaults(func=cmd_drift)
+
+    audit_parser = subparsers.add_parser('audit', help='show who read or changed a key')
+    audit_parser.add_argument('env')
+    audit_parser.add_argument('key')
+    audit_parser.add_argument('--limit', type=int, default=None, help='show only the most recent entries')
+    audit_parser.set_defaults(func=cmd_audit)
+
+    rotation_parser = subparsers.add_parser('rotation', help="show or set a key's expiry and owner")
+    rotation_parser.add_argument('env')
+    rotation_parser.add_argument('key')
+    rotation_parser.add_argument('--expires', help="expiry date like 2026-12-31, or 'none' to clear it")
+    rotation_parser.add_argument('--owner', help="who rotates the key ('' to clear)")
+    rotation_parser.set_defaults(func=cmd_rotation)
+
+    expiring_parser = subparsers.add_parser('expiring', help='list the secrets that expired or expire soon')
+    expiring_parser.add_argument('--days', type=float, default=rotation.EXPIRING_SOON_DAYS,
+                                 help='how many days ahead to look (default: %(default)s)')
+    expiring_parser.add_argument('--prefix', default='', help='only list the envs under this prefix')
+    expiring_parser.set_defaults(func=cmd_expiring)
+
+    bundle_parser = subparsers.add_parser('bundle', help='compile the binary bundles other services read envs from')
+    bundle_parser.add_argument('envs', nargs='*', metavar='env', help='environments to compile (default: all)')
+    bundle_parser.set_defaults(func=cmd_bundle)
+
+    parent_parser = subparsers.add_parser('parent', help="show or set the env an environment inherits from")
+    parent_parser.add_argument('env')
+    parent_parser.add_argument('parent', nargs='?', help='environment to inherit from')
+    parent_parser.add_argument('--clear', action='store_true', help='stop inheriting')
+    parent_parser.set_defaults(func=cmd_parent)
+
+    return parser
+
+
+def main(argv=None):
+    """Entry point for the k8s-secret-manager-cli script."""
+    args = build_parser().parse_args(argv)
+    storage.envs_dir = args.envs_dir
+    try:
+        sys.exit(args.func(args))
+    except crypto.DecryptionError as e:
+        _error(str(e))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import re
+import bisect
+import threading
+
+from secrets_manager import layers
+
+# Key suggestions for the "Show Decoded Value for Key" box. The keys of an env (including
+# inherited ones) are kept as sorted arrays, rebuilt only when one of the env files
+# changes, and queried with bisect, so a suggestion costs a few comparisons rather than
+# a scan of the env.
+
+# Suggestions returned when no limit is given, and the most a caller may ask for
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 50
+
+# Envs whose key arrays are kept per process; the least recently built go first
+MAX_CACHED_ENVS = 256
+
+# Keys are split into words on anything but letters and digits, e.g. DB_PASSWORD -> db, password
+_WORD_SPLIT = re.compile(r'[^0-9a-zA-Z]+|(?<=[a-z])(?=[A-Z])')
+
+# env -> (signatures of its env files, sorted [(folded key, key)], sorted [(folded word, key)])
+_cache = {}
+_lock = threading.Lock()
+
+
+def _storage():
+    # Imported lazily because the storage layer imports the modules this one uses
+    from secrets_manager import storage
+    return storage
+
+
+def _index(env):
+    """Returns the sorted key and word arrays of an env, rebuilding them if a file changed."""
+    storage = _storage()
+    chain = layers.parent_chain(env)
+    signatures = tuple((layer, storage.file_signature(storage.env_path(layer))) for layer in chain)
+    cached = _cache.get(env)
+    if cached is not None and cached[0] == signatures:
+        return cached[1], cached[2]
+
+    keys = set()
+    for layer in chain:
+        keys.update(storage.get_keys(layer))
+    folded = sorted((key.casefold(), key) for key in keys)
+    words = sorted({(word.casefold(), key) for key in keys for word in _WORD_SPLIT.split(key) if word})
+    with _lock:
+        if len(_cache) >= MAX_CACHED_ENVS:
+            _cache.pop(next(iter(_cache), None), None)
+        _cache[env] = (signatures, folded, words)
+    return folded, words
+
+
+def _starting_with(pairs, prefix, limit, found):
+    """Adds the keys of sorted (folded, key) pairs whose folded part starts with prefix."""
+    index = bisect.bisect_left(pairs, (prefix,))
+    while index < len(pairs) and len(found) < limit and pairs[index][0].startswith(prefix):
+        found.setdefault(pairs[index][1])
+        index += 1
+
+
+def _is_subsequence(term, text):
+    characters = iter(text)
+    return all(character in characters for character in term)
+
+
+def suggest(env, term, limit=DEFAULT_SUGGESTIONS):
+    """Returns up to `limit` keys of an env (including inherited ones) matching term, best first.
+
+    Keys starting with the term come first, then keys with a word starting with it
+    (PASS finds DB_PASSWORD), each found by bisect; only if that leaves room are the
+    keys containing the term's letters in order (dbpw finds DB_PASSWORD) scanned for.
+    Matching ignores case.
+    """
+    term = term.strip().casefold()
+    limit = max(1, min(limit, MAX_SUGGESTIONS))
+    if not term:
+        return []
+    folded, words = _index(env)
+    # Insertion ordered; values unused
+    found = {}
+    _starting_with(folded, term, limit, found)
+    if len(found) < limit:
+        _starting_with(words, term, limit, found)
+    if len(found) < limit and len(term) > 1:
+        for folded_key, key in folded:
+            if len(found) >= limit:
+                break
+            if key not in found and _is_subsequence(term, folded_key):
+                found.setdefault(key)
+    return list(found)
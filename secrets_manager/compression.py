@@ -0,0 +1,89 @@
+import zlib
+
+try:
+    import brotli
+except ImportError: # Optional dependency; without it responses are gzip compressed only
+    brotli = None
+
+# Responses smaller than this are sent as they are; compressing them saves next to nothing
+COMPRESS_MIN_SIZE = 1024
+
+# Text-based types worth compressing (pages, API responses, exports, stylesheets)
+COMPRESSIBLE_MIMETYPES = (
+    'text/html', 'text/plain', 'text/css', 'text/yaml',
+    'application/json', 'application/yaml', 'application/javascript',
+)
+
+# Moderate levels: responses are compressed on every request, so speed matters more than ratio
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+# Each compressor is returned as (compress, sync_flush, finish) functions
+
+def _gzip_compressor():
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) # wbits 31 = gzip container
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def _brotli_compressor():
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    return compressor.process, compressor.flush, compressor.finish
+
+
+def _choose_encoding(accept_encodings):
+    """Returns 'br', 'gzip' or None for the request's Accept-Encoding header."""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress_stream(chunks, compress, sync_flush, finish):
+    """Compresses a streamed body chunk by chunk, so it is never held in memory as a whole.
+
+    Each chunk is flushed through the compressor, so a streamed page reaches the browser
+    as it is rendered instead of waiting for the compressor's buffer to fill.
+    """
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        yield compress(chunk) + sync_flush()
+    yield finish()
+
+
+def compress_response(request, response):
+    """Compresses a response with brotli or gzip if the client accepts it and it is worth it.
+
+    Streamed responses (like exports) are compressed as they are generated; others only
+    when they are at least COMPRESS_MIN_SIZE bytes.
+    """
+    if (request.method == 'HEAD' or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    # Whatever we decide, caches must keep the variants apart
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    compress, sync_flush, finish = _brotli_compressor() if encoding == 'br' else _gzip_compressor()
+
+    if response.is_streamed and not response.direct_passthrough:
+        response.response = _compress_stream(response.response, compress, sync_flush, finish)
+        response.headers.pop('Content-Length', None)
+    else:
+        # Static files are sent as passthrough file wrappers; they are small, so read them whole
+        response.direct_passthrough = False
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(data) + finish())
+
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # The compressed bytes differ from the original, so the ETag may only match weakly
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,169 @@
+import os
+import base64
+import hashlib
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError: # Optional dependency, only needed when encryption at rest is turned on
+    AESGCM = None
+
+# Encryption at rest is turned on by giving a master secret, either directly or as a file.
+# Each env gets its own AES-256-GCM key derived from the master secret with scrypt, and every
+# value is sealed separately, so reading one value never requires decrypting the others.
+MASTER_KEY_VAR = 'SECRETS_MASTER_KEY'
+MASTER_KEYFILE_VAR = 'SECRETS_MASTER_KEYFILE'
+
+# Sealed values are stored as "enc:v1:<urlsafe base64 of nonce + ciphertext>". Plain values
+# are Base64, which never contains ':', so both kinds can live side by side in one env.
+SEALED_PREFIX = 'enc:v1:'
+
+NONCE_SIZE = 12
+
+# scrypt cost; about 0.1s and 32 MiB per derivation, paid once per env per process
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Derived keys by (master secret, store salt, env), kept for the life of the worker
+_env_keys = {}
+# Master secrets read from keyfiles, by path
+_keyfiles = {}
+# Store salts, by envs directory
+_salts = {}
+
+
+class DecryptionError(ValueError):
+    """A sealed value could not be decrypted (wrong master secret, or tampered data)."""
+
+
+def _master_secret():
+    """Returns the configured master secret as bytes, or None if encryption is off."""
+    passphrase = os.environ.get(MASTER_KEY_VAR)
+    if passphrase:
+        return passphrase.encode('utf-8')
+    keyfile = os.environ.get(MASTER_KEYFILE_VAR)
+    if not keyfile:
+        return None
+    if keyfile not in _keyfiles:
+        with open(keyfile, 'rb') as f:
+            _keyfiles[keyfile] = f.read().strip()
+    return _keyfiles[keyfile]
+
+
+def enabled():
+    """True if a master secret is configured, i.e. new values are stored encrypted."""
+    return bool(os.environ.get(MASTER_KEY_VAR) or os.environ.get(MASTER_KEYFILE_VAR))
+
+
+def _store_salt():
+    """Returns the random salt of the store, creating it the first time it is needed.
+
+    The salt is not secret; it lives beside the env files so that the same master
+    secret gives different keys in different stores.
+    """
+    # Imported lazily because the storage layer imports this module
+    from secrets_manager import storage
+    path = os.path.join(storage.envs_dir, '.salt')
+    salt = _salts.get(path)
+    if salt is not None:
+        return salt
+    if not os.path.exists(path):
+        os.makedirs(storage.envs_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(os.urandom(16))
+        try:
+            # link() fails if another process created the salt first, in which case we use theirs
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path, 'rb') as f:
+        salt = f.read()
+    _salts[path] = salt
+    return salt
+
+
+def _env_key(env):
+    """Returns the AES-256 key of an env, running the KDF only the first time."""
+    master = _master_secret()
+    if master is None:
+        raise DecryptionError(f"Values in '{env}' are encrypted; set {MASTER_KEY_VAR} or {MASTER_KEYFILE_VAR}.")
+    salt = _store_salt()
+    cache_key = (master, salt, env)
+    key = _env_keys.get(cache_key)
+    if key is None:
+        key = hashlib.scrypt(master, salt=salt + env.encode('utf-8'),
+                             n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, maxmem=64 * 1024 * 1024, dklen=32)
+        _env_keys[cache_key] = key
+    return key
+
+
+def fingerprint_key():
+    """Returns the HMAC key for value fingerprints when encryption is on, otherwise None.
+
+    It is derived like an env key under a name that is not a valid env name, so it never
+    matches a real env's key.
+    """
+    if not enabled():
+        return None
+    return _env_key('.fingerprints')
+
+
+def _cipher(env):
+    if AESGCM is None:
+        raise RuntimeError("Encryption at rest needs the 'cryptography' package "
+                           "(pip install 'k8s-secrets-manager-app[encryption]').")
+    return AESGCM(_env_key(env))
+
+
+def _associated_data(env, key):
+    # Binds each value to its env and key, so sealed values cannot be moved between rows
+    return f"{env}\0{key}".encode('utf-8')
+
+
+def is_sealed(value):
+    """True if a stored value is encrypted."""
+    return bool(value) and value.startswith(SEALED_PREFIX)
+
+
+def seal(env, key, encoded_value):
+    """Encrypts a Base64 value for storage when encryption is on; otherwise returns it unchanged.
+
+    Already sealed values (e.g. from the version history) are returned as they are.
+    """
+    if not enabled() or is_sealed(encoded_value):
+        return encoded_value
+    nonce = os.urandom(NONCE_SIZE)
+    ciphertext = _cipher(env).encrypt(nonce, encoded_value.encode('utf-8'), _associated_data(env, key))
+    return SEALED_PREFIX + base64.urlsafe_b64encode(nonce + ciphertext).decode('ascii')
+
+
+def unseal(env, key, stored_value):
+    """Returns the Base64 value of a stored value, decrypting it if it is sealed."""
+    if not is_sealed(stored_value):
+        return stored_value
+    try:
+        blob = base64.urlsafe_b64decode(stored_value[len(SEALED_PREFIX):])
+        plaintext = _cipher(env).decrypt(blob[:NONCE_SIZE], blob[NONCE_SIZE:], _associated_data(env, key))
+    except (DecryptionError, RuntimeError):
+        raise
+    except Exception:
+        raise DecryptionError(f"Could not decrypt '{key}' in '{env}': wrong master secret or corrupted value.")
+    return plaintext.decode('utf-8')
+
+
+def reseal(env, key, stored_value, encoded_value):
+    """Returns the value to store for encoded_value, given the currently stored value.
+
+    If the stored value already holds the same content it is kept as it is, so rewriting
+    an unchanged value does not produce a new ciphertext (and a spurious history change).
+    """
+    if is_sealed(stored_value) and enabled():
+        try:
+            if unseal(env, key, stored_value) == encoded_value:
+                return stored_value
+        except DecryptionError:
+            pass
+    return seal(env, key, encoded_value)
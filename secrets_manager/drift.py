@@ -0,0 +1,110 @@
+import os
+import json
+import shlex
+
+import yaml
+
+from secrets_manager import layers, audit
+from secrets_manager.storage import env_path
+from secrets_manager.importer import parse_documents
+from secrets_manager.mappings import DRIFT_MAPPINGS, env_for_secret
+
+# Source name used in error messages about pasted text
+DUMP_LABEL = 'pasted YAML'
+
+
+def parse_dump(text, bare_name=None):
+    """Parses a `kubectl get secret(s) -o yaml` dump with one or many Secrets.
+
+    A bare `data:` block (as accepted by the bulk paste) is read as a Secret named
+    bare_name, when given. Returns (secrets, errors) like importer.parse_manifest().
+    """
+    try:
+        docs = [doc for doc in yaml.safe_load_all(text) if doc is not None]
+    except yaml.YAMLError as e:
+        return [], [f"Error parsing YAML: {e}"]
+    if bare_name and len(docs) == 1 and isinstance(docs[0], dict) and 'kind' not in docs[0] \
+            and isinstance(docs[0].get('data'), dict):
+        docs = [dict(docs[0], kind='Secret', metadata={'name': bare_name})]
+    try:
+        return parse_documents(docs, DUMP_LABEL)
+    except (AttributeError, TypeError, ValueError) as e:
+        # A shape parse_documents() doesn't check for; reported instead of failing the request
+        return [], [f"Malformed Secret in the {DUMP_LABEL}: {e}"]
+
+
+def diff_data(stored, live):
+    """Compares {key: base64_value} maps of an env and a live Secret, without decoding values.
+
+    Returns {'added': keys only in the env, 'removed': keys only in the live Secret,
+    'changed': keys whose values differ, 'unchanged': number of equal keys}; the names
+    describe what applying the env to the cluster would do.
+    """
+    return {
+        'added': sorted(stored.keys() - live.keys()),
+        'removed': sorted(live.keys() - stored.keys()),
+        'changed': sorted(key for key in stored.keys() & live.keys() if stored[key] != live[key]),
+        'unchanged': sum(1 for key in stored.keys() & live.keys() if stored[key] == live[key]),
+    }
+
+
+def merge_patch(stored, diff):
+    """Returns the smallest JSON merge patch (RFC 7386) that makes a live Secret match the env."""
+    data = {key: stored[key] for key in diff['added'] + diff['changed']}
+    data.update((key, None) for key in diff['removed'])
+    return {'data': data} if data else {}
+
+
+def kubectl_command(name, namespace, patch):
+    """Returns the `kubectl patch` command applying a merge patch to a Secret."""
+    return (f"kubectl patch secret {shlex.quote(name)} -n {shlex.quote(namespace)} --type merge "
+            f"-p {shlex.quote(json.dumps(patch, separators=(',', ':')))}")
+
+
+def check_drift(text, env=None, env_from='name'):
+    """Compares the Secrets in a pasted dump with the stored envs (including inherited keys).
+
+    A dump with a single Secret (or a bare data block) is compared with `env` when given;
+    otherwise each Secret is matched to an env with env_from. The dump is parsed once and
+    each env read once, however many Secrets refer to it. Returns a summary dict with
+    'secrets' (one entry per compared Secret: 'name', 'namespace', 'env', the diff_data()
+    lists, 'patch' and 'command'; patch and command are None when there is no drift),
+    'drifted' (number of Secrets with drift) and 'errors'.
+    """
+    if env_from not in DRIFT_MAPPINGS:
+        raise ValueError(f"env_from must be one of {', '.join(DRIFT_MAPPINGS)}")
+    secrets, errors = parse_dump(text, bare_name=env)
+    if not secrets and not errors:
+        errors.append('No Secret found in the pasted YAML.')
+    if env is not None and len(secrets) != 1:
+        env = None
+
+    stored_envs = {}
+    results = []
+    for secret in secrets:
+        secret_env = env or env_for_secret(secret, env_from)
+        if secret_env is None or not os.path.exists(env_path(secret_env)):
+            errors.append(f"{secret['name']} ({secret['namespace']}): no environment "
+                          f"'{secret_env or secret['name']}' to compare with")
+            continue
+        if secret_env not in stored_envs:
+            stored_envs[secret_env] = {key: value for key, value, _ in layers.iter_resolved(secret_env)}
+        stored = stored_envs[secret_env]
+        diff = diff_data(stored, secret['data'])
+        patch = merge_patch(stored, diff)
+        if patch:
+            # The patch carries values of the env
+            audit.record('export', secret_env, diff['added'] + diff['changed'])
+        results.append({
+            'name': secret['name'],
+            'namespace': secret['namespace'],
+            'env': secret_env,
+            **diff,
+            'patch': patch or None,
+            'command': kubectl_command(secret['name'], secret['namespace'], patch) if patch else None,
+        })
+    return {
+        'secrets': results,
+        'drifted': sum(1 for result in results if result['patch']),
+        'errors': errors,
+    }
@@ -0,0 +1,190 @@
+import json
+import time
+import queue
+import threading
+
+from secrets_manager import history, layers
+
+# Change feed for open pages. Every write bumps the env's version in its history meta
+# file, from whichever worker made it. One watcher thread per process stats the meta file
+# of each env someone is subscribed to and, when it changed, reads the new versions once
+# and hands them to every subscriber, so the cost doesn't grow with the number of clients.
+
+# How often the watcher checks the subscribed envs for new versions
+POLL_INTERVAL = 0.5
+
+# A comment is sent this often when nothing changes, so proxies keep the stream open and
+# a client that went away is noticed
+KEEPALIVE_INTERVAL = 15
+
+# A stream is ended after this long; the browser reconnects by itself, passing the last
+# event id, so no change is missed and no worker thread is held forever
+STREAM_MAX_AGE = 300
+
+# Each open stream holds a server thread for its whole life (gthread workers run 8), so
+# a process serves at most this many at once and keeps the other threads for ordinary
+# requests. Pages turned away poll poll_changes() instead.
+MAX_STREAMS = 4
+
+# env -> set of subscriber queues
+_subscribers = {}
+# env -> latest version handed to subscribers
+_versions = {}
+_lock = threading.Lock()
+_watcher = None
+_stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+def _storage():
+    # Imported lazily because the storage layer imports the modules this one uses
+    from secrets_manager import storage
+    return storage
+
+
+def _event(env, change):
+    """Turns a version from history.changes_since() into a feed event."""
+    return {'env': env, 'version': change['version'],
+            'changes': [{'key': key, 'op': 'set'} for key in change['set']]
+            + [{'key': key, 'op': 'delete'} for key in change['deleted']]}
+
+
+def _publish(env, changes):
+    """Hands each new version of an env to its subscribers. Called with _lock held."""
+    for change in changes:
+        event = _event(env, change)
+        for subscriber in _subscribers.get(env, ()):
+            subscriber.put(event)
+        _versions[env] = change['version']
+
+
+def _watch():
+    signatures = {}
+    while True:
+        time.sleep(POLL_INTERVAL)
+        with _lock:
+            envs = list(_subscribers)
+        for env in list(signatures):
+            if env not in envs:
+                del signatures[env]
+        for env in envs:
+            signature = _storage().file_signature(history.meta_path(env))
+            if signatures.get(env) == signature:
+                continue
+            signatures[env] = signature
+            try:
+                with _lock:
+                    if env in _versions:
+                        _publish(env, history.changes_since(env, _versions[env]))
+            except Exception as e:
+                print(f"Error reading the changes of env {env} for the change feed: {e}")
+
+
+def _subscribe(envs, since):
+    """Registers a queue for changes to envs after the versions in `since` ({env: version}).
+
+    Versions a subscriber missed (e.g. while reconnecting) are queued right away.
+    """
+    global _watcher
+    subscriber = queue.Queue()
+    with _lock:
+        if _watcher is None:
+            _watcher = threading.Thread(target=_watch, name='change-feed', daemon=True)
+            _watcher.start()
+        for env in envs:
+            if env not in _versions:
+                _versions[env] = history.current_version(env)
+            if since.get(env, _versions[env]) < _versions[env]:
+                missed = [change for change in history.changes_since(env, since[env])
+                          if change['version'] <= _versions[env]]
+                for change in missed:
+                    subscriber.put(_event(env, change))
+            _subscribers.setdefault(env, set()).add(subscriber)
+    return subscriber
+
+
+def _unsubscribe(envs, subscriber):
+    with _lock:
+        for env in envs:
+            subscribers = _subscribers.get(env)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscriber)
+            if not subscribers:
+                # Nobody watches the env any more; forget it so the watcher stops checking it
+                del _subscribers[env]
+                _versions.pop(env, None)
+
+
+def acquire_stream():
+    """Reserves one of this process's MAX_STREAMS stream slots; False if all are taken.
+
+    A reserved slot must be given back with release_stream() once the response is closed.
+    """
+    return _stream_slots.acquire(blocking=False)
+
+
+def release_stream():
+    _stream_slots.release()
+
+
+def poll_changes(env, since):
+    """Returns (events, position) with the changes to an env and the envs it inherits from after `since`.
+
+    For pages that poll instead of holding a stream open. Events are as in stream(), and
+    position is the feed position after them, to pass as `since` next time.
+    """
+    position = {layer: since.get(layer, history.current_version(layer)) for layer in layers.parent_chain(env)}
+    events = []
+    for layer in position:
+        for change in history.changes_since(layer, position[layer]):
+            events.append(_event(layer, change))
+            position[layer] = change['version']
+    return events, format_position(position)
+
+
+def current_position(env):
+    """Returns the feed position of an env as of now, as used in ?since= and event ids."""
+    return format_position({layer: history.current_version(layer) for layer in layers.parent_chain(env)})
+
+
+def format_position(versions):
+    """Formats {env: version} as 'env:version,...'."""
+    return ','.join(f"{env}:{version}" for env, version in versions.items())
+
+
+def parse_position(text):
+    """Parses 'env:version,...' into {env: version}, ignoring malformed parts."""
+    versions = {}
+    for part in (text or '').split(','):
+        env, sep, version = part.rpartition(':')
+        if sep and env and version.isdigit():
+            versions[env] = int(version)
+    return versions
+
+
+def stream(env, since):
+    """Yields Server-Sent Events with the changes to an env and the envs it inherits from.
+
+    Each event is a 'change' with data {"env", "version", "changes": [{"key", "op"}]},
+    where op is 'set' or 'delete' and env is the layer that changed. Its id is the feed
+    position after it, so a reconnecting browser resumes where it left off.
+    """
+    chain = layers.parent_chain(env)
+    position = {layer: since.get(layer, history.current_version(layer)) for layer in chain}
+    subscriber = _subscribe(chain, position)
+    try:
+        # Tells EventSource to reconnect quickly once the stream ends
+        yield 'retry: 1000\n\n'
+        deadline = time.monotonic() + STREAM_MAX_AGE
+        while time.monotonic() < deadline:
+            try:
+                event = subscriber.get(timeout=KEEPALIVE_INTERVAL)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            if event['version'] <= position.get(event['env'], 0):
+                continue
+            position[event['env']] = event['version']
+            yield f"id: {format_position(position)}\nevent: change\ndata: {json.dumps(event)}\n\n"
+    finally:
+        _unsubscribe(chain, subscriber)
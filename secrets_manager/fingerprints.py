@@ -0,0 +1,207 @@
+import os
+import hmac
+import json
+import hashlib
+
+from secrets_manager import crypto
+
+# Index of keyed hashes (HMAC-SHA256) of every stored value, kept in envs/.fingerprints/:
+#   env/<env>.json  {key: fingerprint} for one env, used to find a key's old fingerprint
+#   <xx>.json       {fingerprint: [[env, key], ...]} for fingerprints starting with xx
+#   meta.json       {"check": ...} marks the index as built with the current HMAC key
+# Looking up a value reads a single shard, so it costs the same no matter how many envs
+# or keys there are, and nothing is decoded or decrypted.
+
+# Fingerprints are hex, so the first two characters spread them over 256 shards
+SHARD_PREFIX_LENGTH = 2
+
+# Random HMAC keys read from disk, by path
+_file_keys = {}
+
+
+def _storage():
+    # Imported lazily because the storage layer imports this module
+    from secrets_manager import storage
+    return storage
+
+
+def _index_dir():
+    return os.path.join(_storage().envs_dir, '.fingerprints')
+
+
+def _read_json(path, default):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _hmac_key():
+    """Returns the key fingerprints are computed with.
+
+    With encryption at rest it is derived from the master secret, so the index does not
+    let anyone holding only the files confirm guesses of a value. Otherwise a random key
+    is kept beside the index.
+    """
+    key = crypto.fingerprint_key()
+    if key is not None:
+        return key
+    path = os.path.join(_index_dir(), 'key')
+    if path in _file_keys:
+        return _file_keys[path]
+    if not os.path.exists(path):
+        os.makedirs(_index_dir(), exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(os.urandom(32))
+        try:
+            # Another process may have created the key first; theirs wins
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path, 'rb') as f:
+        _file_keys[path] = f.read()
+    return _file_keys[path]
+
+
+def fingerprint(encoded_value, hmac_key=None):
+    """Returns the fingerprint of a Base64 encoded value."""
+    return hmac.new(hmac_key or _hmac_key(), encoded_value.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def _key_check(hmac_key):
+    # Tells whether the index was built with the same key (e.g. after encryption is turned on)
+    return fingerprint('index-check', hmac_key)
+
+
+def _is_built(hmac_key):
+    return _read_json(os.path.join(_index_dir(), 'meta.json'), {}).get('check') == _key_check(hmac_key)
+
+
+def _index_lock():
+    """Serializes changes to the index across processes. Taken after an env lock, never before."""
+    return _storage()._file_lock('.fingerprints')
+
+
+def _env_map_path(env):
+    return os.path.join(_index_dir(), 'env', f"{_storage().env_file_name(env)}.json")
+
+
+def _shard_path(fp):
+    return os.path.join(_index_dir(), f"{fp[:SHARD_PREFIX_LENGTH]}.json")
+
+
+def _apply(env, key_fps, shards):
+    """Points each key of env at its new fingerprint (None to drop it) in the loaded shards."""
+    env_map = _read_json(_env_map_path(env), {})
+    for key, fp in key_fps.items():
+        old_fp = env_map.pop(key, None)
+        if old_fp == fp:
+            env_map[key] = fp
+            continue
+        if old_fp is not None:
+            shard = shards.setdefault(old_fp[:SHARD_PREFIX_LENGTH], _read_json(_shard_path(old_fp), {}))
+            places = [place for place in shard.get(old_fp, []) if place != [env, key]]
+            if places:
+                shard[old_fp] = places
+            else:
+                shard.pop(old_fp, None)
+        if fp is not None:
+            shard = shards.setdefault(fp[:SHARD_PREFIX_LENGTH], _read_json(_shard_path(fp), {}))
+            shard.setdefault(fp, []).append([env, key])
+            env_map[key] = fp
+    return env_map
+
+
+def _save_shards(shards):
+    for prefix, shard in shards.items():
+        _storage()._write_json_atomic(os.path.join(_index_dir(), f"{prefix}.json"), shard)
+
+
+def record_changes(env, changed, deleted):
+    """Updates the index after a write. Must be called with the env lock held.
+
+    `changed` maps keys to their new Base64 values (not sealed); `deleted` lists removed
+    keys. Does nothing until the index has been built; building it picks up every write.
+    """
+    hmac_key = _hmac_key()
+    with _index_lock():
+        if not _is_built(hmac_key):
+            return
+        key_fps = {key: fingerprint(value, hmac_key) for key, value in changed.items()}
+        key_fps.update((key, None) for key in deleted)
+        shards = {}
+        env_map = _apply(env, key_fps, shards)
+        _save_shards(shards)
+        _storage()._write_json_atomic(_env_map_path(env), env_map)
+
+
+def drop_env(env):
+    """Removes every key of a deleted env from the index. Must be called with the env lock held."""
+    with _index_lock():
+        if not os.path.exists(_env_map_path(env)):
+            return
+        shards = {}
+        _apply(env, dict.fromkeys(_read_json(_env_map_path(env), {})), shards)
+        _save_shards(shards)
+        os.remove(_env_map_path(env))
+
+
+def rebuild(if_needed=False):
+    """Rebuilds the whole index from the env files, decrypting values if needed.
+
+    Runs once for a store that has no index yet, or whose HMAC key changed. With
+    if_needed=True nothing is done if another process built the index meanwhile.
+    Returns the number of values indexed.
+    """
+    storage = _storage()
+    hmac_key = _hmac_key()
+    with _index_lock():
+        if if_needed and _is_built(hmac_key):
+            return 0
+        shards = {}
+        env_maps = {}
+        for env in storage.get_envs():
+            env_map = env_maps[env] = {}
+            for key, value in storage.iter_secrets(env):
+                fp = fingerprint(value, hmac_key)
+                env_map[key] = fp
+                shards.setdefault(fp[:SHARD_PREFIX_LENGTH], {}).setdefault(fp, []).append([env, key])
+
+        # Start from an empty directory so entries of removed envs or an old key don't linger
+        index_dir = _index_dir()
+        if os.path.isdir(index_dir):
+            for root, dirs, files in os.walk(index_dir):
+                for name in files:
+                    if name.endswith('.json'):
+                        os.remove(os.path.join(root, name))
+        _save_shards(shards)
+        for env, env_map in env_maps.items():
+            storage._write_json_atomic(_env_map_path(env), env_map)
+        storage._write_json_atomic(os.path.join(index_dir, 'meta.json'), {'check': _key_check(hmac_key)})
+    return sum(len(env_map) for env_map in env_maps.values())
+
+
+def _ensure_built(hmac_key):
+    if not _is_built(hmac_key):
+        rebuild(if_needed=True)
+
+
+def where_used(encoded_value):
+    """Returns (env, key) pairs of every secret holding a Base64 value, sorted."""
+    hmac_key = _hmac_key()
+    _ensure_built(hmac_key)
+    fp = fingerprint(encoded_value, hmac_key)
+    return sorted(tuple(place) for place in _read_json(_shard_path(fp), {}).get(fp, []))
+
+
+def duplicates(env):
+    """Returns the groups of keys in an env that hold the same value, as sorted lists."""
+    _ensure_built(_hmac_key())
+    groups = {}
+    for key, fp in _read_json(_env_map_path(env), {}).items():
+        groups.setdefault(fp, []).append(key)
+    return sorted(sorted(keys) for keys in groups.values() if len(keys) > 1)
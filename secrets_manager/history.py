@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import bisect
+
+# Version history of each env, kept in envs/.history/<env>/ as segments:
+#   <S>.snapshot.json  the full env (ordered [key, value] pairs) as of version S
+#   <S>.deltas.jsonl   one line per later version: {"version", "time", "set", "deleted"}
+# A new segment is started once the deltas since the last snapshot add up to the size of
+# the snapshot itself, so rebuilding any version reads at most about twice the env size
+# and the snapshots never cost more space than the changes they summarize.
+
+# Also start a new segment after this many versions, to bound the number of deltas replayed
+MAX_SEGMENT_DELTAS = 500
+
+
+def _storage():
+    # Imported lazily because the storage layer imports this module
+    from secrets_manager import storage
+    return storage
+
+
+def _history_root():
+    return os.path.join(_storage().envs_dir, '.history')
+
+
+def _history_dir(env):
+    return os.path.join(_history_root(), _storage().env_file_name(env))
+
+
+def meta_path(env):
+    """Returns the path of an env's history meta file, which is replaced on every write to the env."""
+    return os.path.join(_history_dir(env), 'meta.json')
+
+
+def _load_meta(env):
+    try:
+        with open(meta_path(env), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _segments(env):
+    """Returns the sorted start versions of all segments of an env's history."""
+    try:
+        names = os.listdir(_history_dir(env))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name.split('.')[0]) for name in names if name.endswith('.snapshot.json'))
+
+
+def _start_segment(env, version, state, meta):
+    """Writes a full snapshot of state as version and makes it the current segment."""
+    path = os.path.join(_history_dir(env), f"{version:010d}.snapshot.json")
+    _storage()._write_json_atomic(path, [[key, value] for key, value in state])
+    meta.update(segment=version, segment_deltas=0, segment_bytes=0, snapshot_bytes=os.path.getsize(path))
+
+
+def _iter_deltas(env, segment):
+    try:
+        with open(os.path.join(_history_dir(env), f"{segment:010d}.deltas.jsonl"), encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break # Still being appended by a writer in another process
+                if line.strip():
+                    yield json.loads(line)
+    except FileNotFoundError:
+        return
+
+
+def current_version(env):
+    """Returns the latest version number of an env (0 if it has no history yet)."""
+    meta = _load_meta(env)
+    return meta['version'] if meta else 0
+
+
+def ensure_started(env, load_state):
+    """Starts the history of an env with its current content as version 0, if not started yet.
+
+    `load_state` returns the current (key, value) pairs and is only called when needed.
+    Must be called with the env lock held, before the env is changed.
+    """
+    if _load_meta(env) is not None:
+        return
+    os.makedirs(_history_dir(env), exist_ok=True)
+    now = time.time()
+    meta = {'version': 0, 'time': now, 'started': now}
+    _start_segment(env, 0, load_state(), meta)
+    _storage()._write_json_atomic(meta_path(env), meta)
+
+
+def record_version(env, changed, deleted, load_state):
+    """Records a write as a new version holding only the changed and deleted keys.
+
+    `load_state` returns the env content after the write; it is only called when a new
+    snapshot is due. Must be called with the env lock held. Returns the env's version.
+    """
+    meta = _load_meta(env)
+    if not changed and not deleted:
+        return meta['version']
+
+    version = meta['version'] + 1
+    now = time.time()
+    line = json.dumps({'version': version, 'time': now, 'set': changed, 'deleted': sorted(deleted)},
+                      separators=(',', ':')) + '\n'
+    with open(os.path.join(_history_dir(env), f"{meta['segment']:010d}.deltas.jsonl"), 'a', encoding='utf-8') as f:
+        f.write(line)
+    meta.update(version=version, time=now,
+                segment_deltas=meta['segment_deltas'] + 1,
+                segment_bytes=meta['segment_bytes'] + len(line))
+
+    if meta['segment_bytes'] >= meta['snapshot_bytes'] or meta['segment_deltas'] >= MAX_SEGMENT_DELTAS:
+        _start_segment(env, version, load_state(), meta)
+    _storage()._write_json_atomic(meta_path(env), meta)
+    return version
+
+
+def get_version_state(env, version):
+    """Rebuilds an env as of a version. Returns an ordered {key: value} dict, or None if unknown."""
+    meta = _load_meta(env)
+    if meta is None or not 0 <= version <= meta['version']:
+        return None
+    segments = _segments(env)
+    segment = segments[bisect.bisect_right(segments, version) - 1]
+
+    with open(os.path.join(_history_dir(env), f"{segment:010d}.snapshot.json"), encoding='utf-8') as f:
+        state = dict(json.load(f))
+    for delta in _iter_deltas(env, segment):
+        if delta['version'] > version:
+            break
+        state.update(delta['set'])
+        for key in delta['deleted']:
+            state.pop(key, None)
+    return state
+
+
+def changes_since(env, version):
+    """Lists the versions after `version`, oldest first, with the keys each one set or deleted.
+
+    Only the segments holding those versions are read.
+    """
+    segments = _segments(env)
+    first = max(0, bisect.bisect_right(segments, version) - 1)
+    versions = []
+    for segment in segments[first:]:
+        for delta in _iter_deltas(env, segment):
+            if delta['version'] > version:
+                versions.append({'version': delta['version'], 'time': delta['time'],
+                                 'set': list(delta['set']), 'deleted': delta['deleted']})
+    return versions
+
+
+def list_versions(env):
+    """Lists all versions of an env, oldest first, with the keys each one set or deleted.
+
+    Version 0 is the content the env had when its history started. It is listed first,
+    with 'baseline': True and no keys, since listing them would mean reading its snapshot.
+    """
+    meta = _load_meta(env)
+    if meta is None:
+        return []
+    started = meta.get('started')
+    if started is None:
+        # Histories started before the start time was kept in the meta file
+        started = os.path.getmtime(os.path.join(_history_dir(env), f"{0:010d}.snapshot.json"))
+    baseline = {'version': 0, 'time': started, 'set': [], 'deleted': [], 'baseline': True}
+    return [baseline] + changes_since(env, 0)
+
+
+def diff_states(old, new):
+    """Compares two {key: value} states by key and encoded value."""
+    return {
+        'added': [key for key in new if key not in old],
+        'removed': [key for key in old if key not in new],
+        'changed': [key for key in new if key in old and old[key] != new[key]],
+    }
+
@@ -0,0 +1,203 @@
+import os
+import re
+import base64
+import tarfile
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+from secrets_manager.storage import save_secrets
+from secrets_manager.mappings import ENV_MAPPINGS, env_for_secret
+
+# File types picked up from a directory or archive
+MANIFEST_EXTENSIONS = ('.yaml', '.yml', '.json')
+ARCHIVE_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.zip')
+
+# Below this many files, parsing in-process is cheaper than starting a process pool
+POOL_THRESHOLD = 8
+
+# How pool processes are started. The web app imports from a threaded worker, and a
+# process forked while other threads hold locks can hang on them, so workers are started
+# fresh instead of forked
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Keys allowed in a Kubernetes Secret's data/stringData
+_KEY_RE = re.compile(r'^[-._a-zA-Z0-9]+$')
+
+
+def _is_manifest(name):
+    return name.lower().endswith(MANIFEST_EXTENSIONS)
+
+
+def _is_archive(name):
+    return name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def collect_sources(path):
+    """Lists the manifest files to import from a directory, an archive or a single file.
+
+    Returns (name, content) pairs. Files on disk are returned with content None so the
+    workers read them themselves; archive members are read up front.
+    """
+    if os.path.isdir(path):
+        sources = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            sources.extend((os.path.join(root, f), None) for f in sorted(files) if _is_manifest(f))
+        return sources
+
+    lower = path.lower()
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            return [(info.filename, archive.read(info)) for info in archive.infolist()
+                    if not info.is_dir() and _is_manifest(info.filename)]
+    if _is_archive(lower):
+        with tarfile.open(path) as archive:
+            return [(member.name, archive.extractfile(member).read()) for member in archive.getmembers()
+                    if member.isfile() and _is_manifest(member.name)]
+    return [(path, None)]
+
+
+def _secret_docs(doc):
+    """Yields the Secret objects in a parsed YAML document, unwrapping `kind: List`."""
+    if not isinstance(doc, dict):
+        return
+    if doc.get('kind') == 'List' and isinstance(doc.get('items'), list):
+        for item in doc['items']:
+            yield from _secret_docs(item)
+    elif doc.get('kind') == 'Secret':
+        yield doc
+
+
+def _validate_secret(doc, errors, label):
+    """Returns the validated data of a Secret as {key: base64_value}, recording problems in errors."""
+    data = {}
+    for key, val in (doc.get('data') or {}).items():
+        key = str(key)
+        if not _KEY_RE.match(key):
+            errors.append(f"{label}: invalid key '{key}'")
+        elif not isinstance(val, str):
+            errors.append(f"{label}: non-string value for key '{key}'")
+        else:
+            try:
+                base64.b64decode(val, validate=True)
+                data[key] = val
+            except ValueError:
+                errors.append(f"{label}: invalid base64 for key '{key}'")
+    # stringData holds plain values, which take precedence over data like in Kubernetes
+    for key, val in (doc.get('stringData') or {}).items():
+        key = str(key)
+        if not _KEY_RE.match(key):
+            errors.append(f"{label}: invalid key '{key}'")
+        elif val is None or isinstance(val, (dict, list)):
+            errors.append(f"{label}: non-string value for key '{key}'")
+        else:
+            data[key] = base64.b64encode(str(val).encode('utf-8')).decode('utf-8')
+    return data
+
+
+def parse_manifest(source):
+    """Parses and validates one manifest file. Runs in a worker process.
+
+    Returns (secrets, errors) where secrets is a list of
+    {'name', 'namespace', 'data', 'source'} dicts.
+    """
+    name, content = source
+    try:
+        if content is None:
+            with open(name, 'rb') as f:
+                content = f.read()
+        docs = list(yaml.safe_load_all(content))
+    except Exception as e:
+        return [], [f"{name}: could not be parsed: {e}"]
+    return parse_documents(docs, name)
+
+
+def parse_documents(docs, name):
+    """Extracts and validates the Secrets in already parsed YAML documents from source `name`.
+
+    Returns (secrets, errors) like parse_manifest().
+    """
+    secrets = []
+    errors = []
+    for doc in docs:
+        for secret in _secret_docs(doc):
+            metadata = secret.get('metadata')
+            if metadata is not None and not isinstance(metadata, dict):
+                errors.append(f"{name} (unnamed): Secret metadata must be a mapping")
+                continue
+            metadata = metadata or {}
+            secret_name = str(metadata.get('name') or '')
+            label = f"{name} ({secret_name or 'unnamed'})"
+            if not secret_name:
+                errors.append(f"{label}: Secret has no metadata.name")
+                continue
+            malformed = [field for field in ('data', 'stringData')
+                         if secret.get(field) is not None and not isinstance(secret[field], dict)]
+            if malformed:
+                # Skipped whole rather than imported as an empty env
+                errors.append(f"{label}: {' and '.join(malformed)} must be a mapping of keys to values")
+                continue
+            secrets.append({
+                'name': secret_name,
+                'namespace': str(metadata.get('namespace') or 'default'),
+                'data': _validate_secret(secret, errors, label),
+                'source': name,
+            })
+    return secrets, errors
+
+
+def import_manifests(path, env_from='name', workers=None, dry_run=False):
+    """Imports every Secret manifest under path (a directory, archive or single file).
+
+    Files are parsed and validated in a process pool; the results are merged per env
+    and each env is then written once. Returns a summary dict with 'files', 'secrets',
+    'envs' ({env: number of keys}) and 'errors'.
+    """
+    if env_from not in ENV_MAPPINGS:
+        raise ValueError(f"env_from must be one of {', '.join(ENV_MAPPINGS)}")
+
+    sources = collect_sources(path)
+    if len(sources) < POOL_THRESHOLD or workers == 1:
+        results = [parse_manifest(source) for source in sources]
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(POOL_START_METHOD)) as executor:
+            # Hand each worker several files at a time to keep IPC overhead low
+            chunksize = max(1, len(sources) // (workers * 4))
+            results = list(executor.map(parse_manifest, sources, chunksize=chunksize))
+
+    errors = []
+    merged = {}
+    origins = {}
+    secret_count = 0
+    for secrets, parse_errors in results:
+        errors.extend(parse_errors)
+        for secret in secrets:
+            env = env_for_secret(secret, env_from)
+            if env is None:
+                errors.append(f"{secret['source']} ({secret['name']}): cannot map to a valid env name")
+                continue
+            secret_count += 1
+            env_data = merged.setdefault(env, {})
+            for key in secret['data']:
+                if key in env_data:
+                    errors.append(f"{secret['source']} ({secret['name']}): key '{key}' in env '{env}' "
+                                  f"also set by {origins[env, key]}, last one wins")
+                origins[env, key] = secret['source']
+            env_data.update(secret['data'])
+
+    if not dry_run:
+        # One write per env, no matter how many Secrets were merged into it
+        for env, data in merged.items():
+            if not save_secrets(env, data):
+                errors.append(f"Could not write env '{env}'")
+
+    return {
+        'files': len(sources),
+        'secrets': secret_count,
+        'envs': {env: len(data) for env, data in merged.items()},
+        'errors': errors,
+    }
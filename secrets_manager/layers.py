@@ -0,0 +1,149 @@
+import os
+from collections import OrderedDict
+
+from secrets_manager import crypto
+
+# An env may inherit from a parent env, named in envs/.parents/<env>. The env's own CSV
+# then holds only its overrides and additions; everything else is read from the parent
+# chain. Keys are resolved from the root of the chain down, so nearer layers win.
+
+# Longest parent chain followed; anything deeper is treated as a misconfiguration
+MAX_CHAIN_DEPTH = 16
+
+# Resolved views kept per worker, least recently used first
+RESOLVED_CACHE_SIZE = 32
+
+# env -> (signature of the chain it was built from, {key: (stored_value, source_env)})
+_resolved_cache = OrderedDict()
+
+
+class LayerError(ValueError):
+    """An invalid parent assignment (unknown env, or one that would create a cycle)."""
+
+
+def _storage():
+    # Imported lazily because the storage layer imports this module
+    from secrets_manager import storage
+    return storage
+
+
+def _parents_dir():
+    return os.path.join(_storage().envs_dir, '.parents')
+
+
+def _parent_path(env):
+    return os.path.join(_parents_dir(), _storage().env_file_name(env))
+
+
+def get_parent(env):
+    """Returns the name of the env's parent, or None if it doesn't inherit."""
+    try:
+        with open(_parent_path(env), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def parent_chain(env):
+    """Returns [env, parent, grandparent, ...], stopping at a cycle or MAX_CHAIN_DEPTH."""
+    chain = [env]
+    parent = get_parent(env)
+    while parent is not None and parent not in chain and len(chain) < MAX_CHAIN_DEPTH:
+        chain.append(parent)
+        parent = get_parent(parent)
+    return chain
+
+
+def children(env):
+    """Lists the envs that name env as their parent."""
+    try:
+        names = os.listdir(_parents_dir())
+    except FileNotFoundError:
+        return []
+    envs = (_storage().env_from_file_name(name) for name in names if not name.startswith('.'))
+    return sorted(child for child in envs if get_parent(child) == env)
+
+
+def set_parent(env, parent):
+    """Makes env inherit from parent, or stops it inheriting when parent is None.
+
+    Raises LayerError if the parent doesn't exist or would make the chain loop.
+    """
+    storage = _storage()
+    if not storage.is_valid_env_name(env) or not os.path.exists(storage.env_path(env)):
+        raise LayerError(f"Environment '{env}' not found.")
+    path = _parent_path(env)
+    if parent is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    if not storage.is_valid_env_name(parent) or not os.path.exists(storage.env_path(parent)):
+        raise LayerError(f"Parent environment '{parent}' not found.")
+    if env in parent_chain(parent):
+        raise LayerError(f"'{env}' cannot inherit from '{parent}': '{parent}' already inherits from '{env}'.")
+    storage._write_file_atomic(path, parent)
+
+
+def _chain_signature(chain):
+    storage = _storage()
+    return tuple((layer, storage.file_signature(storage.env_path(layer)), storage.file_signature(_parent_path(layer)))
+                 for layer in chain)
+
+
+def _resolve(chain):
+    """Builds {key: (stored_value, source_env)} for a chain; values stay sealed."""
+    storage = _storage()
+    resolved = {}
+    for layer in reversed(chain):
+        values = {}
+        for key, stored_value in storage.iter_stored(layer):
+            # A repeated key keeps its first row, as in get_secret_value()
+            values.setdefault(key, (stored_value, layer))
+        resolved.update(values)
+    return resolved
+
+
+def resolved_view(env):
+    """Returns the env's resolved {key: (stored_value, source_env)}, from the cache when no layer changed.
+
+    Checking the cache costs one stat per layer; the chain is only re-read after a write
+    to one of its layers or a change of parents.
+    """
+    chain = parent_chain(env)
+    signature = _chain_signature(chain)
+    cached = _resolved_cache.get(env)
+    if cached is not None and cached[0] == signature:
+        _resolved_cache.move_to_end(env)
+        return cached[1]
+    resolved = _resolve(chain)
+    _resolved_cache[env] = (signature, resolved)
+    _resolved_cache.move_to_end(env)
+    while len(_resolved_cache) > RESOLVED_CACHE_SIZE:
+        _resolved_cache.popitem(last=False)
+    return resolved
+
+
+def iter_resolved(env):
+    """Yields (key, encoded_value, source_env) for the env with inherited keys, decrypting one row at a time.
+
+    Envs without a parent are read straight from their file, exactly like iter_secrets().
+    """
+    if get_parent(env) is None:
+        for key, encoded_value in _storage().iter_secrets(env):
+            yield key, encoded_value, env
+        return
+    for key, (stored_value, source) in resolved_view(env).items():
+        # Values are sealed under the key of the layer that stores them
+        yield key, crypto.unseal(source, key, stored_value), source
+
+
+def get_resolved_value(env, key):
+    """Returns (encoded_value, source_env) for a key of the env or its parents, or None if missing."""
+    if get_parent(env) is None:
+        encoded_value = _storage().get_secret_value(env, key)
+        return None if encoded_value is None else (encoded_value, env)
+    entry = resolved_view(env).get(str(key))
+    if entry is None:
+        return None
+    stored_value, source = entry
+    return crypto.unseal(source, key, stored_value), source
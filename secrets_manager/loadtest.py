@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import time
+import base64
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode
+
+from secrets_manager import storage
+from secrets_manager.server import gunicorn_command
+
+# Routes the load test can drive, with the share of requests each gets by default
+DEFAULT_MIX = {'show': 40, 'show_all': 10, 'update_all': 20, 'bulk_confirm': 10, 'search_other_envs': 20}
+
+# Keys changed by each update_all / bulk_confirm request
+KEYS_PER_WRITE = 5
+
+# How long to wait for gunicorn to answer before giving up
+STARTUP_TIMEOUT = 30
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _encode(value):
+    return base64.b64encode(value.encode('utf-8')).decode('utf-8')
+
+
+def parse_mix(text):
+    """Parses 'show=40,update_all=20,...' into {route: weight}."""
+    mix = {}
+    for part in text.split(','):
+        route, sep, weight = part.partition('=')
+        route = route.strip()
+        if route not in DEFAULT_MIX or not sep:
+            raise argparse.ArgumentTypeError(f"expected ROUTE=WEIGHT with ROUTE one of {', '.join(DEFAULT_MIX)}, got {part!r}")
+        mix[route] = int(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError('at least one route needs a positive weight')
+    return mix
+
+
+def seed_store(env_count, key_count):
+    """Creates the envs the load test reads from, directly through the storage layer."""
+    envs = [f"load{i}" for i in range(env_count)]
+    for env in envs:
+        storage.update_env(env, {f"KEY_{n}": _encode(f"seed-{env}-{n}") for n in range(key_count)})
+    return envs
+
+
+class Client:
+    """One simulated user, sending requests one after another over its own connections.
+
+    Writes only touch keys owned by this client, so the last acknowledged value of each
+    key is known exactly and can be checked once the run is over.
+    """
+
+    def __init__(self, client_id, port, envs, key_count, mix, rng):
+        self.client_id = client_id
+        self.port = port
+        self.envs = envs
+        self.key_count = key_count
+        self.routes = list(mix)
+        self.weights = list(mix.values())
+        self.rng = rng
+        self.latencies = {route: [] for route in mix}
+        self.errors = {route: 0 for route in mix}
+        self.acknowledged = {} # (env, key) -> value of the last acknowledged write
+        self.sequence = 0
+
+    def _request(self, method, path, body=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body is not None else {}
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read() # Include the full body (e.g. a streamed page) in the latency
+            return response.status
+        finally:
+            conn.close()
+
+    def _owned_updates(self, env):
+        """Returns new values for a few of this client's keys in env."""
+        updates = {}
+        for _ in range(KEYS_PER_WRITE):
+            self.sequence += 1
+            key = f"LT_{self.client_id}_{self.rng.randrange(KEYS_PER_WRITE * 4)}"
+            updates[key] = f"value-{self.client_id}-{self.sequence}"
+        return updates
+
+    def _show(self):
+        env = self.rng.choice(self.envs)
+        return self._request('GET', '/show?' + urlencode({'env': env, 'key': f"KEY_{self.rng.randrange(self.key_count)}"})), None
+
+    def _show_all(self):
+        return self._request('GET', '/show_all?' + urlencode({'env': self.rng.choice(self.envs)})), None
+
+    def _search_other_envs(self):
+        query = {'current_env': self.rng.choice(self.envs), 'search_term': f"KEY_{self.rng.randrange(self.key_count)}"}
+        return self._request('GET', '/search_other_envs?' + urlencode(query)), None
+
+    def _update_all(self):
+        env = self.rng.choice(self.envs)
+        updates = self._owned_updates(env)
+        body = urlencode([('env', env)] + [('keys', key) for key in updates] + [('values', value) for value in updates.values()])
+        return self._request('POST', '/update_all', body), (env, updates)
+
+    def _bulk_confirm(self):
+        env = self.rng.choice(self.envs)
+        updates = self._owned_updates(env)
+        data = base64.b64encode(json.dumps({key: _encode(value) for key, value in updates.items()}).encode('utf-8'))
+        body = urlencode({'env': env, 'bulk_data_encoded_json': data.decode('utf-8')})
+        return self._request('POST', '/bulk_confirm', body), (env, updates)
+
+    def run(self, deadline):
+        while time.monotonic() < deadline:
+            route = self.rng.choices(self.routes, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                status, write = getattr(self, f"_{route}")()
+            except OSError:
+                status, write = None, None
+            self.latencies[route].append(time.perf_counter() - start)
+            # Writes answer with a redirect; anything else means the write was not acknowledged
+            if status is None or status >= 400 or (write is not None and status != 302):
+                self.errors[route] += 1
+            elif write is not None:
+                env, updates = write
+                for key, value in updates.items():
+                    self.acknowledged[env, key] = value
+
+
+def percentile(sorted_values, fraction):
+    """Returns the value below which `fraction` of the sorted values fall (nearest rank)."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def verify_writes(clients):
+    """Returns the acknowledged writes whose value is not in the store, as (env, key, expected, found)."""
+    missing = []
+    for client in clients:
+        for (env, key), value in client.acknowledged.items():
+            stored = storage.get_secret_value(env, key)
+            found = base64.b64decode(stored).decode('utf-8') if stored is not None else None
+            if found != value:
+                missing.append((env, key, value, found))
+    return missing
+
+
+def report(clients, elapsed, out=sys.stdout):
+    """Prints throughput and latency percentiles per route and returns the total error count."""
+    print(f"{'route':<20}{'requests':>10}{'req/s':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}", file=out)
+    total_errors = 0
+    for route in clients[0].latencies:
+        latencies = sorted(latency for client in clients for latency in client.latencies[route])
+        errors = sum(client.errors[route] for client in clients)
+        total_errors += errors
+        print(f"{route:<20}{len(latencies):>10}{len(latencies) / elapsed:>10.1f}{errors:>8}"
+              f"{percentile(latencies, 0.50) * 1000:>10.1f}{percentile(latencies, 0.95) * 1000:>10.1f}"
+              f"{percentile(latencies, 0.99) * 1000:>10.1f}", file=out)
+    total = sum(len(latencies) for client in clients for latencies in client.latencies.values())
+    print(f"{'total':<20}{total:>10}{total / elapsed:>10.1f}{total_errors:>8}", file=out)
+    return total_errors
+
+
+def _wait_until_ready(port, server):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {server.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not answer within {STARTUP_TIMEOUT}s")
+
+
+def run_load_test(args):
+    """Starts gunicorn on a scratch store, drives the workload and checks the writes. Returns an exit code."""
+    envs_dir = args.envs_dir or tempfile.mkdtemp(prefix='k8s-secret-manager-loadtest-')
+    storage.envs_dir = envs_dir
+
+    envs = seed_store(args.envs, args.keys)
+    port = _free_port()
+    command = gunicorn_command(bind=f"127.0.0.1:{port}", workers=args.workers)
+    print(f"Store: {envs_dir}")
+    print(f"Starting: {' '.join(command)}")
+    server_env = dict(os.environ, ENVS_DIR=envs_dir)
+    server = subprocess.Popen(command, env=server_env, stdout=subprocess.DEVNULL,
+                              stderr=None if args.verbose else subprocess.DEVNULL)
+    try:
+        _wait_until_ready(port, server)
+        rng = random.Random(args.seed)
+        clients = [Client(n, port, envs, args.keys, args.mix, random.Random(rng.random())) for n in range(args.clients)]
+        print(f"Running {args.clients} clients for {args.duration}s against {args.workers} worker(s)...")
+        start = time.monotonic()
+        deadline = start + args.duration
+        threads = [threading.Thread(target=client.run, args=(deadline,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    errors = report(clients, elapsed)
+    acknowledged = sum(len(client.acknowledged) for client in clients)
+    missing = verify_writes(clients)
+    for env, key, expected, found in missing[:20]:
+        print(f"LOST WRITE {env}/{key}: expected {expected!r}, found {found!r}")
+    print(f"Verified {acknowledged} acknowledged key write(s): {len(missing)} missing or stale.")
+    if missing or errors:
+        print(f"Store kept for inspection: {envs_dir}")
+        return 1
+    if not args.envs_dir:
+        shutil.rmtree(envs_dir, ignore_errors=True)
+    return 0
+
+
+def build_parser():
+    """Builds the argument parser for the load test."""
+    parser = argparse.ArgumentParser(prog='k8s-secret-manager-loadtest',
+                                     description='Drive a mixed read/write workload against the app under gunicorn '
+                                                 'and check that every acknowledged write was kept.')
+    parser.add_argument('--workers', type=int, default=3, help='gunicorn worker processes (default: %(default)s)')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent simulated clients (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=20, help='seconds to run (default: %(default)s)')
+    parser.add_argument('--envs', type=int, default=4, help='environments to spread the load over (default: %(default)s)')
+    parser.add_argument('--keys', type=int, default=200, help='seeded keys per environment (default: %(default)s)')
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX),
+                        help='request mix as ROUTE=WEIGHT pairs (default: '
+                             + ','.join(f"{route}={weight}" for route, weight in DEFAULT_MIX.items()) + ')')
+    parser.add_argument('--seed', type=int, default=None, help='random seed, to repeat a run')
+    parser.add_argument('--envs-dir', help='scratch directory for the store (default: a new temporary directory)')
+    parser.add_argument('--verbose', action='store_true', help="show gunicorn's log output")
+    return parser
+
+
+def main(argv=None):
+    """Entry point for the k8s-secret-manager-loadtest script."""
+    args = build_parser().parse_args(argv)
+    sys.exit(run_load_test(args))
+
+
+if __name__ == '__main__':
+    main()
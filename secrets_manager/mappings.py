@@ -0,0 +1,28 @@
+from secrets_manager.storage import is_valid_env_name
+
+# How a Kubernetes Secret is mapped to an env, shared by the manifest importer and the
+# drift check. Kept apart from them so the CLI can offer the choices without loading
+# yaml or the process pool.
+
+# By the Secret's name, its namespace, or both, either as "<namespace>-<name>" or as the
+# hierarchical "<namespace>/<name>"
+ENV_MAPPINGS = ('name', 'namespace', 'namespace-name', 'namespace/name')
+
+# Mapping by namespace alone would compare many Secrets with one env, so the drift check
+# doesn't offer it
+DRIFT_MAPPINGS = ('name', 'namespace-name', 'namespace/name')
+
+
+def env_for_secret(secret, env_from='name'):
+    """Returns the env name a parsed Secret maps to, or None if it isn't a valid env name."""
+    if env_from == 'namespace':
+        env = secret['namespace']
+    elif env_from == 'namespace-name':
+        env = f"{secret['namespace']}-{secret['name']}"
+    elif env_from == 'namespace/name':
+        env = f"{secret['namespace']}/{secret['name']}"
+    else:
+        env = secret['name']
+    # Kubernetes names may contain dots, env names may not
+    env = env.lower().replace('.', '-')
+    return env if is_valid_env_name(env) else None
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import secrets
+
+from flask import g, session
+
+from secrets_manager import storage
+
+# Flashed messages, kept on the server instead of in Flask's cookie session. A request's
+# messages are written to envs/.flashes/<id>.json when it ends, and the session holds only
+# that id, so the cookie stays the same small size however many messages an operation
+# produces. Messages not shown within MESSAGE_TTL are dropped, as is anything beyond
+# MAX_STORED entries.
+SESSION_KEY = '_flash_id'
+
+# Messages left unread this long (e.g. the user closed the tab) are dropped
+MESSAGE_TTL = 10 * 60
+
+# Entries kept at most, across all users; the oldest go first
+MAX_STORED = 1000
+
+# Messages shown at once; the rest are folded into a last one listing them
+MAX_MESSAGES = 20
+
+# Detail lines kept per message
+MAX_DETAILS = 200
+
+# How often a process removes expired entries
+PRUNE_INTERVAL = 60
+
+_last_pruned = 0
+
+
+class Message(str):
+    """A flashed message; details, if any, are extra lines shown under it (e.g. the skipped keys)."""
+
+    def __new__(cls, text, details=()):
+        message = super().__new__(cls, text)
+        message.details = list(details)
+        return message
+
+
+def _flashes_dir():
+    return os.path.join(storage.envs_dir, '.flashes')
+
+
+def _entry_path(entry_id):
+    return os.path.join(_flashes_dir(), f"{entry_id}.json")
+
+
+def flash(message, category='message', details=()):
+    """Queues a message for the next page shown to the user, like flask.flash().
+
+    Details are capped at MAX_DETAILS lines. A message already queued by the same request
+    isn't repeated, so errors hit once per key in a loop are shown once.
+    """
+    pending = g.setdefault('_flash_pending', [])
+    details = list(details)
+    if len(details) > MAX_DETAILS:
+        details = details[:MAX_DETAILS] + [f"... and {len(details) - MAX_DETAILS} more."]
+    if any(queued[0] == category and queued[1] == message for queued in pending):
+        return
+    pending.append([category, str(message), details])
+
+
+def _load(entry_id):
+    """Returns the messages of a stored entry and removes it; [] if it expired or is gone."""
+    if not entry_id or not isinstance(entry_id, str) or not entry_id.replace('-', '').replace('_', '').isalnum():
+        return []
+    path = _entry_path(entry_id)
+    try:
+        with open(path, encoding='utf-8') as f:
+            entry = json.load(f)
+        os.remove(path)
+    except (FileNotFoundError, ValueError):
+        return []
+    if entry.get('time', 0) < time.time() - MESSAGE_TTL:
+        return []
+    return entry.get('messages', [])
+
+
+def get_flashed_messages(with_categories=False, category_filter=()):
+    """Returns and clears the messages for this user, like flask.get_flashed_messages().
+
+    Messages are Message strings, so templates can show their details.
+    """
+    flashes = g.get('_flashes')
+    if flashes is None:
+        flashes = _load(session.pop(SESSION_KEY, None)) + g.pop('_flash_pending', [])
+        g._flashes = flashes = [(category, Message(message, details)) for category, message, details in flashes]
+    if category_filter:
+        flashes = [flash for flash in flashes if flash[0] in category_filter]
+    if not with_categories:
+        return [message for _, message in flashes]
+    return flashes
+
+
+def _fold(messages):
+    """Keeps the first MAX_MESSAGES messages, folding the rest into one listing them."""
+    if len(messages) <= MAX_MESSAGES:
+        return messages
+    rest = messages[MAX_MESSAGES - 1:]
+    details = [message for _, message, _ in rest][:MAX_DETAILS]
+    return messages[:MAX_MESSAGES - 1] + [['warning', f"... and {len(rest)} more message(s).", details]]
+
+
+def _save_pending(response):
+    """Stores the messages queued by this request, replacing the ones not yet shown."""
+    pending = g.pop('_flash_pending', None)
+    if not pending:
+        return response
+    try:
+        messages = _fold(_load(session.get(SESSION_KEY)) + pending)
+        entry_id = secrets.token_urlsafe(16)
+        storage._write_json_atomic(_entry_path(entry_id), {'time': time.time(), 'messages': messages})
+        session[SESSION_KEY] = entry_id
+        _prune()
+    except Exception as e:
+        print(f"Error saving flashed messages: {e}")
+    return response
+
+
+def _prune():
+    """Removes the oldest entries beyond MAX_STORED, and expired ones at most once per PRUNE_INTERVAL."""
+    global _last_pruned
+    now = time.time()
+    if now - _last_pruned < PRUNE_INTERVAL and len(os.listdir(_flashes_dir())) <= MAX_STORED:
+        return
+    _last_pruned = now
+    entries = []
+    for entry in os.scandir(_flashes_dir()):
+        try:
+            entries.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            pass
+    entries.sort(reverse=True)
+    for index, (mtime, path) in enumerate(entries):
+        if index >= MAX_STORED or mtime < now - MESSAGE_TTL:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def install(app):
+    """Makes an app's pages use the server-side message store instead of the cookie session."""
+    app.after_request(_save_pending)
+    app.jinja_env.globals['get_flashed_messages'] = get_flashed_messages
@@ -0,0 +1,200 @@
+import os
+import hmac
+import json
+import time
+import pstats
+import cProfile
+import itertools
+import threading
+import tracemalloc
+from urllib.parse import parse_qs
+
+# Single requests can be run under cProfile and tracemalloc on demand, by sending the
+# profiling token (a config secret) in the X-Profile-Token header or the _profile query
+# parameter. Without the token set, the middleware is never installed, so requests run
+# exactly as before. Results are kept in envs/.profiles/<id>.json (summary) and
+# <id>.prof (the full cProfile data, for pstats or snakeviz).
+PROFILE_TOKEN_VAR = 'SECRETS_PROFILE_TOKEN'
+
+PROFILE_HEADER = 'X-Profile-Token'
+PROFILE_QUERY_PARAM = '_profile'
+
+# Reading saved profiles takes the same token, but isn't itself profiled
+UNPROFILED_PATH_PREFIX = '/api/v1/profiles'
+
+# Functions (by cumulative time) and allocation sites (by size) kept in a summary
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 20
+
+# Frames recorded per allocation; one keeps tracemalloc's own overhead low
+TRACEMALLOC_FRAMES = 1
+
+# Oldest profiles beyond this many are removed
+MAX_PROFILES = 100
+
+# tracemalloc traces the whole process, so one request is profiled at a time; others
+# asking meanwhile run unprofiled
+_busy = threading.Lock()
+_counter = itertools.count(1)
+
+
+def _storage():
+    # Imported lazily because the storage layer imports the modules this one is used with
+    from secrets_manager import storage
+    return storage
+
+
+def profiles_dir():
+    return os.path.join(_storage().envs_dir, '.profiles')
+
+
+def token():
+    """Returns the configured profiling token, or None when profiling is off."""
+    return os.environ.get(PROFILE_TOKEN_VAR) or None
+
+
+def check_token(given):
+    """True if profiling is on and `given` is its token."""
+    expected = token()
+    return bool(expected and given) and hmac.compare_digest(given.encode('utf-8'), expected.encode('utf-8'))
+
+
+def _summarize(profiler, snapshot, peak, info):
+    stats = pstats.Stats(profiler)
+    functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+    return dict(info, functions=[
+        {'function': name, 'file': filename, 'line': line, 'calls': calls,
+         'total_time': round(total_time, 6), 'cumulative_time': round(cumulative_time, 6)}
+        for (filename, line, name), (_, calls, total_time, cumulative_time, _) in functions
+    ], allocations=[
+        {'file': stat.traceback[0].filename, 'line': stat.traceback[0].lineno, 'size': stat.size, 'count': stat.count}
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+    ], peak_memory=peak)
+
+
+def _save(profile_id, profiler, summary):
+    directory = profiles_dir()
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, f"{profile_id}.prof"))
+    _storage()._write_json_atomic(os.path.join(directory, f"{profile_id}.json"), summary, indent=1)
+    # Ids start with the time, so sorting them sorts by age
+    for old_id in list_profiles()[MAX_PROFILES:]:
+        for extension in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, old_id + extension))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles():
+    """Returns the ids of the saved profiles, newest first."""
+    try:
+        names = os.listdir(profiles_dir())
+    except FileNotFoundError:
+        return []
+    return sorted((name[:-5] for name in names if name.endswith('.json')), reverse=True)
+
+
+def load_profile(profile_id):
+    """Returns the summary of a saved profile, or None if there is no such profile."""
+    if profile_id not in list_profiles():
+        return None
+    with open(os.path.join(profiles_dir(), f"{profile_id}.json"), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def profile_data_path(profile_id):
+    """Returns the path of a profile's cProfile data, or None if there is no such profile."""
+    if profile_id not in list_profiles():
+        return None
+    return os.path.join(profiles_dir(), f"{profile_id}.prof")
+
+
+class ProfilingMiddleware:
+    """WSGI middleware running the requests that carry the profiling token under cProfile and tracemalloc.
+
+    The whole response is profiled, including bodies streamed after the view returned;
+    time spent by the server sending chunks is left out, of both the profile and its
+    duration. The profile id is returned in the X-Profile-Id response header.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def _requested(self, environ):
+        if environ.get('PATH_INFO', '').startswith(UNPROFILED_PATH_PREFIX):
+            return False
+        given = environ.get('HTTP_' + PROFILE_HEADER.upper().replace('-', '_'))
+        if given is None and PROFILE_QUERY_PARAM in environ.get('QUERY_STRING', ''):
+            given = (parse_qs(environ['QUERY_STRING']).get(PROFILE_QUERY_PARAM) or [None])[0]
+        return given is not None and check_token(given)
+
+    def __call__(self, environ, start_response):
+        if not self._requested(environ):
+            return self.wsgi_app(environ, start_response)
+        return self._profiled(environ, start_response)
+
+    def _unprofiled(self, environ, start_response):
+        body = self.wsgi_app(environ, start_response)
+        try:
+            yield from body
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    def _profiled(self, environ, start_response):
+        # Taken here rather than in __call__, so it is only held once the response is iterated
+        if not _busy.acquire(blocking=False):
+            yield from self._unprofiled(environ, start_response)
+            return
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_counter)}"
+        status = []
+
+        def capture_start_response(status_line, headers, exc_info=None):
+            status.append(status_line)
+            return start_response(status_line, headers + [('X-Profile-Id', profile_id)], exc_info)
+
+        profiler = cProfile.Profile()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        # Like the profiler, the clock only runs while the app is working on the response
+        duration = 0.0
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            body = self.wsgi_app(environ, capture_start_response)
+            try:
+                for chunk in body:
+                    profiler.disable()
+                    duration += time.perf_counter() - started
+                    yield chunk
+                    started = time.perf_counter()
+                    profiler.enable()
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+                profiler.disable()
+            duration += time.perf_counter() - started
+            try:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                info = {
+                    'id': profile_id, 'time': time.time(), 'method': environ.get('REQUEST_METHOD'),
+                    'path': environ.get('PATH_INFO'), 'status': status[0] if status else None,
+                    'duration': round(duration, 6),
+                }
+                _save(profile_id, profiler, _summarize(profiler, snapshot, peak, info))
+            except Exception as e:
+                # The response has been sent by now; losing its profile must not fail it
+                print(f"Error saving the profile of request {environ.get('PATH_INFO')}: {e}")
+        finally:
+            profiler.disable()
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            _busy.release()
+
+
+def install(app):
+    """Wraps a Flask app's WSGI callable with ProfilingMiddleware, only if a profiling token is set."""
+    if token():
+        app.wsgi_app = ProfilingMiddleware(app.wsgi_app)
@@ -0,0 +1,120 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from secrets_manager.storage import ENV_SEPARATOR, env_path, is_valid_env_name, get_envs, rewrite_keys
+
+OPERATIONS = ('rename', 'copy', 'delete')
+MATCH_MODES = ('prefix', 'regex')
+
+# Envs are rewritten concurrently; each holds only its own env lock
+MAX_WORKERS = 8
+
+
+def key_mapper(mode, pattern, replacement=''):
+    """Returns a function mapping a key to its new name, or to None if the key doesn't match.
+
+    In prefix mode the prefix is swapped for the replacement. In regex mode the pattern
+    must match the whole key and the replacement may use groups (\\1 or \\g<name>).
+    """
+    if mode not in MATCH_MODES:
+        raise ValueError(f"Match mode must be one of {', '.join(MATCH_MODES)}.")
+    if not pattern:
+        raise ValueError('A key pattern is required.')
+    if mode == 'prefix':
+        return lambda key: replacement + key[len(pattern):] if key.startswith(pattern) else None
+    try:
+        regex = re.compile(pattern)
+    except re.error as e:
+        raise ValueError(f"Invalid regular expression: {e}")
+
+    def map_key(key):
+        match = regex.fullmatch(key)
+        return match.expand(replacement) if match else None
+    return map_key
+
+
+def plan_keys(keys, operation, mapper):
+    """Works out ({new_key: old_key} copies, keys to delete) for one env's keys.
+
+    Raises ValueError if two keys would get the same new name, or a new name is empty.
+    """
+    copies = {}
+    matched = []
+    for key in keys:
+        new_key = mapper(key)
+        if new_key is None:
+            continue
+        matched.append(key)
+        if operation == 'delete':
+            continue
+        new_key = new_key.strip()
+        if not new_key:
+            raise ValueError(f"'{key}' would be renamed to an empty key.")
+        if new_key == key:
+            continue
+        if new_key in copies:
+            raise ValueError(f"'{copies[new_key]}' and '{key}' would both become '{new_key}'.")
+        copies[new_key] = key
+    if operation == 'copy':
+        return copies, []
+    if operation == 'delete':
+        return {}, matched
+    # A renamed key is removed unless another key was renamed to its name
+    return copies, [key for key in copies.values() if key not in copies]
+
+
+def _refactor_env(env, operation, mapper, dry_run):
+    try:
+        copies, deletes, overwritten = rewrite_keys(env, lambda keys: plan_keys(keys, operation, mapper), dry_run)
+    except ValueError as e:
+        # Conflicting new names; the env is left as it is
+        return env, None, f"{env}: {e}"
+    except Exception as e:
+        print(f"Error refactoring keys of env {env}: {e}")
+        return env, None, f"{env}: {e}"
+    if operation == 'delete':
+        changes = [[key, None] for key in deletes]
+    else:
+        changes = sorted([old_key, new_key] for new_key, old_key in copies.items())
+    return env, {'changes': changes, 'overwritten': overwritten}, None
+
+
+def refactor_keys(operation, mode, pattern, replacement='', envs=None, workers=None, dry_run=False):
+    """Renames, copies or deletes the keys matching a prefix or regex in several envs (all by default).
+
+    An entry of envs ending in '/' (e.g. "prod/") selects every env under that prefix. Each env is changed with one atomic write and its own version; envs are processed in
+    a thread pool. Returns a summary dict with 'envs' ({env: {'changes': [[old, new], ...],
+    'overwritten': [...]}} for envs with matching keys), 'keys' (number of keys changed),
+    and 'errors'. With dry_run=True the same summary is returned and nothing is written.
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"Operation must be one of {', '.join(OPERATIONS)}.")
+    mapper = key_mapper(mode, pattern, replacement)
+    errors = []
+    if envs:
+        selected = set()
+        for env in envs:
+            if env.endswith(ENV_SEPARATOR):
+                found = get_envs(env.rstrip(ENV_SEPARATOR))
+            else:
+                found = [env] if is_valid_env_name(env) and os.path.exists(env_path(env)) else []
+            if not found:
+                errors.append(f"{env}: environment not found")
+            selected.update(found)
+        envs = sorted(selected)
+    else:
+        envs = sorted(get_envs())
+    summary = {'envs': {}, 'keys': 0, 'errors': errors}
+
+    workers = workers or min(MAX_WORKERS, len(envs)) or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda env: _refactor_env(env, operation, mapper, dry_run), envs))
+
+    for env, result, error in results:
+        if error:
+            summary['errors'].append(error)
+        elif result['changes']:
+            summary['envs'][env] = result
+            summary['keys'] += len(result['changes'])
+    return summary
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import heapq
+import uuid
+import datetime
+import threading
+
+# Rotation metadata of each stored value, kept in envs/.rotation/<env>.json:
+#   {key: {"created": ..., "rotated": ..., "expires": ..., "owner": ...}}
+# Times are Unix timestamps. 'created' and 'rotated' are set by every write that adds a key
+# or changes its value; 'expires' and 'owner' are optional and set by hand. The env CSV
+# keeps only key,value, so exports and the key scanner are unaffected. Every change also
+# writes a new random token to envs/.rotation/.generation, so other processes can tell
+# whether anything changed by reading that one small file.
+
+# Secrets expiring within this many days are listed as expiring soon
+EXPIRING_SOON_DAYS = 14
+
+# How often the scheduler looks for metadata changed by other processes
+POLL_INTERVAL = 5.0
+
+# Every expiry known to this process, as a min-heap of (expires, env, key). Entries
+# whose expiry changed are left in place and skipped (_expiries holds the current ones),
+# and the heap is rebuilt once they outnumber the live ones.
+_heap = []
+_expiries = {}
+# Entries not yet expired when they were loaded, popped by the scheduler as they expire
+_timers = []
+# When _refresh() last looked for changes; expiries after it are still announced
+_refreshed_at = None
+# Metadata file name -> (signature it was loaded with, keys with an expiry)
+_loaded = {}
+# The generation token the metadata was last loaded at; _UNLOADED before the first load
+_UNLOADED = object()
+_generation = _UNLOADED
+_lock = threading.Lock()
+# The thread logging expiries, False if another process runs it
+_scheduler = None
+# Held locked for the life of the process that runs the scheduler
+_scheduler_lock_file = None
+
+
+def _storage():
+    # Imported lazily because the storage layer imports this module
+    from secrets_manager import storage
+    return storage
+
+
+def _metadata_dir():
+    return os.path.join(_storage().envs_dir, '.rotation')
+
+
+def _metadata_path(env):
+    return os.path.join(_metadata_dir(), f"{_storage().env_file_name(env)}.json")
+
+
+def parse_expiry(text):
+    """Parses an expiry given as an ISO date or date and time (local time) into a timestamp."""
+    try:
+        return datetime.datetime.fromisoformat(text.strip()).timestamp()
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid expiry '{text}'; use a date like 2026-12-31 or 2026-12-31T18:00.")
+
+
+def _generation_path():
+    return os.path.join(_metadata_dir(), '.generation')
+
+
+def _read_generation():
+    try:
+        with open(_generation_path(), encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _bump_generation():
+    """Tells other processes that some metadata changed."""
+    _storage()._write_file_atomic(_generation_path(), uuid.uuid4().hex)
+
+
+def get_metadata(env):
+    """Returns {key: metadata} for the stored keys of an env that have any."""
+    try:
+        with open(_metadata_path(env), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _update(env, change):
+    """Applies change(metadata) to an env's metadata file under a lock, atomically."""
+    storage = _storage()
+    with storage._file_lock(f".rotation-{storage.env_file_name(env)}"):
+        metadata = get_metadata(env)
+        change(metadata)
+        path = _metadata_path(env)
+        if not metadata:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return metadata
+        else:
+            storage._write_json_atomic(path, metadata)
+        _bump_generation()
+        return metadata
+
+
+def record_changes(env, changed, deleted):
+    """Stamps keys added or given a new value as rotated now and drops deleted keys.
+
+    Called by the storage layer after every write.
+    """
+    if not changed and not deleted:
+        return
+    now = time.time()
+
+    def change(metadata):
+        for key in changed:
+            entry = metadata.setdefault(key, {'created': now, 'expires': None, 'owner': None})
+            entry['rotated'] = now
+        for key in deleted:
+            metadata.pop(key, None)
+    _update(env, change)
+
+
+def restore(env, entries):
+    """Sets the whole metadata of some keys, e.g. to carry it over when keys are renamed."""
+    if entries:
+        _update(env, lambda metadata: metadata.update(entries))
+
+
+_UNSET = object()
+
+
+def set_metadata(env, key, expires=_UNSET, owner=_UNSET):
+    """Sets the expiry (a timestamp, or None to clear it) and/or owner of a stored key.
+
+    Returns the key's metadata. The caller checks that the key exists.
+    """
+    now = time.time()
+
+    def change(metadata):
+        entry = metadata.setdefault(key, {'created': now, 'rotated': now, 'expires': None, 'owner': None})
+        if expires is not _UNSET:
+            entry['expires'] = expires
+        if owner is not _UNSET:
+            entry['owner'] = owner or None
+    return _update(env, change)[key]
+
+
+def _set_expiry(env, key, expires, since):
+    """Points (env, key) at a new expiry in the heaps. Called with _lock held."""
+    if _expiries.get((env, key)) == expires:
+        return
+    if expires is None:
+        _expiries.pop((env, key), None)
+        return
+    _expiries[env, key] = expires
+    heapq.heappush(_heap, (expires, env, key))
+    if expires > since and _scheduler is not False:
+        heapq.heappush(_timers, (expires, env, key))
+
+
+def _refresh():
+    """Loads the metadata files changed since the last call. Called with _lock held.
+
+    The directory is only listed when the generation token changed, and only files
+    whose signature changed are read.
+    """
+    global _generation, _heap, _refreshed_at
+    storage = _storage()
+    now = time.time()
+    # An expiry set since the last check may already have passed; it is still announced
+    since = now if _refreshed_at is None else _refreshed_at
+    _refreshed_at = now
+    generation = _read_generation()
+    if generation == _generation:
+        return
+    _generation = generation
+    seen = set()
+    try:
+        entries = list(os.scandir(_metadata_dir()))
+    except FileNotFoundError:
+        entries = []
+    for entry in entries:
+        if not entry.name.endswith('.json'):
+            continue
+        seen.add(entry.name)
+        st = entry.stat()
+        file_signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        old_signature, old_keys = _loaded.get(entry.name, (None, set()))
+        if file_signature == old_signature:
+            continue
+        env = storage.env_from_file_name(entry.name[:-5])
+        try:
+            with open(entry.path, encoding='utf-8') as f:
+                metadata = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+        keys = {key for key, meta in metadata.items() if meta.get('expires') is not None}
+        for key in old_keys - keys:
+            _set_expiry(env, key, None, since)
+        for key in keys:
+            _set_expiry(env, key, metadata[key]['expires'], since)
+        _loaded[entry.name] = (file_signature, keys)
+    for name in set(_loaded) - seen:
+        env = storage.env_from_file_name(name[:-5])
+        for key in _loaded.pop(name)[1]:
+            _set_expiry(env, key, None, since)
+
+    if len(_heap) > 2 * len(_expiries) + 1000:
+        _heap = [(expires, env, key) for (env, key), expires in _expiries.items()]
+        heapq.heapify(_heap)
+
+
+def expiring_soon(within_days=EXPIRING_SOON_DAYS, prefix=''):
+    """Lists the secrets that expired or expire within `within_days`, soonest first.
+
+    Only the part of the heap up to the horizon is visited, so the cost depends on the
+    number of results, not on the number of secrets. Each result is a dict with 'env',
+    'key', 'expires' and 'expired'; prefix limits them to envs under a prefix.
+    """
+    now = time.time()
+    horizon = now + within_days * 24 * 60 * 60
+    found = {}
+    with _lock:
+        _refresh()
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            if i >= len(_heap) or _heap[i][0] > horizon:
+                continue
+            expires, env, key = _heap[i]
+            # An expiry set back to an earlier value is in the heap twice; it is listed once
+            if _expiries.get((env, key)) == expires and (not prefix or env == prefix or env.startswith(prefix + '/')):
+                found[env, key] = {'env': env, 'key': key, 'expires': expires, 'expired': expires <= now}
+            stack.extend((2 * i + 1, 2 * i + 2))
+    return sorted(found.values(), key=lambda item: (item['expires'], item['env'], item['key']))
+
+
+def _schedule():
+    while True:
+        with _lock:
+            _refresh()
+            now = time.time()
+            while _timers and _timers[0][0] <= now:
+                timer = heapq.heappop(_timers)
+                # An expiry set back to an earlier value has two timers; it is announced once
+                while _timers and _timers[0] == timer:
+                    heapq.heappop(_timers)
+                expires, env, key = timer
+                if _expiries.get((env, key)) == expires:
+                    print(f"Secret '{key}' in environment '{env}' has expired; rotate it.")
+            wait = min(POLL_INTERVAL, _timers[0][0] - now) if _timers else POLL_INTERVAL
+        time.sleep(max(wait, 0.1))
+
+
+def start():
+    """Loads every expiry once and starts the background scheduler.
+
+    Only one process (the first to get the lock) runs the scheduler and logs expiries;
+    the others still answer expiring_soon() from their own heap.
+    """
+    global _scheduler, _scheduler_lock_file
+    with _lock:
+        _refresh()
+        if _scheduler is not None:
+            return
+        # Without flock (Windows) every process gets the lock and logs expiries
+        lock_file = _storage()._acquire_lock('.rotation-scheduler', blocking=False)
+        if lock_file is None:
+            _scheduler = False
+            _timers.clear()
+            return
+        _scheduler_lock_file = lock_file
+        _scheduler = threading.Thread(target=_schedule, name='rotation-scheduler', daemon=True)
+        _scheduler.start()
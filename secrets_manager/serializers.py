@@ -0,0 +1,161 @@
+import base64
+import json
+from collections import namedtuple
+
+# A registered export format. `func(env, secrets)` takes an iterable of
+# (key, base64_encoded_value) pairs and yields the document as string chunks.
+Serializer = namedtuple('Serializer', ['name', 'label', 'func', 'mimetype', 'filename'])
+
+# Export formats by name, in registration order (used to build the export menu)
+SERIALIZERS = {}
+
+DEFAULT_FORMAT = 'data'
+
+
+def register_serializer(name, label, mimetype, filename):
+    """Decorator that registers a streaming serializer under a ?format= name.
+
+    `filename` is a template for the download name and may use `{env}`.
+    """
+    def decorator(func):
+        SERIALIZERS[name] = Serializer(name, label, func, mimetype, filename)
+        return func
+    return decorator
+
+
+def get_serializer(name):
+    """Returns the serializer registered under name, or None if there is no such format."""
+    return SERIALIZERS.get(name)
+
+
+# --- Helpers ---
+
+def _decode(encoded_value):
+    """Decodes a stored Base64 value to text, returning None if it is not valid Base64/UTF-8."""
+    try:
+        return base64.b64decode(encoded_value, validate=True).decode('utf-8')
+    except Exception:
+        return None
+
+
+def _quote(value):
+    """Quotes a string as a YAML double-quoted scalar (JSON strings are valid YAML)."""
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _dotenv_quote(value):
+    """Quotes a value for a dotenv file using double quotes and backslash escapes."""
+    escaped = (value.replace('\\', '\\\\')
+                    .replace('"', '\\"')
+                    .replace('\n', '\\n')
+                    .replace('\r', '\\r'))
+    return f'"{escaped}"'
+
+
+def _manifest_header(env):
+    """Yields the apiVersion/kind/metadata lines of a Secret manifest."""
+    yield 'apiVersion: v1\n'
+    yield 'kind: Secret\n'
+    yield 'metadata:\n'
+    yield f'  name: {_quote(env)}\n'
+    yield 'type: Opaque\n'
+
+
+# --- Formats ---
+
+@register_serializer('data', 'YAML data block', 'text/plain', '{env}_secrets.yaml')
+def serialize_data_block(env, secrets):
+    """Bare `data:` block, the same shape as the `data:` section of `kubectl get secret -o yaml`."""
+    yield 'data:'
+    empty = True
+    for key, encoded_value in secrets:
+        empty = False
+        # Use YAML-like indentation
+        yield f"\n  {key}: {encoded_value}"
+    if empty:
+        # Add a comment if no secrets are present
+        yield '\n  # No secrets defined for this environment'
+
+
+@register_serializer('secret', 'Secret manifest (data)', 'application/yaml', '{env}_secret.yaml')
+def serialize_secret_manifest(env, secrets):
+    """Full `kind: Secret` manifest with the stored Base64 values under `data:`."""
+    yield from _manifest_header(env)
+    yield 'data:'
+    empty = True
+    for key, encoded_value in secrets:
+        empty = False
+        yield f'\n  {key}: {encoded_value}'
+    yield ' {}\n' if empty else '\n'
+
+
+@register_serializer('stringdata', 'Secret manifest (stringData)', 'application/yaml', '{env}_secret.yaml')
+def serialize_string_data_manifest(env, secrets):
+    """Full `kind: Secret` manifest with decoded values under `stringData:`.
+
+    Values that are not valid UTF-8 cannot be written as stringData, so they are
+    collected and emitted unchanged in a trailing `data:` section.
+    """
+    yield from _manifest_header(env)
+    yield 'stringData:'
+    binary = []
+    empty = True
+    for key, encoded_value in secrets:
+        value = _decode(encoded_value)
+        if value is None:
+            binary.append((key, encoded_value))
+            continue
+        empty = False
+        yield f'\n  {key}: {_quote(value)}'
+    yield ' {}\n' if empty else '\n'
+    if binary:
+        yield 'data:\n'
+        for key, encoded_value in binary:
+            yield f'  {key}: {encoded_value}\n'
+
+
+@register_serializer('dotenv', 'dotenv (.env)', 'text/plain', '{env}.env')
+def serialize_dotenv(env, secrets):
+    """`KEY="value"` lines with decoded values, one per secret."""
+    for key, encoded_value in secrets:
+        value = _decode(encoded_value)
+        if value is None:
+            yield f'# {key}: skipped, value is not valid UTF-8\n'
+        else:
+            yield f'{key}={_dotenv_quote(value)}\n'
+
+
+@register_serializer('json', 'Secret manifest (JSON)', 'application/json', '{env}_secret.json')
+def serialize_json_manifest(env, secrets):
+    """Full Secret manifest as JSON with the stored Base64 values under `data`."""
+    yield '{"apiVersion": "v1", "kind": "Secret", '
+    yield f'"metadata": {{"name": {json.dumps(env)}}}, "type": "Opaque", "data": {{'
+    separator = ''
+    for key, encoded_value in secrets:
+        yield f'{separator}{json.dumps(key)}: {json.dumps(encoded_value)}'
+        separator = ', '
+    yield '}}\n'
+
+
+@register_serializer('kustomize', 'kustomize secretGenerator', 'application/yaml', '{env}_kustomization.yaml')
+def serialize_kustomize(env, secrets):
+    """kustomization.yaml with a `secretGenerator` entry holding the decoded values as literals."""
+    yield 'apiVersion: kustomize.config.k8s.io/v1beta1\n'
+    yield 'kind: Kustomization\n'
+    yield 'secretGenerator:\n'
+    yield f'- name: {_quote(env)}\n'
+    yield '  type: Opaque\n'
+    yield '  literals:'
+    skipped = []
+    empty = True
+    for key, encoded_value in secrets:
+        value = _decode(encoded_value)
+        if value is None:
+            # Literals are plain text; binary values have no representation here
+            skipped.append(key)
+            continue
+        empty = False
+        yield f'\n  - {_quote(f"{key}={value}")}'
+    yield ' []\n' if empty else '\n'
+    for key in skipped:
+        yield f'# {key}: skipped, value is not valid UTF-8\n'
@@ -0,0 +1,29 @@
+import os
+import sys
+
+# How the app is served in production, shared by run_server() and the load test so both
+# run the same server configuration. Kept out of the app module, which starts background
+# work when imported, so the load test can build the command without loading the app.
+
+# Defaults for the production-like server started by run_server()
+GUNICORN_WORKERS = 3
+# Threads per worker; an open page holds one for its change feed, up to feed.MAX_STREAMS
+# per worker, so the rest always serve ordinary requests
+GUNICORN_THREADS = 8
+GUNICORN_BIND = '127.0.0.1:5000'
+
+
+def gunicorn_command(bind=GUNICORN_BIND, workers=GUNICORN_WORKERS):
+    """Returns the gunicorn command line that serves the app; the executable comes first."""
+    # Find the gunicorn executable in the virtual environment
+    gunicorn_executable = os.path.join(sys.prefix, 'Scripts', 'gunicorn.exe') if sys.platform == "win32" else os.path.join(sys.prefix, 'bin', 'gunicorn')
+
+    # We pass the module path 'secrets_manager.app'
+    # Gunicorn will find the 'app' object within that module
+    return [
+        gunicorn_executable,
+        '--workers', str(workers), # Number of worker processes
+        '--worker-class', 'gthread', '--threads', str(GUNICORN_THREADS), # Long-lived change feeds don't block a whole worker
+        '--bind', bind, # Bind to localhost on port 5000 by default
+        'secrets_manager.app:app' # Module:app object
+    ]
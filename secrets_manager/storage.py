@@ -0,0 +1,762 @@
+import os
+import sys
+import csv
+import json
+import mmap
+import threading
+from contextlib import contextmanager
+
+from secrets_manager import history, crypto, fingerprints, layers, validation, audit, rotation, bundle
+
+try:
+    import fcntl
+except ImportError: # Windows has no flock; writes there are not serialized across processes
+    fcntl = None
+
+# Directory to store environment CSV files (relative to the project root)
+# We can keep this relative as the app will be run from the project root
+envs_dir = os.environ.get('ENVS_DIR', 'envs')
+
+# Env names may be hierarchical, e.g. "cluster/namespace/secret". Each level is a
+# directory, so envs/cluster/namespace/secret.csv, and listing one level reads only its
+# own directory however many envs there are in total.
+ENV_SEPARATOR = '/'
+MAX_ENV_DEPTH = 4
+
+# Columns of an env CSV file
+FIELDNAMES = ['key', 'value']
+
+# Largest CSV field read. The default (128 KB) is smaller than a file stored as a value,
+# which may be up to 1 MiB before Base64 encoding and encryption.
+MAX_FIELD_SIZE = 4 * 1024 * 1024
+csv.field_size_limit(MAX_FIELD_SIZE)
+
+# Bundles kept mapped per process for key lookups; each holds a file descriptor
+MAX_OPEN_BUNDLES = 64
+
+# env -> (bundle file signature, BundleReader), reused while the bundle is unchanged
+_bundles = {}
+
+
+def _flash_error(message):
+    """Shows an error to the user when called while handling a web request.
+
+    The storage layer is also used by the CLI, where there is no request (and Flask
+    may not even be imported), so outside a request only the printed log remains.
+    """
+    if 'flask' not in sys.modules:
+        return
+    from flask import has_request_context
+    if has_request_context():
+        from secrets_manager import messages
+        messages.flash(message, 'error')
+
+
+def env_path(env):
+    """Returns the path of the CSV file that stores an environment."""
+    *groups, name = env.split(ENV_SEPARATOR)
+    return os.path.join(envs_dir, *groups, f"{name}.csv")
+
+
+def env_file_name(env):
+    """Returns an env name as a single file name, for the files kept per env beside the store
+    (locks, history, indexes). Names can't contain dots, so '/' becomes '.'."""
+    return env.replace(ENV_SEPARATOR, '.')
+
+
+def env_from_file_name(name):
+    """Reverses env_file_name()."""
+    return name.replace('.', ENV_SEPARATOR)
+
+
+def _is_valid_segment(segment):
+    return bool(segment) and segment.replace('-', '').replace('_', '').isalnum()
+
+
+def is_valid_env_name(env):
+    """Checks that an environment name is alphanumeric, optionally with hyphens or underscores.
+
+    Hierarchical names ("cluster/namespace/secret") are checked level by level, up to
+    MAX_ENV_DEPTH levels.
+    """
+    if not env:
+        return False
+    segments = env.split(ENV_SEPARATOR)
+    return len(segments) <= MAX_ENV_DEPTH and all(_is_valid_segment(segment) for segment in segments)
+
+
+def file_signature(path):
+    """Returns (inode, mtime_ns, size) of a file, or None if it doesn't exist.
+
+    Every write replaces the file, so the signature changes whenever its content does.
+    """
+    try:
+        st = os.stat(path)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+    except FileNotFoundError:
+        return None
+
+
+def _prefix_dir(prefix):
+    return os.path.join(envs_dir, *prefix.split(ENV_SEPARATOR)) if prefix else envs_dir
+
+
+def list_env_level(prefix=''):
+    """Lists one level of the env tree: (envs, groups) directly under prefix, both sorted.
+
+    envs are full env names; groups are the prefixes that have envs below them. Only the
+    prefix's own directory is read.
+    """
+    if prefix and not is_valid_env_name(prefix):
+        return [], []
+    base = f"{prefix}{ENV_SEPARATOR}" if prefix else ''
+    envs = []
+    groups = []
+    try:
+        with os.scandir(_prefix_dir(prefix)) as entries:
+            for entry in entries:
+                # Skips the hidden directories of history, locks and indexes, and temp files
+                if entry.name.startswith('.'):
+                    continue
+                if entry.name.endswith('.csv') and _is_valid_segment(entry.name[:-4]):
+                    envs.append(base + entry.name[:-4])
+                elif _is_valid_segment(entry.name) and entry.is_dir():
+                    groups.append(base + entry.name)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error listing environments under '{prefix}': {e}")
+        _flash_error(f"Error listing environments: {e}")
+    return sorted(envs), sorted(groups)
+
+
+def get_envs(prefix=''):
+    """Lists all environments (names without .csv), or only those under a prefix.
+
+    With a prefix, only that part of the directory tree is walked.
+    """
+    envs, groups = list_env_level(prefix)
+    for group in groups:
+        envs.extend(get_envs(group))
+    return envs
+
+
+def get_secrets(env):
+    """Reads secrets from the CSV file for a given environment."""
+    path = env_path(env)
+    if not os.path.exists(path):
+        return []
+    secrets_list = []
+    try:
+        with open(path, newline='', encoding='utf-8') as csvfile:
+            # Use DictReader, but handle potential empty files gracefully
+            try:
+                reader = csv.DictReader(csvfile)
+                secrets_list = list(reader)
+                for row in secrets_list:
+                    if crypto.is_sealed(row.get('value')):
+                        row['value'] = crypto.unseal(env, str(row.get('key')), row['value'])
+            except csv.Error:
+                # Handle cases where the file might be empty or corrupted
+                pass # Return empty list if reading fails
+    except crypto.DecryptionError:
+        # Not a read error an empty list could stand in for; callers report it
+        raise
+    except Exception as e:
+        print(f"Error reading CSV for env {env}: {e}")
+        _flash_error(f"Error reading secrets for environment '{env}': {e}")
+        return [] # Return empty list on error
+    return secrets_list
+
+
+@contextmanager
+def _mapped_env(env):
+    """Memory-maps the CSV file for an environment, yielding an empty buffer if it is missing or empty."""
+    path = env_path(env)
+    if not os.path.exists(path):
+        yield b''
+        return
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap refuses to map zero-length files
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            yield buf
+
+
+def bundle_path(env):
+    """Returns the path of an env's compiled bundle (see the bundle module)."""
+    return os.path.join(envs_dir, '.bundles', f"{env_file_name(env)}.bundle")
+
+
+def _current_bundle(env):
+    """Returns a reader for the env's bundle if it was compiled from the current CSV, else None.
+
+    A missing or stale bundle (e.g. written before bundles existed, or the CSV edited by
+    hand) just means lookups scan the CSV instead.
+    """
+    signature = file_signature(bundle_path(env))
+    if signature is None:
+        return None
+    cached = _bundles.get(env)
+    if cached is None or cached[0] != signature:
+        try:
+            reader = bundle.BundleReader(bundle_path(env))
+        except (OSError, ValueError, bundle.BundleError):
+            return None
+        if len(_bundles) >= MAX_OPEN_BUNDLES:
+            # Not closed here: another thread may still be reading it; it is unmapped once unused
+            _bundles.pop(next(iter(_bundles), None), None)
+        _bundles[env] = cached = (signature, reader)
+    reader = cached[1]
+    return reader if reader.source_signature == file_signature(env_path(env)) else None
+
+
+def _write_bundle(env, pairs, version):
+    """Compiles the env's bundle after a write of its CSV. The caller must hold the env lock."""
+    try:
+        bundle.write_bundle(bundle_path(env), pairs, version, file_signature(env_path(env)))
+    except Exception as e:
+        # Readers fall back to the CSV, so the write itself still succeeded
+        print(f"Error writing the bundle for env {env}: {e}")
+
+
+def compile_bundle(env):
+    """Compiles an env's bundle from its CSV, e.g. for an env last written before bundles existed.
+
+    Returns the number of keys in the bundle. Errors are raised.
+    """
+    with _env_lock(env):
+        pairs = _pairs(_read_entries(env))
+        bundle.write_bundle(bundle_path(env), pairs, history.current_version(env), file_signature(env_path(env)))
+        return len({key for key, _ in pairs})
+
+
+def _csv_field(buf, pos, line_end):
+    """Returns (start, end, next_pos) for the CSV field beginning at pos.
+
+    Quoted fields may span lines, so their end is found by walking the closing
+    quotes instead of stopping at line_end. For quoted fields start/end exclude the
+    surrounding quotes; doubled quotes inside them are left for the caller to unescape.
+    """
+    if buf[pos:pos + 1] == b'"':
+        i = pos + 1
+        while True:
+            quote = buf.find(b'"', i)
+            if quote == -1:
+                return pos + 1, len(buf), len(buf)
+            if buf[quote + 1:quote + 2] == b'"':
+                i = quote + 2 # Escaped quote, keep looking
+                continue
+            return pos + 1, quote, quote + 1
+    comma = buf.find(b',', pos, line_end)
+    end = line_end if comma == -1 else comma
+    return pos, end, end
+
+
+def _content_end(buf, pos):
+    """Returns the end of the line containing pos, before its '\n' (and a '\r' preceding it)."""
+    line_end = buf.find(b'\n', pos)
+    if line_end == -1:
+        line_end = len(buf)
+    # Ignore a trailing '\r' so CRLF and LF files scan the same way
+    return line_end - 1 if line_end > pos and buf[line_end - 1:line_end] == b'\r' else line_end
+
+
+def _scan_rows(buf):
+    """Yields (key, value_start, value_end) for each data row in a mapped env CSV."""
+    size = len(buf)
+    # Skip the header row
+    pos = buf.find(b'\n') + 1
+    if pos == 0:
+        return
+    while pos < size:
+        content_end = _content_end(buf, pos)
+        if content_end == pos:
+            # Blank line
+            pos = buf.find(b'\n', pos)
+            pos = size if pos == -1 else pos + 1
+            continue
+
+        key_start, key_end, pos = _csv_field(buf, pos, content_end)
+        if pos > content_end:
+            # The key was quoted and spanned lines; the value is on the line the key ended on
+            content_end = _content_end(buf, pos)
+        if buf[pos:pos + 1] != b',':
+            # Malformed row without a value column, skip it like DictReader would yield value=None
+            pos = buf.find(b'\n', pos)
+            pos = size if pos == -1 else pos + 1
+            continue
+        value_start, value_end, pos = _csv_field(buf, pos + 1, content_end)
+
+        yield buf[key_start:key_end].decode('utf-8').replace('""', '"'), value_start, value_end
+
+        # Continue after the end of the row (quoted fields may have moved past line_end)
+        pos = buf.find(b'\n', pos)
+        pos = size if pos == -1 else pos + 1
+
+
+def scan_keys(env):
+    """Returns (key, value_start, value_end) tuples for an environment without decoding any values.
+
+    Offsets are byte positions of the raw (still CSV-quoted) value in the env file as it
+    was when scanned; writes replace the file, so they are not valid after one.
+    """
+    try:
+        with _mapped_env(env) as buf:
+            return list(_scan_rows(buf))
+    except Exception as e:
+        print(f"Error scanning keys for env {env}: {e}")
+        _flash_error(f"Error reading secrets for environment '{env}': {e}")
+        return []
+
+
+def get_keys(env):
+    """Returns the list of secret keys in an environment, in file order."""
+    return [key for key, _, _ in scan_keys(env)]
+
+
+def count_keys(env):
+    """Returns the number of secrets stored in an environment."""
+    reader = _current_bundle(env)
+    if reader is not None:
+        return len(reader)
+    return len(scan_keys(env))
+
+
+def has_key(env, key):
+    """Checks whether a key exists in an environment without reading any values."""
+    key = str(key)
+    reader = _current_bundle(env)
+    if reader is not None:
+        return key in reader
+    return any(k == key for k, _, _ in scan_keys(env))
+
+
+def get_secret_value(env, key):
+    """Returns the stored (Base64 encoded) value for a single key, or None if the key is missing.
+
+    The key is looked up by binary search in the env's bundle when it is current;
+    otherwise only the matching row's value is read from the mapped CSV. Either way
+    only that value is decoded (and decrypted, if sealed).
+    """
+    key = str(key)
+    try:
+        reader = _current_bundle(env)
+        if reader is not None:
+            value = reader.get(key)
+            return None if value is None else crypto.unseal(env, key, str(value, 'utf-8'))
+        with _mapped_env(env) as buf:
+            for k, start, end in _scan_rows(buf):
+                if k == key:
+                    return crypto.unseal(env, key, buf[start:end].decode('utf-8').replace('""', '"'))
+    except crypto.DecryptionError:
+        raise
+    except Exception as e:
+        print(f"Error reading value for key {key} in env {env}: {e}")
+        _flash_error(f"Error reading secret '{key}' in environment '{env}': {e}")
+    return None
+
+
+def iter_stored(env):
+    """Yields (key, stored_value) pairs for an environment without decrypting anything.
+
+    Sealed values are yielded as stored; pass them to crypto.unseal() with the same env.
+    """
+    try:
+        with _mapped_env(env) as buf:
+            for key, start, end in _scan_rows(buf):
+                yield key, buf[start:end].decode('utf-8').replace('""', '"')
+    except Exception as e:
+        print(f"Error reading CSV for env {env}: {e}")
+        _flash_error(f"Error reading secrets for environment '{env}': {e}")
+
+
+def iter_secrets(env):
+    """Yields (key, encoded_value) pairs for an environment one row at a time.
+
+    The env file stays mapped while the generator is consumed, so only the row being
+    yielded is ever materialized (and decrypted, if sealed).
+    """
+    for key, stored_value in iter_stored(env):
+        yield key, crypto.unseal(env, key, stored_value)
+
+
+def _append_secret(path, key, encoded_value):
+    """Appends a single new row to an env CSV, writing the header first if the file is empty."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a+b') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            f.write(b'key,value\r\n')
+        else:
+            # Make sure the new row starts on its own line
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\r\n')
+    with open(path, 'a', newline='', encoding='utf-8') as csvfile:
+        csv.writer(csvfile).writerow([key, encoded_value])
+
+
+@contextmanager
+def _env_lock(env):
+    """Holds an exclusive lock on an environment across processes (e.g. all gunicorn workers).
+
+    The lock file lives beside the env files because the CSV itself is replaced on
+    every write. The lock is not reentrant, so helpers called while holding it must
+    not take it again.
+    """
+    with _file_lock(env_file_name(env)):
+        yield
+
+
+def _acquire_lock(name, blocking=True):
+    """Opens envs/.locks/<name>.lock and takes an exclusive lock on it across processes.
+
+    Returns the open lock file; closing it releases the lock. Returns None instead of
+    waiting when blocking is False and another process holds the lock. Shared by the
+    side stores (history, index, audit log, ...), each with its own lock name.
+    """
+    lock_dir = os.path.join(envs_dir, '.locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    lock_file = open(os.path.join(lock_dir, f"{name}.lock"), 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        except BaseException:
+            lock_file.close()
+            raise
+    return lock_file
+
+
+@contextmanager
+def _file_lock(name, blocking=True):
+    """Holds _acquire_lock(name) for a with block; yields False if it wasn't acquired."""
+    lock_file = _acquire_lock(name, blocking)
+    if lock_file is None:
+        yield False
+        return
+    with lock_file:
+        try:
+            yield True
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_file_atomic(path, text):
+    """Replaces a small text file atomically (temp file + rename), creating its directory."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Per thread as well, for files written without a lock
+    tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_json_atomic(path, data, indent=None):
+    """Replaces a JSON file atomically; compact unless indent is given."""
+    _write_file_atomic(path, json.dumps(data, indent=indent, separators=None if indent else (',', ':')))
+
+
+def _read_entries(env):
+    """Reads all rows of an env CSV, raising on errors instead of returning an empty list."""
+    path = env_path(env)
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='', encoding='utf-8') as csvfile:
+        return list(csv.DictReader(csvfile))
+
+
+def _write_entries(path, entries):
+    """Writes a full list of entries to an env CSV atomically (temp file + rename)."""
+    # Ensure the directory exists before writing
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES, extrasaction='ignore')
+            writer.writeheader()
+            # Filter out potential empty or malformed rows before writing
+            writer.writerows(row for row in entries if row and row.get('key') is not None)
+        # Readers never see a half-written file
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _pairs(entries):
+    """Returns (key, value) pairs for CSV rows, skipping malformed ones.
+
+    If a key repeats, only its first row counts, as in lookups and updates of the CSV.
+    """
+    pairs = {}
+    for row in entries:
+        if row and row.get('key') is not None:
+            pairs.setdefault(str(row.get('key')), row.get('value') or '')
+    return list(pairs.items())
+
+
+def _record_history(env, before, after, load_state=None):
+    """Records the difference between two {key: value} states as a new version of an env.
+
+    `after` is taken as the full new content unless `load_state` says otherwise. The
+    changed and deleted keys are also queued for the audit log and have their rotation
+    dates updated. Returns the new version number, or None if it couldn't be recorded.
+    """
+    changed = {key: value for key, value in after.items() if before.get(key) != value}
+    deleted = [key for key in before if key not in after]
+    version = None
+    try:
+        version = history.record_version(env, changed, deleted, load_state or (lambda: list(after.items())))
+    except Exception as e:
+        print(f"Error recording history for env {env}: {e}")
+        _flash_error(f"Saved, but could not record a version of '{env}': {e}")
+    audit.record('set', env, changed, version)
+    audit.record('delete', env, deleted, version)
+    try:
+        # Sealing a value (or re-sealing it) changes how it is stored, not the secret
+        rotated = [key for key, value in changed.items() if _plaintext_changed(env, key, before.get(key), value)]
+        rotation.record_changes(env, rotated, deleted)
+    except Exception as e:
+        print(f"Error updating the rotation metadata of env {env}: {e}")
+    return version
+
+
+def _plaintext_changed(env, key, old_value, new_value):
+    """True if two stored values of a key hold different Base64 values once unsealed."""
+    if old_value is None or not (crypto.is_sealed(old_value) or crypto.is_sealed(new_value)):
+        return old_value != new_value
+    try:
+        return crypto.unseal(env, key, old_value) != crypto.unseal(env, key, new_value)
+    except crypto.DecryptionError:
+        return True
+
+
+def _record_fingerprints(env, changed, deleted):
+    """Updates the value fingerprint index after a write; `changed` holds unsealed Base64 values."""
+    try:
+        fingerprints.record_changes(env, changed, deleted)
+    except Exception as e:
+        print(f"Error updating the fingerprint index for env {env}: {e}")
+        _flash_error(f"Saved, but could not update the value index for '{env}': {e}")
+
+
+def _apply_changes(env, upserts, deletes, replace):
+    """Applies a batch of changes to an env file. The caller must hold the env lock."""
+    current = _read_entries(env)
+    history.ensure_started(env, lambda: _pairs(current))
+    before = dict(_pairs(current))
+    entries = [] if replace else current
+
+    remaining = dict(upserts)
+    for row in entries:
+        # Ensure row and row.get('key') are not None before comparison
+        key = str(row.get('key')) if row else None
+        if key in remaining:
+            # Encrypted at rest if enabled; unchanged values keep their stored form
+            row['value'] = crypto.reseal(env, key, before.get(key), remaining.pop(key))
+    # New keys are appended in the order given
+    entries.extend({'key': key, 'value': crypto.reseal(env, key, before.get(key), value)}
+                   for key, value in remaining.items())
+    kept = [row for row in entries if row and str(row.get('key')) not in deletes]
+    after = dict(_pairs(kept))
+
+    _write_entries(env_path(env), kept)
+    version = _record_history(env, before, after)
+    _write_bundle(env, _pairs(kept), version)
+    # Upserts from the version history may be sealed; fingerprints are taken of the plain value
+    _record_fingerprints(env, {key: crypto.unseal(env, key, upserts[key]) for key in after
+                               if key in upserts and before.get(key) != after[key]},
+                         before.keys() - after.keys())
+    validation.schedule(env)
+    # Keys that existed before and are gone now, whether deleted or left out of a replace
+    return len(upserts), len(before.keys() - after.keys())
+
+
+def update_env(env, upserts=None, deletes=(), replace=False):
+    """Applies upserts and deletes to an environment as one transaction.
+
+    `upserts` maps keys to Base64 encoded values; existing keys keep their position and
+    new keys are appended. `deletes` are removed afterwards. With replace=True the env
+    ends up holding exactly `upserts`. The whole read-modify-write happens under the
+    env lock and results in a single atomic write of the CSV file.
+
+    Returns (upserted_count, deleted_count). Unlike the other helpers, errors are raised
+    so callers can report them in their own way.
+    """
+    upserts = {str(key): value for key, value in (upserts or {}).items()}
+    deletes = {str(key) for key in deletes}
+    with _env_lock(env):
+        return _apply_changes(env, upserts, deletes, replace)
+
+
+def save_secrets(env, updates):
+    """Saves or updates many secrets in an environment with a single write of its CSV file.
+
+    `updates` maps keys to Base64 encoded values. Returns True if the file was written.
+    """
+    try:
+        update_env(env, updates)
+        return True
+    except Exception as e:
+         print(f"Error writing CSV for env {env}: {e}")
+         _flash_error(f"Error saving secrets for environment '{env}': {e}")
+         return False
+
+
+def save_secret(env, key, encoded_value):
+    """Saves or updates a secret in the CSV file for a given environment."""
+    path = env_path(env)
+    # Ensure the key is a string before comparison
+    key = str(key)
+
+    try:
+        with _env_lock(env):
+            # New keys only need a row appended; the key scan avoids parsing every value to find out
+            if os.path.exists(path) and not has_key(env, key):
+                history.ensure_started(env, lambda: _pairs(_read_entries(env)))
+                stored_value = crypto.seal(env, key, encoded_value)
+                # Taken before the append changes the CSV; a stale bundle stays stale until a full write
+                reader = _current_bundle(env)
+                _append_secret(path, key, stored_value)
+                # Only the appended row changed; a snapshot, if due, needs the whole file
+                version = _record_history(env, {}, {key: stored_value}, lambda: _pairs(_read_entries(env)))
+                if reader is not None:
+                    # The bundle already holds every other row, so the CSV isn't parsed again
+                    _write_bundle(env, [*reader.items(), (key, stored_value)], version)
+                _record_fingerprints(env, {key: encoded_value}, ())
+                validation.schedule(env)
+            else:
+                _apply_changes(env, {key: encoded_value}, set(), False)
+    except Exception as e:
+        print(f"Error writing CSV for env {env}: {e}")
+        _flash_error(f"Error saving secrets for environment '{env}': {e}")
+
+
+def rewrite_keys(env, plan, dry_run=False):
+    """Renames, copies or deletes keys of an environment in one transaction.
+
+    `plan` is called with the env's current keys, under the env lock, and returns
+    ({new_key: old_key} copies, keys to delete). Copied values overwrite existing keys
+    and new keys are appended, as with save_secret(); deletes then apply as with
+    delete_secrets(). With dry_run=True nothing is written.
+
+    Returns (copies, deletes, overwritten keys). Errors are raised, like update_env().
+    """
+    with _env_lock(env):
+        current = dict(_pairs(_read_entries(env)))
+        copies, deletes = plan(list(current))
+        overwritten = sorted(key for key in copies if key in current and key not in deletes)
+        if not dry_run and (copies or deletes):
+            # Values are sealed with their key name, so they are moved in the clear and resealed
+            upserts = {new_key: crypto.unseal(env, old_key, current[old_key]) for new_key, old_key in copies.items()}
+            metadata = rotation.get_metadata(env)
+            _apply_changes(env, upserts, set(deletes), False)
+            # Moved keys keep their owner, expiry and rotation dates
+            rotation.restore(env, {new_key: metadata[old_key] for new_key, old_key in copies.items()
+                                   if old_key in metadata})
+        return copies, deletes, overwritten
+
+
+def delete_secrets(env, keys):
+    """Deletes several keys from an environment with a single write of its CSV file.
+
+    Returns the number of secrets deleted (0 if none were found or the write failed).
+    """
+    keys = {str(key) for key in keys}
+    try:
+        with _env_lock(env):
+            # Leave the file untouched when none of the keys exist
+            if not any(key in keys for key in get_keys(env)):
+                return 0
+            return _apply_changes(env, {}, keys, False)[1]
+    except Exception as e:
+        print(f"Error writing CSV after deleting secrets for env {env}: {e}")
+        _flash_error(f"Error saving changes after deleting secrets in '{env}': {e}")
+        return 0 # Indicate deletion failed due to save error
+
+
+def delete_secret_from_csv(env, key):
+    """Deletes a secret with the given key from the CSV file for an environment."""
+    # Returns the number of deleted items (1 if found)
+    return delete_secrets(env, [key])
+
+
+def delete_env(env):
+    """Deletes an environment's CSV file, recording the removal of its keys as a last version.
+
+    Returns False if the env does not exist; raises on errors, including layers.LayerError
+    when other envs inherit from it.
+    """
+    path = env_path(env)
+    inheriting = layers.children(env)
+    if inheriting:
+        raise layers.LayerError(f"'{env}' is the parent of {', '.join(inheriting)}; change their parent first.")
+    with _env_lock(env):
+        if not os.path.exists(path):
+            return False
+        layers.set_parent(env, None)
+        current = _read_entries(env)
+        history.ensure_started(env, lambda: _pairs(current))
+        os.remove(path)
+        try:
+            os.remove(bundle_path(env))
+        except FileNotFoundError:
+            pass
+        # Keeps the history consistent if an env with the same name is created later
+        _record_history(env, dict(_pairs(current)), {})
+        try:
+            fingerprints.drop_env(env)
+        except Exception as e:
+            print(f"Error updating the fingerprint index for env {env}: {e}")
+        validation.forget(env)
+    _remove_empty_dirs(os.path.dirname(path))
+    return True
+
+
+def _remove_empty_dirs(path):
+    """Removes the directories of a hierarchical env that no env is left in, up to envs_dir."""
+    root = os.path.abspath(envs_dir)
+    path = os.path.abspath(path)
+    while path != root and path.startswith(root + os.sep):
+        try:
+            os.rmdir(path)
+        except OSError:
+            # Not empty (or already gone): the levels above it are in use too
+            return
+        path = os.path.dirname(path)
+
+
+def encrypt_env(env):
+    """Encrypts the values of an environment that are still stored in plain text, in one write.
+
+    Returns the number of values encrypted. Needs encryption at rest to be turned on.
+    """
+    if not crypto.enabled():
+        raise RuntimeError(f"Set {crypto.MASTER_KEY_VAR} or {crypto.MASTER_KEYFILE_VAR} to encrypt values.")
+    with _env_lock(env):
+        plain = {key: value for key, value in _pairs(_read_entries(env)) if not crypto.is_sealed(value)}
+        if plain:
+            _apply_changes(env, plain, set(), False)
+        return len(plain)
+
+
+def rollback_env(env, version):
+    """Restores an environment to its content as of a version, recorded as a new version.
+
+    Returns the (upserted, deleted) counts, or None if the version does not exist.
+    """
+    state = history.get_version_state(env, version)
+    if state is None:
+        return None
+    return update_env(env, state, replace=True)
@@ -0,0 +1,158 @@
+import os
+import json
+import base64
+import binascii
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Status of every stored value, kept in envs/.validation/<env>.json:
+#   {"signature": [...], "keys": {key: {"status": ..., "size": ...}}}
+# 'signature' is that of the env file the statuses were computed from, so they are only
+# used while the file is unchanged. Statuses:
+#   text     Base64 of UTF-8 text, shown as is
+#   binary   valid Base64 of bytes that are not UTF-8 text
+#   invalid  not valid Base64
+# 'size' is the decoded size in bytes (the stored length for invalid values).
+
+TEXT, BINARY, INVALID = 'text', 'binary', 'invalid'
+
+# Validation runs in the background so writes and page views never wait for it
+VALIDATOR_THREADS = 2
+
+_executor = None
+# Envs queued or being validated by this process
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _storage():
+    # Imported lazily because the storage layer imports this module
+    from secrets_manager import storage
+    return storage
+
+
+def _meta_path(env):
+    return os.path.join(_storage().envs_dir, '.validation', f"{_storage().env_file_name(env)}.json")
+
+
+def classify(encoded_value):
+    """Returns (status, size) for a Base64 encoded value."""
+    try:
+        raw = base64.b64decode(encoded_value, validate=True)
+    except (binascii.Error, ValueError):
+        return INVALID, len(encoded_value)
+    try:
+        raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return BINARY, len(raw)
+    return TEXT, len(raw)
+
+
+def _read_meta(env):
+    try:
+        with open(_meta_path(env), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _is_fresh(env, meta):
+    signature = _storage().file_signature(_storage().env_path(env))
+    return meta is not None and signature is not None and meta.get('signature') == list(signature)
+
+
+def validate_env(env):
+    """Computes and saves the status of every value of an env. Returns the number of values checked.
+
+    Does nothing if the saved statuses are still fresh, or if another process is
+    validating the env right now.
+    """
+    storage = _storage()
+    with storage._file_lock(f".validation-{storage.env_file_name(env)}", blocking=False) as locked:
+        if not locked:
+            return 0
+        if _is_fresh(env, _read_meta(env)):
+            return 0
+        # Taken before reading, so a write during the scan leaves the result stale, not wrong
+        signature = storage.file_signature(storage.env_path(env))
+        if signature is None:
+            return 0
+        keys = {}
+        for key, encoded_value in storage.iter_secrets(env):
+            status, size = classify(encoded_value)
+            keys[key] = {'status': status, 'size': size}
+
+        storage._write_json_atomic(_meta_path(env), {'signature': list(signature), 'keys': keys})
+        return len(keys)
+
+
+def _run(env):
+    try:
+        validate_env(env)
+    except Exception as e:
+        print(f"Error validating the values of env {env}: {e}")
+    finally:
+        with _pending_lock:
+            _pending.discard(env)
+
+
+def start():
+    """Starts the background validator and queues every env whose statuses are missing or stale.
+
+    Until this is called (the web app does so at startup), schedule() does nothing, so
+    the command line tools never wait for validation before exiting.
+    """
+    global _executor
+    with _pending_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=VALIDATOR_THREADS, thread_name_prefix='validator')
+    for env in _storage().get_envs():
+        if not _is_fresh(env, _read_meta(env)):
+            schedule(env)
+
+
+def schedule(env):
+    """Queues an env for validation in the background, unless it is already queued."""
+    with _pending_lock:
+        if _executor is None or env in _pending:
+            return
+        _pending.add(env)
+    _executor.submit(_run, env)
+
+
+def forget(env):
+    """Removes the saved statuses of a deleted env."""
+    try:
+        os.remove(_meta_path(env))
+    except FileNotFoundError:
+        pass
+
+
+def statuses(env):
+    """Returns {key: {'status', 'size'}} for an env, or None while it has not been validated.
+
+    Stale statuses are never returned; the env is queued for validation instead.
+    """
+    meta = _read_meta(env)
+    if _is_fresh(env, meta):
+        return meta['keys']
+    schedule(env)
+    return None
+
+
+def problems():
+    """Returns the values that are not text across all envs, and the envs not validated yet.
+
+    The result is ({'env', 'key', 'status', 'size'} dicts sorted by env and key, sorted
+    list of pending envs).
+    """
+    found = []
+    pending = []
+    for env in sorted(_storage().get_envs()):
+        env_statuses = statuses(env)
+        if env_statuses is None:
+            pending.append(env)
+            continue
+        found.extend({'env': env, 'key': key, **status} for key, status in sorted(env_statuses.items())
+                     if status['status'] != TEXT)
+    return found, pending
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from secrets_manager import audit, completion, crypto, layers, storage
+
+
+class StoreTestCase(unittest.TestCase):
+    """Runs each test against its own empty store, with encryption at rest off."""
+
+    def setUp(self):
+        environ = mock.patch.dict(os.environ)
+        environ.start()
+        self.addCleanup(environ.stop)
+        os.environ.pop(crypto.MASTER_KEY_VAR, None)
+        os.environ.pop(crypto.MASTER_KEYFILE_VAR, None)
+
+        self._envs_dir = storage.envs_dir
+        storage.envs_dir = tempfile.mkdtemp(prefix='secrets-manager-test-')
+        self._clear_caches()
+
+    def tearDown(self):
+        # Queued audit entries are written to this store now rather than at exit
+        audit.flush()
+        self._clear_caches()
+        shutil.rmtree(storage.envs_dir)
+        storage.envs_dir = self._envs_dir
+
+    @staticmethod
+    def _clear_caches():
+        # Caches checked by file signature could match a file of an earlier test's store
+        for _, reader in storage._bundles.values():
+            reader.close()
+        storage._bundles.clear()
+        layers._resolved_cache.clear()
+        completion._cache.clear()
+
+    def write_csv(self, env, text):
+        """Writes an env file by hand, as an operator editing the store would."""
+        path = storage.env_path(env)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            f.write(text)
@@ -0,0 +1,103 @@
+import unittest
+
+from flask import Flask
+from support import StoreTestCase
+
+from secrets_manager import storage
+from secrets_manager.api import api
+
+
+class ApiTestCase(StoreTestCase):
+    """Calls the JSON API on an app with only its blueprint, so no background work is started."""
+
+    def setUp(self):
+        super().setUp()
+        app = Flask(__name__)
+        app.register_blueprint(api)
+        self.client = app.test_client()
+
+
+class EncodedValueTest(ApiTestCase):
+
+    def test_non_ascii_encoded_values_are_rejected(self):
+        for method, url, body, key in [
+            ('patch', '/api/v1/envs/dev/secrets', {'set': {'A': 'é'}, 'encoded': True}, 'A'),
+            ('put', '/api/v1/envs/dev/secrets', {'secrets': {'A': 'é'}, 'encoded': True}, 'A'),
+            ('put', '/api/v1/envs/dev/secrets/A', {'value': 'é', 'encoded': True}, 'A'),
+            ('post', '/api/v1/where_used', {'value': 'é', 'encoded': True}, 'value'),
+        ]:
+            response = getattr(self.client, method)(url, json=body)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertEqual(response.get_json(), {'error': f"Value for key '{key}' is not valid Base64."})
+        self.assertFalse(storage.get_envs())
+
+    def test_encoded_values_are_stored_as_given(self):
+        response = self.client.put('/api/v1/envs/dev/secrets/A', json={'value': 'eA==', 'encoded': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(storage.get_secret_value('dev', 'A'), 'eA==')
+
+
+class ErrorTest(ApiTestCase):
+    """Every error is answered with {"error": ...} and a 4xx status, never a redirect or a 500."""
+
+    def assertError(self, response, status):
+        self.assertEqual(response.status_code, status, response.get_data(as_text=True))
+        self.assertIsInstance(response.get_json().get('error'), str)
+
+    def test_env_names(self):
+        self.assertError(self.client.get('/api/v1/envs/bad.name/secrets'), 400)
+        self.assertError(self.client.get('/api/v1/envs/missing/secrets'), 404)
+        self.assertError(self.client.patch('/api/v1/envs/missing/secrets', json={'delete': ['A']}), 404)
+
+    def test_request_bodies(self):
+        url = '/api/v1/envs/dev/secrets'
+        self.assertError(self.client.patch(url, data='not json', content_type='application/json'), 400)
+        self.assertError(self.client.patch(url, json=['A']), 400)
+        self.assertError(self.client.patch(url, json={'set': ['A']}), 400)
+        self.assertError(self.client.patch(url, json={'set': {' ': 'x'}}), 400)
+        self.assertError(self.client.patch(url, json={'set': {'A': 1}}), 400)
+        self.assertError(self.client.patch(url, json={'delete': 'A'}), 400)
+        self.assertError(self.client.patch(url, json={'set': {'A': 'x'}, 'delete': ['A']}), 400)
+        self.assertFalse(storage.get_envs())
+
+    def test_missing_keys_and_versions(self):
+        storage.update_env('dev', {'A': 'YQ=='})
+        self.assertError(self.client.get('/api/v1/envs/dev/secrets/B'), 404)
+        self.assertError(self.client.delete('/api/v1/envs/dev/secrets/B'), 404)
+        self.assertError(self.client.delete('/api/v1/envs/dev/secrets'), 400)
+        self.assertError(self.client.get('/api/v1/envs/dev/versions/7'), 404)
+        self.assertError(self.client.get('/api/v1/envs/dev/versions/0/diff/7'), 404)
+        self.assertError(self.client.post('/api/v1/envs/dev/versions/7/rollback'), 404)
+
+    def test_values_that_are_not_text(self):
+        storage.update_env('dev', {'BIN': '/w=='})
+        self.assertError(self.client.get('/api/v1/envs/dev/secrets/BIN'), 422)
+        self.assertEqual(self.client.get('/api/v1/envs/dev/secrets/BIN?raw=1').get_json()['value'], '/w==')
+        body = self.client.get('/api/v1/envs/dev/secrets').get_json()
+        self.assertEqual((body['secrets'], body['undecodable']), ({'BIN': None}, ['BIN']))
+
+    def test_parent_loops_are_refused(self):
+        storage.update_env('base', {'A': 'YQ=='})
+        storage.update_env('dev', {'B': 'Yg=='})
+        self.assertEqual(self.client.put('/api/v1/envs/dev/parent', json={'parent': 'base'}).status_code, 200)
+        self.assertError(self.client.put('/api/v1/envs/base/parent', json={'parent': 'dev'}), 409)
+        self.assertError(self.client.put('/api/v1/envs/dev/parent', json={'parent': 1}), 400)
+
+
+class BatchTest(ApiTestCase):
+
+    def test_patch_is_one_version(self):
+        storage.update_env('dev', {'A': 'YQ==', 'B': 'Yg=='})
+        response = self.client.patch('/api/v1/envs/dev/secrets', json={'set': {'C': 'c', 'A': 'a2'}, 'delete': ['B']})
+        self.assertEqual(response.get_json(), {'env': 'dev', 'set': 2, 'deleted': 1, 'version': 2})
+        self.assertEqual(self.client.get('/api/v1/envs/dev/secrets').get_json()['secrets'], {'A': 'a2', 'C': 'c'})
+
+    def test_put_replaces_the_env(self):
+        storage.update_env('dev', {'A': 'YQ=='})
+        self.client.put('/api/v1/envs/dev/secrets', json={'secrets': {'B': 'b'}})
+        body = self.client.get('/api/v1/envs/dev/secrets?key=A&key=B').get_json()
+        self.assertEqual((body['secrets'], body['missing']), ({'B': 'b'}, ['A']))
+
+
+if __name__ == '__main__':
+    unittest.main()
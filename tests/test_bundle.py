@@ -0,0 +1,58 @@
+import os
+import unittest
+
+from support import StoreTestCase
+
+from secrets_manager import bundle, history, layers, storage
+
+
+class DuplicateKeyTest(StoreTestCase):
+    """A key written twice to an env CSV (e.g. by hand) resolves to its first value everywhere."""
+
+    def setUp(self):
+        super().setUp()
+        self.write_csv('dev', 'key,value\nA,Zmlyc3Q=\nB,Yg==\nA,c2Vjb25k\n')
+
+    def _csv_value(self, key):
+        # The bundle is left out when it is missing, so this is the CSV scan
+        if os.path.exists(storage.bundle_path('dev')):
+            os.remove(storage.bundle_path('dev'))
+        return storage.get_secret_value('dev', key)
+
+    def _bundle_value(self, key):
+        with bundle.BundleReader(storage.bundle_path('dev')) as reader:
+            value = reader.get(key)
+            try:
+                return None if value is None else str(value, 'utf-8')
+            finally:
+                if value is not None:
+                    value.release()
+
+    def test_compiled_bundle_agrees_with_csv(self):
+        self.assertEqual(storage.compile_bundle('dev'), 2)
+        self.assertEqual(self._bundle_value('A'), 'Zmlyc3Q=')
+        self.assertEqual(storage.get_secret_value('dev', 'A'), 'Zmlyc3Q=')
+        self.assertEqual(self._csv_value('A'), 'Zmlyc3Q=')
+
+    def test_bundle_written_by_update_agrees_with_csv(self):
+        storage.update_env('dev', {'B': 'YjI='})
+        self.assertEqual(self._bundle_value('A'), 'Zmlyc3Q=')
+        self.assertEqual(storage.get_secret_value('dev', 'A'), 'Zmlyc3Q=')
+        self.assertEqual(self._csv_value('A'), 'Zmlyc3Q=')
+
+    def test_updating_a_repeated_key_changes_what_both_return(self):
+        storage.update_env('dev', {'A': 'bmV3'})
+        self.assertEqual(self._bundle_value('A'), 'bmV3')
+        self.assertEqual(storage.get_secret_value('dev', 'A'), 'bmV3')
+        self.assertEqual(self._csv_value('A'), 'bmV3')
+
+    def test_history_and_layers_agree_with_csv(self):
+        storage.update_env('dev', {'B': 'YjI='})
+        self.assertEqual(history.get_version_state('dev', history.current_version('dev'))['A'], 'Zmlyc3Q=')
+        storage.update_env('child', {'C': 'Yw=='})
+        layers.set_parent('child', 'dev')
+        self.assertEqual(layers.get_resolved_value('child', 'A'), ('Zmlyc3Q=', 'dev'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import io
+import os
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+
+from support import StoreTestCase
+
+from secrets_manager import cli, crypto, layers, storage
+
+
+class CliTestCase(StoreTestCase):
+
+    def run_cli(self, *argv):
+        """Runs the CLI on the test store; returns (exit code, stdout)."""
+        out = io.StringIO()
+        with redirect_stdout(out), redirect_stderr(io.StringIO()):
+            try:
+                cli.main(['--envs-dir', storage.envs_dir, *argv])
+            except SystemExit as e:
+                return e.code, out.getvalue()
+        return 0, out.getvalue()
+
+
+class DiffTest(CliTestCase):
+
+    def test_inherited_keys_are_compared(self):
+        storage.update_env('base', {'SHARED': 'cw==', 'CHANGED': 'MQ=='})
+        storage.update_env('uat', {'ONLY_UAT': 'dQ=='})
+        storage.update_env('prod', {'CHANGED': 'Mg=='})
+        layers.set_parent('uat', 'base')
+        layers.set_parent('prod', 'base')
+        code, out = self.run_cli('diff', 'uat', 'prod')
+        self.assertEqual(code, 1)
+        self.assertEqual(out.splitlines(), ['~ CHANGED', '- ONLY_UAT'])
+
+    def test_same_values_encrypted_under_different_envs_are_equal(self):
+        os.environ[crypto.MASTER_KEY_VAR] = 'test master secret'
+        storage.update_env('uat', {'A': 'YQ=='})
+        storage.update_env('prod', {'A': 'YQ=='})
+        self.assertNotEqual(next(storage.iter_stored('uat'))[1], next(storage.iter_stored('prod'))[1])
+        self.assertEqual(self.run_cli('diff', 'uat', 'prod'), (0, ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import hashlib
+import tempfile
+import unittest
+from unittest import mock
+
+from support import StoreTestCase
+
+from secrets_manager import crypto, storage
+
+
+class CryptoTestCase(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.environ[crypto.MASTER_KEY_VAR] = 'test master secret'
+
+
+class SealTest(CryptoTestCase):
+
+    def test_round_trip(self):
+        sealed = crypto.seal('dev', 'A', 'YQ==')
+        self.assertTrue(crypto.is_sealed(sealed))
+        self.assertNotIn('YQ==', sealed)
+        self.assertEqual(crypto.unseal('dev', 'A', sealed), 'YQ==')
+        # A fresh nonce every time
+        self.assertNotEqual(crypto.seal('dev', 'A', 'YQ=='), sealed)
+
+    def test_values_are_bound_to_their_env_and_key(self):
+        sealed = crypto.seal('dev', 'A', 'YQ==')
+        with self.assertRaises(crypto.DecryptionError):
+            crypto.unseal('dev', 'B', sealed)
+        with self.assertRaises(crypto.DecryptionError):
+            crypto.unseal('prod', 'A', sealed)
+
+    def test_wrong_or_missing_master_secret(self):
+        sealed = crypto.seal('dev', 'A', 'YQ==')
+        os.environ[crypto.MASTER_KEY_VAR] = 'another secret'
+        with self.assertRaises(crypto.DecryptionError):
+            crypto.unseal('dev', 'A', sealed)
+        del os.environ[crypto.MASTER_KEY_VAR]
+        with self.assertRaises(crypto.DecryptionError):
+            crypto.unseal('dev', 'A', sealed)
+
+    def test_plain_values_pass_through(self):
+        self.assertEqual(crypto.unseal('dev', 'A', 'YQ=='), 'YQ==')
+        # Sealed values from the history are stored as they are
+        sealed = crypto.seal('dev', 'A', 'YQ==')
+        self.assertEqual(crypto.seal('dev', 'A', sealed), sealed)
+        del os.environ[crypto.MASTER_KEY_VAR]
+        self.assertEqual(crypto.seal('dev', 'A', 'YQ=='), 'YQ==')
+
+    def test_reseal_keeps_an_unchanged_value(self):
+        sealed = crypto.seal('dev', 'A', 'YQ==')
+        self.assertEqual(crypto.reseal('dev', 'A', sealed, 'YQ=='), sealed)
+        self.assertEqual(crypto.unseal('dev', 'A', crypto.reseal('dev', 'A', sealed, 'Yg==')), 'Yg==')
+
+    def test_keyfile(self):
+        del os.environ[crypto.MASTER_KEY_VAR]
+        with tempfile.NamedTemporaryFile('w', dir=storage.envs_dir, delete=False) as f:
+            f.write('keyfile secret\n')
+        os.environ[crypto.MASTER_KEYFILE_VAR] = f.name
+        self.assertTrue(crypto.enabled())
+        self.assertEqual(crypto.unseal('dev', 'A', crypto.seal('dev', 'A', 'YQ==')), 'YQ==')
+
+
+class KeyDerivationTest(CryptoTestCase):
+
+    def test_each_env_key_is_derived_once(self):
+        with mock.patch.object(hashlib, 'scrypt', wraps=hashlib.scrypt) as scrypt:
+            for _ in range(3):
+                crypto.unseal('dev', 'A', crypto.seal('dev', 'A', 'YQ=='))
+                crypto.seal('prod', 'A', 'YQ==')
+        self.assertEqual(scrypt.call_count, 2)
+
+    def test_keys_differ_by_env_store_and_master_secret(self):
+        dev = crypto._env_key('dev')
+        self.assertEqual(len(dev), 32)
+        self.assertNotEqual(crypto._env_key('prod'), dev)
+        self.assertNotEqual(crypto.fingerprint_key(), dev)
+        os.environ[crypto.MASTER_KEY_VAR] = 'another secret'
+        self.assertNotEqual(crypto._env_key('dev'), dev)
+        os.environ[crypto.MASTER_KEY_VAR] = 'test master secret'
+        # Another store has its own salt
+        envs_dir = storage.envs_dir
+        storage.envs_dir = os.path.join(envs_dir, 'other-store')
+        try:
+            self.assertNotEqual(crypto._env_key('dev'), dev)
+        finally:
+            storage.envs_dir = envs_dir
+
+
+class EncryptedStoreTest(CryptoTestCase):
+
+    def test_values_are_stored_sealed_and_read_plain(self):
+        storage.update_env('dev', {'A': 'YQ==', 'B': 'Yg=='})
+        with open(storage.env_path('dev'), encoding='utf-8') as f:
+            text = f.read()
+        self.assertNotIn('YQ==', text)
+        self.assertEqual(text.count(crypto.SEALED_PREFIX), 2)
+        self.assertEqual(storage.get_secret_value('dev', 'A'), 'YQ==')
+        self.assertEqual(dict(storage.iter_secrets('dev')), {'A': 'YQ==', 'B': 'Yg=='})
+
+        del os.environ[crypto.MASTER_KEY_VAR]
+        with self.assertRaises(crypto.DecryptionError):
+            storage.get_secret_value('dev', 'A')
+
+    def test_rewriting_an_unchanged_value_keeps_its_ciphertext(self):
+        storage.update_env('dev', {'A': 'YQ=='})
+        stored = dict(storage.iter_stored('dev'))
+        storage.update_env('dev', {'A': 'YQ=='})
+        self.assertEqual(dict(storage.iter_stored('dev')), stored)
+
+    def test_encrypt_env_seals_plain_values(self):
+        del os.environ[crypto.MASTER_KEY_VAR]
+        storage.update_env('dev', {'A': 'YQ==', 'B': 'Yg=='})
+        os.environ[crypto.MASTER_KEY_VAR] = 'test master secret'
+        self.assertEqual(storage.encrypt_env('dev'), 2)
+        self.assertTrue(all(crypto.is_sealed(value) for _, value in storage.iter_stored('dev')))
+        self.assertEqual(dict(storage.iter_secrets('dev')), {'A': 'YQ==', 'B': 'Yg=='})
+        self.assertEqual(storage.encrypt_env('dev'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
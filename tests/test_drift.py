@@ -0,0 +1,103 @@
+import json
+import shlex
+import unittest
+
+from support import StoreTestCase
+
+from secrets_manager import layers, storage
+from secrets_manager.drift import check_drift, diff_data, kubectl_command, merge_patch
+
+DUMP = """\
+apiVersion: v1
+kind: List
+items:
+- apiVersion: v1
+  kind: Secret
+  metadata:
+    name: api
+    namespace: prod
+  data:
+    SAME: cw==
+    CHANGED: b2xk
+    LIVE_ONLY: bA==
+- apiVersion: v1
+  kind: Secret
+  metadata:
+    name: web
+    namespace: prod
+  data:
+    SAME: cw==
+"""
+
+
+class MergePatchTest(unittest.TestCase):
+
+    def test_patch_sets_changed_keys_and_removes_live_only_keys(self):
+        stored = {'SAME': 'cw==', 'CHANGED': 'bmV3', 'ADDED': 'YQ=='}
+        live = {'SAME': 'cw==', 'CHANGED': 'b2xk', 'LIVE_ONLY': 'bA=='}
+        diff = diff_data(stored, live)
+        self.assertEqual(diff, {'added': ['ADDED'], 'removed': ['LIVE_ONLY'], 'changed': ['CHANGED'], 'unchanged': 1})
+        patch = merge_patch(stored, diff)
+        self.assertEqual(patch, {'data': {'ADDED': 'YQ==', 'CHANGED': 'bmV3', 'LIVE_ONLY': None}})
+        # Applying the patch (RFC 7386: null removes a member) gives the env's data
+        patched = dict(live)
+        for key, value in patch['data'].items():
+            if value is None:
+                del patched[key]
+            else:
+                patched[key] = value
+        self.assertEqual(patched, stored)
+
+    def test_no_drift_is_an_empty_patch(self):
+        data = {'A': 'YQ=='}
+        self.assertEqual(merge_patch(data, diff_data(data, dict(data))), {})
+
+    def test_command_quotes_the_patch(self):
+        patch = {'data': {"IT'S": None}}
+        command = kubectl_command('my secret', 'prod', patch)
+        args = shlex.split(command)
+        self.assertEqual(args[:7], ['kubectl', 'patch', 'secret', 'my secret', '-n', 'prod', '--type'])
+        self.assertEqual(json.loads(args[-1]), patch)
+
+
+class CheckDriftTest(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        storage.update_env('prod-api', {'SAME': 'cw==', 'CHANGED': 'bmV3'})
+        storage.update_env('prod-web', {'SAME': 'cw=='})
+
+    def test_each_secret_is_compared_with_its_env(self):
+        summary = check_drift(DUMP, env_from='namespace-name')
+        self.assertEqual(summary['errors'], [])
+        self.assertEqual(summary['drifted'], 1)
+        api, web = summary['secrets']
+        self.assertEqual((api['env'], api['changed'], api['removed']), ('prod-api', ['CHANGED'], ['LIVE_ONLY']))
+        self.assertEqual(api['patch'], {'data': {'CHANGED': 'bmV3', 'LIVE_ONLY': None}})
+        self.assertEqual(api['command'], kubectl_command('api', 'prod', api['patch']))
+        self.assertEqual((web['env'], web['patch'], web['command']), ('prod-web', None, None))
+
+    def test_inherited_keys_are_part_of_the_patch(self):
+        storage.update_env('base', {'FROM_BASE': 'Yg=='})
+        layers.set_parent('prod-web', 'base')
+        summary = check_drift(DUMP, env_from='namespace-name')
+        web = summary['secrets'][1]
+        self.assertEqual(web['added'], ['FROM_BASE'])
+        self.assertEqual(web['patch'], {'data': {'FROM_BASE': 'Yg=='}})
+
+    def test_bare_data_block_is_compared_with_the_given_env(self):
+        summary = check_drift('data:\n  SAME: cw==\n', env='prod-api')
+        self.assertEqual(summary['secrets'][0]['patch'], {'data': {'CHANGED': 'bmV3'}})
+
+    def test_unmatched_secrets_and_bad_input_are_reported(self):
+        summary = check_drift(DUMP)
+        self.assertEqual(summary['secrets'], [])
+        self.assertEqual(len(summary['errors']), 2)
+        self.assertEqual(check_drift('')['errors'], ['No Secret found in the pasted YAML.'])
+        self.assertTrue(check_drift('data: [')['errors'][0].startswith('Error parsing YAML'))
+        with self.assertRaises(ValueError):
+            check_drift(DUMP, env_from='namespace')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import random
+import unittest
+from unittest import mock
+
+from support import StoreTestCase
+
+from secrets_manager import history, storage
+
+
+class ListVersionsTest(StoreTestCase):
+
+    def test_no_history_lists_nothing(self):
+        self.assertEqual(history.list_versions('dev'), [])
+
+    def test_baseline_is_listed_and_can_be_rolled_back_to(self):
+        self.write_csv('dev', 'key,value\nA,YQ==\n')
+        storage.update_env('dev', {'B': 'Yg=='})
+        versions = history.list_versions('dev')
+        self.assertEqual([(v['version'], v['set'], v.get('baseline', False)) for v in versions],
+                         [(0, [], True), (1, ['B'], False)])
+        self.assertLessEqual(versions[0]['time'], versions[1]['time'])
+
+        storage.rollback_env('dev', versions[0]['version'])
+        self.assertEqual(list(storage.iter_secrets('dev')), [('A', 'YQ==')])
+
+
+class RebuildTest(StoreTestCase):
+    """Every version rebuilds to exactly what the env held, whichever segment it falls in."""
+
+    def _write_versions(self, count):
+        rng = random.Random(7)
+        states = {0: {}}
+        state = {}
+        storage.update_env('dev', {'K0': 'MA=='})
+        state['K0'] = 'MA=='
+        states[1] = dict(state)
+        for version in range(2, count + 1):
+            upserts = {f"K{rng.randrange(8)}": f"{version:04d}" for _ in range(rng.randint(1, 3))}
+            deletes = [key for key in state if key not in upserts and rng.random() < 0.2]
+            storage.update_env('dev', upserts, deletes)
+            state.update(upserts)
+            for key in deletes:
+                del state[key]
+            states[version] = dict(state)
+        return states
+
+    def test_every_version_rebuilds(self):
+        states = self._write_versions(60)
+        self.assertEqual(history.current_version('dev'), 60)
+        # Deltas outgrow the small snapshots quickly, so there are several segments
+        self.assertGreater(len(history._segments('dev')), 3)
+        for version, state in states.items():
+            self.assertEqual(history.get_version_state('dev', version), state, version)
+        self.assertIsNone(history.get_version_state('dev', 61))
+
+    def test_segments_are_capped_by_delta_count(self):
+        with mock.patch.object(history, 'MAX_SEGMENT_DELTAS', 4):
+            storage.update_env('dev', {'BIG': 'eA==' * 1000})
+            for version in range(2, 11):
+                storage.update_env('dev', {'A': f"{version:04d}"})
+        # Version 1 outgrows the empty snapshot of version 0; after that, every 4 versions
+        self.assertEqual(history._segments('dev'), [0, 1, 5, 9])
+        self.assertEqual(history.get_version_state('dev', 9)['A'], '0009')
+
+    def test_changes_since_spans_segments(self):
+        self._write_versions(30)
+        changes = history.changes_since('dev', 5)
+        self.assertEqual([change['version'] for change in changes], list(range(6, 31)))
+        self.assertEqual(history.changes_since('dev', 30), [])
+
+    def test_rollback_is_a_new_version(self):
+        states = self._write_versions(20)
+        storage.rollback_env('dev', 7)
+        self.assertEqual(history.current_version('dev'), 21)
+        self.assertEqual(dict(storage.iter_secrets('dev')), states[7])
+        self.assertEqual(history.get_version_state('dev', 20), states[20])
+        self.assertEqual(history.diff_states(states[20], states[7]),
+                         history.diff_states(history.get_version_state('dev', 20), history.get_version_state('dev', 21)))
+        self.assertIsNone(storage.rollback_env('dev', 99))
+
+    def test_diff_states(self):
+        self.assertEqual(history.diff_states({'A': '1', 'B': '2', 'C': '3'}, {'A': '1', 'B': '9', 'D': '4'}),
+                         {'added': ['D'], 'removed': ['C'], 'changed': ['B']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+from support import StoreTestCase
+
+from secrets_manager import importer, storage
+
+MANIFEST = """apiVersion: v1
+kind: Secret
+metadata:
+  name: app-{index}
+data:
+  TOKEN: {value}
+"""
+
+
+class ImportManifestsTest(StoreTestCase):
+
+    def _write_manifests(self, count):
+        directory = tempfile.mkdtemp(dir=storage.envs_dir)
+        for index in range(count):
+            with open(os.path.join(directory, f"{index:02d}.yaml"), 'w', encoding='utf-8') as f:
+                f.write(MANIFEST.format(index=index, value='dG9rZW4='))
+        return directory
+
+    def test_pool_workers_are_not_forked(self):
+        self.assertNotEqual(importer.POOL_START_METHOD, 'fork')
+
+    def test_import_in_process_pool(self):
+        summary = importer.import_manifests(self._write_manifests(importer.POOL_THRESHOLD + 2), workers=2)
+        self.assertEqual(summary['errors'], [])
+        self.assertEqual(summary['secrets'], importer.POOL_THRESHOLD + 2)
+        self.assertEqual(storage.get_secret_value('app-9', 'TOKEN'), 'dG9rZW4=')
+
+    def test_malformed_data_is_reported_per_file(self):
+        directory = self._write_manifests(1)
+        with open(os.path.join(directory, 'bad.yaml'), 'w', encoding='utf-8') as f:
+            f.write('kind: Secret\nmetadata:\n  name: bad\ndata: [1, 2]\n')
+        summary = importer.import_manifests(directory, workers=1)
+        self.assertEqual(summary['secrets'], 1)
+        self.assertEqual(len(summary['errors']), 1)
+        self.assertIn('bad.yaml', summary['errors'][0])
+        self.assertNotIn('bad', storage.get_envs())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import unittest
+
+from support import StoreTestCase
+
+from secrets_manager import crypto, history, rotation, storage
+from secrets_manager.refactor import key_mapper, plan_keys, refactor_keys
+
+
+class PlanKeysTest(unittest.TestCase):
+
+    def test_chained_renames_use_the_old_values(self):
+        # A1 -> AA1 and AA1 -> AAA1 in the same refactor; AA1 is overwritten, not deleted
+        copies, deletes = plan_keys(['A1', 'AA1', 'B1'], 'rename', key_mapper('prefix', 'A', 'AA'))
+        self.assertEqual(copies, {'AA1': 'A1', 'AAA1': 'AA1'})
+        self.assertEqual(deletes, ['A1'])
+
+    def test_conflicting_new_names(self):
+        with self.assertRaises(ValueError):
+            plan_keys(['DB_USER', 'DB_PASS'], 'rename', key_mapper('regex', r'DB_\w+', 'DB'))
+        with self.assertRaises(ValueError):
+            plan_keys(['A'], 'rename', key_mapper('prefix', 'A', ' '))
+
+    def test_invalid_patterns(self):
+        with self.assertRaises(ValueError):
+            key_mapper('regex', '(')
+        with self.assertRaises(ValueError):
+            key_mapper('glob', 'A*')
+        with self.assertRaises(ValueError):
+            key_mapper('prefix', '')
+
+
+class RefactorKeysTest(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        storage.update_env('prod/api', {'A1': 'MQ==', 'AA1': 'Mg==', 'B1': 'Mw=='})
+        storage.update_env('prod/web', {'A1': 'NA=='})
+        storage.update_env('dev', {'A1': 'NQ=='})
+
+    def _values(self, env):
+        return dict(storage.iter_secrets(env))
+
+    def test_chained_rename_is_one_version_per_env(self):
+        summary = refactor_keys('rename', 'prefix', 'A', 'AA', envs=['prod/'])
+        self.assertEqual(summary['errors'], [])
+        self.assertEqual(summary['keys'], 3)
+        self.assertEqual(summary['envs']['prod/api'], {'changes': [['A1', 'AA1'], ['AA1', 'AAA1']], 'overwritten': ['AA1']})
+        self.assertEqual(self._values('prod/api'), {'AA1': 'MQ==', 'B1': 'Mw==', 'AAA1': 'Mg=='})
+        self.assertEqual(self._values('prod/web'), {'AA1': 'NA=='})
+        self.assertEqual(history.current_version('prod/api'), 2)
+        # Envs not selected are left alone
+        self.assertEqual(self._values('dev'), {'A1': 'NQ=='})
+
+    def test_regex_groups(self):
+        refactor_keys('rename', 'regex', r'(A+)(\d)', r'KEY_\2_\1')
+        self.assertEqual(self._values('prod/api'), {'KEY_1_A': 'MQ==', 'KEY_1_AA': 'Mg==', 'B1': 'Mw=='})
+
+    def test_a_conflict_leaves_only_that_env_unchanged(self):
+        summary = refactor_keys('rename', 'regex', r'A+1', 'X')
+        self.assertEqual(len(summary['errors']), 1)
+        self.assertTrue(summary['errors'][0].startswith('prod/api: '))
+        self.assertEqual(self._values('prod/api'), {'A1': 'MQ==', 'AA1': 'Mg==', 'B1': 'Mw=='})
+        self.assertEqual(self._values('dev'), {'X': 'NQ=='})
+
+    def test_dry_run_writes_nothing(self):
+        before = {env: self._values(env) for env in storage.get_envs()}
+        summary = refactor_keys('delete', 'prefix', 'A', dry_run=True)
+        self.assertEqual(summary['keys'], 4)
+        self.assertEqual({env: self._values(env) for env in storage.get_envs()}, before)
+
+    def test_copy_and_delete(self):
+        refactor_keys('copy', 'prefix', 'B', 'C', envs=['prod/api'])
+        self.assertEqual(self._values('prod/api'), {'A1': 'MQ==', 'AA1': 'Mg==', 'B1': 'Mw==', 'C1': 'Mw=='})
+        refactor_keys('delete', 'prefix', 'A', envs=['prod/api'])
+        self.assertEqual(self._values('prod/api'), {'B1': 'Mw==', 'C1': 'Mw=='})
+
+    def test_unknown_envs_are_reported(self):
+        summary = refactor_keys('delete', 'prefix', 'A', envs=['missing', 'nope/'])
+        self.assertEqual(summary['errors'], ['missing: environment not found', 'nope/: environment not found'])
+
+    def test_renamed_keys_keep_their_metadata_and_decrypt(self):
+        os.environ[crypto.MASTER_KEY_VAR] = 'test master secret'
+        storage.update_env('sealed', {'OLD': 'MQ=='})
+        rotation.set_metadata('sealed', 'OLD', owner='team-a')
+        refactor_keys('rename', 'prefix', 'OLD', 'NEW', envs=['sealed'])
+        self.assertEqual(self._values('sealed'), {'NEW': 'MQ=='})
+        self.assertEqual(rotation.get_metadata('sealed')['NEW']['owner'], 'team-a')
+        self.assertNotIn('OLD', rotation.get_metadata('sealed'))
+
+
+if __name__ == '__main__':
+    unittest.main()
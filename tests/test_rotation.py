@@ -0,0 +1,52 @@
+import os
+import time
+import unittest
+
+from support import StoreTestCase
+
+from secrets_manager import rotation, storage
+
+
+class ExpiringSoonTest(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # The heap is per process; start each test from an empty one
+        rotation._heap.clear()
+        rotation._expiries.clear()
+        rotation._loaded.clear()
+        rotation._generation = rotation._UNLOADED
+        storage.update_env('dev', {'A': 'YQ==', 'B': 'Yg=='})
+
+    def _expiring(self):
+        return [(item['env'], item['key']) for item in rotation.expiring_soon()]
+
+    def test_changes_made_in_quick_succession_are_seen(self):
+        tomorrow = time.time() + 24 * 60 * 60
+        for _ in range(20):
+            rotation.set_metadata('dev', 'A', expires=tomorrow)
+            rotation.set_metadata('dev', 'B', expires=None)
+            self.assertEqual(self._expiring(), [('dev', 'A')])
+            rotation.set_metadata('dev', 'A', expires=None)
+            rotation.set_metadata('dev', 'B', expires=tomorrow)
+            self.assertEqual(self._expiring(), [('dev', 'B')])
+
+    def test_change_within_one_timestamp_tick_is_seen(self):
+        rotation.set_metadata('dev', 'A', expires=time.time() + 60)
+        self.assertEqual(self._expiring(), [('dev', 'A')])
+        directory = os.stat(rotation._metadata_dir())
+        rotation.set_metadata('dev', 'A', expires=None)
+        rotation.set_metadata('dev', 'B', expires=time.time() + 60)
+        # As if the directory's mtime hadn't moved on, e.g. on a filesystem with a coarse clock
+        os.utime(rotation._metadata_dir(), ns=(directory.st_atime_ns, directory.st_mtime_ns))
+        self.assertEqual(self._expiring(), [('dev', 'B')])
+
+    def test_deleted_keys_stop_expiring(self):
+        rotation.set_metadata('dev', 'A', expires=time.time() - 1)
+        self.assertEqual(rotation.expiring_soon()[0]['expired'], True)
+        storage.update_env('dev', deletes=['A'])
+        self.assertEqual(self._expiring(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
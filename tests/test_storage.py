@@ -0,0 +1,57 @@
+import io
+import csv
+import random
+import unittest
+
+from support import StoreTestCase
+
+from secrets_manager import storage
+
+# Characters the generated keys and values are made of, weighted towards the ones the
+# CSV has to quote
+ALPHABET = 'ab,"\n\r é' + 'xyz' * 3
+
+
+def _dict_reader_rows(text):
+    return [(row['key'], row['value']) for row in csv.DictReader(io.StringIO(text, newline=''))]
+
+
+class ScanRowsTest(StoreTestCase):
+    """The mmap scan used for key listings and single-value lookups reads files like csv.DictReader."""
+
+    def _assert_scans_like_dict_reader(self, text):
+        self.write_csv('dev', text)
+        expected = _dict_reader_rows(text)
+        self.assertEqual(list(storage.iter_stored('dev')), expected, repr(text))
+        self.assertEqual(storage.get_keys('dev'), [key for key, _ in expected], repr(text))
+        # Lookups return a repeated key's first value
+        for key, value in dict(reversed(expected)).items():
+            self.assertEqual(storage.get_secret_value('dev', key), value, repr(text))
+
+    def test_multiline_quoted_key_and_value(self):
+        self._assert_scans_like_dict_reader('key,value\n"A\nB",x\nC,"1\n2"\n"D\r\n",y\nE,z\n')
+
+    def test_quotes_commas_and_blank_lines(self):
+        self._assert_scans_like_dict_reader('key,value\r\n"a,""b""",c\r\n\r\nd,\r\n,e\r\n')
+
+    def test_round_trip_of_generated_files(self):
+        rng = random.Random(1234)
+
+        def text():
+            return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 6)))
+
+        for _ in range(500):
+            out = io.StringIO(newline='')
+            # As the store writes them, or LF files as written by hand or other tools; a bare
+            # '\r' outside quotes (which no writer here produces) isn't taken for a line end
+            if rng.random() < 0.5:
+                writer = csv.writer(out)
+            else:
+                writer = csv.writer(out, lineterminator='\n', quoting=csv.QUOTE_ALL)
+            writer.writerow(storage.FIELDNAMES)
+            writer.writerows([text() or 'k', text()] for _ in range(rng.randint(0, 6)))
+            self._assert_scans_like_dict_reader(out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()